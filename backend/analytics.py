@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+"""
+analytics.py - Columnar snapshot of POSITIONS for the dashboard stats.
+
+A PositionColumns snapshot keeps, for each stats mode ('manu' / 'all',
+same rule as app._stats_mode), the present positions of that mode as
+parallel typed arrays (array module), one entry per position:
+
+  idpers, idtheme, idstructure      ids (NULL structure = NULL below)
+  label, role                       CODE_STRUCTURE / CODE_CONTRIBUTION
+                                    (codes of LABELS)
+
+plus, per mode, the row numbers of each structure and of each theme.
+The widgets answered here (overview, top/themes, themes_per_person,
+themes_coverage, people_count) are distinct-person counts per key: zip
+of the key and idpers columns, set and Counter do the work in C, without
+any SQLite access at request time.
+
+The snapshot is rebuilt on the first request after a change of
+DB_META.data_version or of the theme index.
+"""
+import threading
+from array import array
+from collections import Counter
+from itertools import compress
+from operator import itemgetter
+
+import label_codes
+from db import cursor, data_version, fetch_all, fetch_one, read_snapshot
+from theme_index import get_theme_index
+
+# Reads the idx_pos_struct_cover index only; NULL read as NULL below
+LOAD_SQL = """
+    SELECT IDPERS, IDTHEME, COALESCE(IDSTRUCTURE, -1), COALESCE(CODE_STRUCTURE, -1),
+           COALESCE(CODE_CONTRIBUTION, -1), COALESCE(CODE_TEMPORALITE, -1), AUTO
+    FROM POSITIONS
+"""
+LABELS_SQL = "SELECT CODE AS code, LABEL AS label FROM LABELS"
+PERSONS_SQL = 'SELECT COUNT(*) AS n FROM PERSONNE'
+
+# Stand-in for NULL in the integer columns (ids and codes are positive)
+NULL = -1
+
+COLUMNS = ("idpers", "idtheme", "idstructure", "label", "role", "temp", "auto")
+TYPECODES = ("q", "q", "q", "q", "q", "q", "b")
+
+# Columns kept per mode (temp and auto are consumed by the masks)
+KEPT = ("idpers", "idtheme", "idstructure", "label", "role")
+
+ROLES = {"experts": label_codes.EXPERT, "contributeurs": label_codes.CONTRIBUTEUR,
+         "utilisateurs": label_codes.UTILISATEUR}
+
+
+def _top(counts, limit=None):
+    """(key, count) pairs by decreasing count, then key; a negative limit
+    keeps them all, like SQLite's LIMIT."""
+    rows = sorted(counts.items(), key=lambda kv: (-kv[1], kv[0]))
+    return rows if limit is None or limit < 0 else rows[:limit]
+
+
+def _take(col, rows):
+    """Values of `col` at the row numbers `rows`, as a tuple."""
+    if not rows:
+        return ()
+    return (col[rows[0]],) if len(rows) == 1 else itemgetter(*rows)(col)
+
+
+def _row_index(col):
+    """{value: array of the row numbers holding it} of a column."""
+    out = {}
+    for i, v in enumerate(col):
+        out.setdefault(v, array("l")).append(i)
+    return out
+
+
+class PositionColumns:
+    """Immutable snapshot of POSITIONS; build with PositionColumns(rows of
+    LOAD_SQL as tuples, ThemeIndex, number of persons, version, {code: label})."""
+
+    def __init__(self, rows, themes, n_persons=0, version=None, labels=None):
+        self.version = version
+        self.themes = themes
+        self.n_persons = n_persons
+        self.labels = labels or {}
+        cols = list(zip(*rows)) or [()] * len(COLUMNS)
+        self.n_rows = len(rows)
+
+        present = bytes(map(label_codes.PRESENT.__eq__, cols[COLUMNS.index("temp")]))
+        manual = bytes(map(int.__and__, present,
+                           map((0).__eq__, cols[COLUMNS.index("auto")])))
+        # mode -> {column: array} over the present positions of the mode
+        self.modes = {}
+        for mode, mask in (("all", present), ("manu", manual)):
+            self.modes[mode] = {
+                name: array(TYPECODES[COLUMNS.index(name)], compress(cols[COLUMNS.index(name)], mask))
+                for name in KEPT}
+        # mode -> {column: {id: row numbers}} for the people_count filters
+        self.index = {mode: {key: _row_index(c[key]) for key in ("idstructure", "idtheme")}
+                      for mode, c in self.modes.items()}
+        self._memo = {}
+
+    def __len__(self):
+        return self.n_rows
+
+    # ── Kernels ─────────────────────────────────────────────────────
+    def _pairs(self, key, mode):
+        """Distinct (key, person) pairs of the rows of `mode`, memoized per
+        key column."""
+        memo_key = (key, mode)
+        pairs = self._memo.get(memo_key)
+        if pairs is None:
+            c = self.modes[mode]
+            pairs = self._memo[memo_key] = frozenset(zip(c[key], c["idpers"]))
+        return pairs
+
+    def _distinct(self, key, mode):
+        """{key: number of distinct persons} over the rows of `mode`."""
+        memo_key = ("count", key, mode)
+        counts = self._memo.get(memo_key)
+        if counts is None:
+            counts = self._memo[memo_key] = Counter(k for k, _ in self._pairs(key, mode))
+        return counts
+
+    def _per_person(self, mode):
+        """{person: number of distinct themes} over the rows of `mode`."""
+        memo_key = ("per_person", mode)
+        counts = self._memo.get(memo_key)
+        if counts is None:
+            counts = self._memo[memo_key] = Counter(p for _, p in self._pairs("idtheme", mode))
+        return counts
+
+    def _theme_rows(self, counts, limit):
+        """{id, label, cnt} of the themes of THEMES in `counts`, top first."""
+        counts = {tid: cnt for tid, cnt in counts.items() if tid in self.themes}
+        return [{"id": tid, "label": self.themes.label(tid), "cnt": cnt}
+                for tid, cnt in _top(counts, limit)]
+
+    # ── Widgets ─────────────────────────────────────────────────────
+    def overview(self, mode):
+        per_person = self._per_person(mode)
+        people = len(per_person)
+        structures = self._distinct("idstructure", mode)
+        return {
+            "people_present": people,
+            "non_positionnes": self.n_persons - people,
+            "themes_active": len(self._distinct("idtheme", mode)),
+            "structures_active": len(structures) - (NULL in structures),
+            "themes_per_person": round(sum(per_person.values()) / people, 2) if people else None,
+        }
+
+    def top_themes(self, mode, limit):
+        return self._theme_rows(self._distinct("idtheme", mode), limit)
+
+    def themes_per_person(self, mode):
+        buckets = Counter(self._per_person(mode).values())
+        return [{"bucket": b, "people": n} for b, n in sorted(buckets.items())]
+
+    def themes_coverage(self, mode):
+        """Level-1 themes with their distinct persons, in total and per role."""
+        c = self.modes[mode]
+        by_role = Counter((t, r) for t, r, _ in frozenset(zip(c["idtheme"], c["role"], c["idpers"])))
+        t = self.themes
+        rows = []
+        for tid, total in self._distinct("idtheme", mode).items():
+            i = t.pos.get(tid)
+            if i is None or t.niveau[i] != 1:
+                continue
+            row = {"id": tid, "label": t.labels[i]}
+            for key, code in ROLES.items():
+                row[key] = by_role.get((tid, code), 0)
+            row["total"] = total
+            rows.append(row)
+        rows.sort(key=lambda r: (-r["total"], r["id"]))
+        return rows
+
+    def people_count(self, mode, structure=None, theme=None, limit=15):
+        """people_count endpoint: a count for a structure and a theme, the
+        themes of a structure or the structures of a theme."""
+        c, index = self.modes[mode], self.index[mode]
+        if structure is not None:
+            rows = index["idstructure"].get(structure, ())
+            if theme is not None:
+                themes = _take(c["idtheme"], rows)
+                return {"count": len({p for t, p in zip(themes, _take(c["idpers"], rows)) if t == theme})}
+            pairs = set(zip(_take(c["idtheme"], rows), _take(c["idpers"], rows)))
+            return {"by": "theme", "rows": self._theme_rows(Counter(t for t, _ in pairs), limit)}
+        rows = index["idtheme"].get(theme, ())
+        triples = set(zip(_take(c["idstructure"], rows), _take(c["label"], rows), _take(c["idpers"], rows)))
+        counts = Counter((sid, code) for sid, code, _ in triples if sid != NULL)
+        return {"by": "structure", "rows": [
+            {"id": sid, "label": self.labels.get(code) or str(sid), "cnt": cnt}
+            for (sid, code), cnt in _top(counts, limit)]}
+
+    def stats(self):
+        return {"rows": len(self), "persons": self.n_persons,
+                "bytes": sum(col.itemsize * len(col)
+                             for c in self.modes.values() for col in c.values())}
+
+
+_lock = threading.Lock()
+_columns = None
+
+
+def _load(themes):
+    """PositionColumns of the current data, version and rows read in one
+    snapshot."""
+    with read_snapshot():
+        version = data_version()
+        with cursor() as cur:
+            rows = cur.execute(LOAD_SQL).fetchall()
+        n_persons = fetch_one(PERSONS_SQL, {})["n"]
+        labels = {r["code"]: r["label"] for r in fetch_all(LABELS_SQL, {})}
+    return PositionColumns(rows, themes, n_persons, version, labels)
+
+
+def get_columns():
+    """Process-wide PositionColumns, rebuilt if the data or THEMES changed.
+
+    Built outside _lock and swapped in, as bitmap_index.get_bitmaps().
+    """
+    global _columns
+    version = data_version()
+    themes = get_theme_index()
+    pc = _columns
+    if pc is not None and pc.version == version and pc.themes is themes:
+        return pc
+    pc = _load(themes)
+    with _lock:
+        if _columns is None or _columns.version <= pc.version:
+            _columns = pc
+    return pc
+
+
+def stats():
+    pc = _columns
+    if pc is None:
+        return {"loaded": False}
+    return {"loaded": True, "data_version": pc.version, **pc.stats()}
@@ -1,8 +1,20 @@
 
-from flask import Flask, jsonify, request, send_from_directory, abort
+from flask import Flask, Response, jsonify, request, send_from_directory, abort, stream_with_context
+from werkzeug.exceptions import HTTPException
 from flask_cors import CORS
-import os, datetime, jwt
-from db import fetch_all, fetch_one, execute
+import os, base64, datetime, gzip, hashlib, json, jwt, re, threading
+from collections import OrderedDict
+from db import (fetch_all, fetch_one, cursor, transaction, pool_stats, data_version,
+                bump_data_version, read_snapshot)
+import db
+import analytics
+import autocomplete
+import bitmap_index
+import label_codes
+import propagation
+import search_index
+import stats_tables
+from theme_index import get_theme_index
 import secrets
 from functools import wraps
 
@@ -73,9 +85,120 @@ def require_admin(fn):
     return wrapper
 
 
+# --------- STATS RESPONSE CACHE ---------
+# /api/stats/* payloads (and /api/themes/tree) only change when positions
+# or themes are written, so they are cached per (path, normalized args,
+# role) and tagged with DB_META.data_version.  Each entry keeps the JSON
+# and its gzip, compressed once, sent to clients accepting gzip.  The ETag
+# is derived from the same key and the encoding, so a client revalidating
+# an unchanged dashboard or tree gets a 304 without any query other than
+# the data_version lookup.
+STATS_CACHE_SIZE = int(os.getenv('CSR_STATS_CACHE_SIZE', '256'))
+GZIP_LEVEL = 6
+
+
+class ResponseCache:
+    """Thread-safe LRU of serialized responses, valid for one data version."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max(1, max_entries)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._metrics = {"hits": 0, "misses": 0, "not_modified": 0, "evictions": 0}
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                self._metrics["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._metrics["hits"] += 1
+            return entry[1:]
+
+    def put(self, key, version, body, mimetype, gzipped):
+        with self._lock:
+            self._entries[key] = (version, body, mimetype, gzipped)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._metrics["evictions"] += 1
+
+    def count_not_modified(self):
+        with self._lock:
+            self._metrics["not_modified"] += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self._metrics, size=len(self._entries), max_entries=self.max_entries)
+
+
+_stats_cache = ResponseCache(STATS_CACHE_SIZE)
+
+
+def _cache_key():
+    args = tuple(sorted(
+        (k, v.strip().lower() if k == 'mode' else v.strip())
+        for k, v in request.args.items(multi=True)
+    ))
+    return (request.path, args, getattr(request, 'role', 'admin'))
+
+
+def cached_response(version_of):
+    """Decorator (after @require_auth): serve GET responses from _stats_cache
+    for the version returned by `version_of()`, gzipped if the client
+    accepts it, with a strong ETag per encoding, answering 304 when
+    If-None-Match still matches."""
+    def decorate(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            version = version_of()
+            key = _cache_key()
+            use_gzip = request.accept_encodings['gzip'] > 0
+            etag = hashlib.sha1(repr((version, key, use_gzip)).encode('utf-8')).hexdigest()
+
+            if etag in request.if_none_match:
+                _stats_cache.count_not_modified()
+                resp = Response(status=304)
+            else:
+                cached = _stats_cache.get(key, version)
+                if cached is None:
+                    resp = app.make_response(fn(*args, **kwargs))
+                    if resp.status_code != 200:
+                        return resp
+                    body = resp.get_data()
+                    cached = (body, resp.mimetype, gzip.compress(body, GZIP_LEVEL))
+                    _stats_cache.put(key, version, *cached)
+                body, mimetype, gzipped = cached
+                resp = Response(gzipped if use_gzip else body, mimetype=mimetype)
+                if use_gzip:
+                    resp.headers['Content-Encoding'] = 'gzip'
+            resp.set_etag(etag)
+            resp.headers['Cache-Control'] = 'private, no-cache'
+            resp.vary.update(('Authorization', 'Accept-Encoding'))
+            return resp
+        return wrapper
+    return decorate
+
+
+cached_by_data_version = cached_response(data_version)
+
+
+@app.before_request
+def require_db_ready():
+    """503 on the API while the database is (re)built from scratch."""
+    if request.path.startswith('/api/') and request.path != '/api/health' and not db.ready():
+        abort(503, description="Base de données en cours de construction")
+
+
 @app.get("/api/health")
 def health():
-    return jsonify({"status": "ok", "time": datetime.datetime.utcnow().isoformat() + "Z"})
+    db_status = db.status()
+    return jsonify({"status": "ok" if db_status["ready"] else "starting",
+                    "time": datetime.datetime.utcnow().isoformat() + "Z",
+                    "db": db_status, "db_pool": pool_stats(), "stats_cache": _stats_cache.stats(),
+                    "compiled_queries": _compiled.stats(), "autocomplete": autocomplete.stats(),
+                    "bitmaps": bitmap_index.stats(), "analytics": analytics.stats()})
 
 @app.post("/api/login")
 def login():
@@ -102,38 +225,39 @@ def login():
 
 
 # --------- THEMES ---------
+def _tree_version():
+    """The plain tree only changes with THEMES, the counts with any write."""
+    if _as_bool(request.args.get("counts", "0")):
+        return data_version()
+    return get_theme_index().version
+
+
 @app.get("/api/themes/tree")
 @require_auth
+@cached_response(_tree_version)
 def themes_tree():
-    sql = """
-        WITH RECURSIVE theme_tree AS (
-            SELECT
-                t."CS_TH_COD#" AS id,
-                t.THEME        AS label,
-                t.THEME_PARENT AS parent_id,
-                t.NIVEAU       AS lvl,
-                0 AS depth
-            FROM THEMES t
-            WHERE t.THEME_PARENT IS NULL
-            UNION ALL
-            SELECT
-                t2."CS_TH_COD#",
-                t2.THEME,
-                t2.THEME_PARENT,
-                t2.NIVEAU,
-                tt.depth + 1
-            FROM THEMES t2
-            JOIN theme_tree tt ON t2.THEME_PARENT = tt.id
-        )
-        SELECT id, label, parent_id, lvl
-        FROM theme_tree
-        ORDER BY label
-        """
-
-    rows = fetch_all(sql, {})
+    """Every theme with its parent and level, from the ThemeIndex.  With
+    ?counts=1, each node also gets its distinct persons, in total and per
+    role, on the theme itself ("direct") and on its whole subtree
+    ("subtree"), for ?temporalite= (Présent by default, * for any) and
+    ?mode= (manu by default, auto, all), read from the bitsets of
+    bitmap_index.py."""
+    rows = get_theme_index().tree_rows()
+    if _as_bool(request.args.get("counts", "0")):
+        bm = bitmap_index.get_bitmaps()
+        mode = CUBE_MODES.get((request.args.get("mode") or "manu").lower(), "MANU")
+        facets = bm.facets("*", _star(request.args.get("temporalite", "Présent")), mode)
+        counts = bm.tree_counts(facets, analytics.ROLES)
+        zero = {"total": 0, **dict.fromkeys(analytics.ROLES, 0)}
+        for r in rows:
+            r["direct"], r["subtree"] = counts.get(r["id"], (zero, zero))
     return jsonify(rows)
 
 # --------- PEOPLE SEARCH ---------
+# One row per position: ROWID_POS (selected for paged requests only)
+# completes the order
+PEOPLE_SEARCH_KEYSET = ("NOM", "PRENOM", "ROWID_POS")
+
 @app.post("/api/people/search")
 @require_auth
 def people_search():
@@ -146,33 +270,15 @@ def people_search():
     struct_id    = body.get('structure_id')
 
     if not ids:
-        return jsonify([])
+        return _rows_response(NO_ROWS_SQL, {}, body, PEOPLE_SEARCH_KEYSET)
 
-    # Build ID placeholders
-    ids_placeholders = ", ".join(f":id{i}" for i in range(1, len(ids) + 1))
     binds = {
-        'include_desc': include_desc,
         'p_role': role,
         'p_temp': temp,
         'p_mode': mode,
         'struct_id': struct_id
     }
-    for i, v in enumerate(ids, start=1):
-        binds[f"id{i}"] = int(v)
-
-    if include_desc:
-        theme_filter = f"""
-            p.IDTHEME IN (
-                WITH RECURSIVE descendants AS (
-                    SELECT "CS_TH_COD#" AS tid FROM THEMES WHERE "CS_TH_COD#" IN ({ids_placeholders})
-                    UNION ALL
-                    SELECT t."CS_TH_COD#" FROM THEMES t JOIN descendants d ON t.THEME_PARENT = d.tid
-                )
-                SELECT tid FROM descendants
-            )
-        """
-    else:
-        theme_filter = f"p.IDTHEME IN ({ids_placeholders})"
+    theme_filter = "p.IDTHEME " + _themes_set_sql("theme_set", ids, binds, include_desc)
 
     sql = f"""
     SELECT
@@ -181,104 +287,131 @@ def people_search():
       per.PE_PE_PRENOM  AS PRENOM,
       t.THEME           AS THEME,
       p.IDTHEME,
-      p.LIBCONTRIBUTION,
-      p.LIBELLETEMPORALITE,
-      p.AUTO_GENERE,
+      lc.LABEL AS LIBCONTRIBUTION,
+      lt.LABEL AS LIBELLETEMPORALITE,
+      CASE WHEN p.AUTO = 1 THEN 'O' END AS AUTO_GENERE,
       p.IDSTRUCTURE,
       COALESCE(s.acronyme, CAST(p.IDSTRUCTURE AS TEXT)) AS STRUCTURE_ACRONYME
-    FROM POSITIONNEMENT p
+      {", p.ROWID_POS" if body.get('limit') is not None else ""}
+    FROM POSITIONS p
     JOIN PERSONNE per  ON per."PE_PE_COD#" = p.IDPERS
     JOIN THEMES t      ON t."CS_TH_COD#"  = p.IDTHEME
     LEFT JOIN STRUCTURES s ON s.id = p.IDSTRUCTURE
+    LEFT JOIN LABELS lc ON lc.CODE = p.CODE_CONTRIBUTION
+    LEFT JOIN LABELS lt ON lt.CODE = p.CODE_TEMPORALITE
     WHERE {theme_filter}
-      AND (:p_role = '*' OR p.LIBCONTRIBUTION = :p_role)
-      AND (:p_temp = '*' OR p.LIBELLETEMPORALITE = :p_temp)
+      AND (:p_role = '*' OR p.CODE_CONTRIBUTION = {label_codes.code_sql(':p_role')})
+      AND (:p_temp = '*' OR p.CODE_TEMPORALITE = {label_codes.code_sql(':p_temp')})
       AND (
            :p_mode = '*' OR
-           (:p_mode = 'AUTO' AND p.AUTO_GENERE = 'O') OR
-           (:p_mode = 'MANU' AND (p.AUTO_GENERE IS NULL OR p.AUTO_GENERE <> 'O'))
+           (:p_mode = 'AUTO' AND p.AUTO = 1) OR
+           (:p_mode = 'MANU' AND p.AUTO = 0)
       )
       AND (:struct_id IS NULL OR p.IDSTRUCTURE = :struct_id)
     ORDER BY per.PE_PE_NOM, per.PE_PE_PRENOM
     """
-    rows = fetch_all(sql, binds)
-
     # Viewer: return count only, no nominative data
     if getattr(request, 'role', 'admin') == 'viewer':
-        return jsonify([{"total_personnes": len(set(r['idpers'] for r in rows))}])
+        return jsonify([{"total_personnes": _count(sql, binds, 'IDPERS')}])
 
-    return jsonify(rows)
+    return _rows_response(sql, binds, body, PEOPLE_SEARCH_KEYSET)
 
 # --------- NON POSITIONNES (global) ---------
 @app.get("/api/stats/non_positionnes")
 @require_auth
+@cached_by_data_version
 def non_positionnes():
-    sql = """
+    sql = f"""
       SELECT per."PE_PE_COD#" AS IDPERS,
              per.PE_PE_NOM  AS NOM,
              per.PE_PE_PRENOM AS PRENOM
       FROM PERSONNE per
       WHERE NOT EXISTS (
-        SELECT 1 FROM POSITIONNEMENT p
+        SELECT 1 FROM POSITIONS p
         WHERE p.IDPERS = per."PE_PE_COD#"
-          AND p.LIBELLETEMPORALITE = 'Présent'
+          AND p.CODE_TEMPORALITE = {label_codes.PRESENT}
       )
       ORDER BY per.PE_PE_NOM, per.PE_PE_PRENOM
     """
-    rows = fetch_all(sql, {})
-
     # Viewer: return count only, no names
     if getattr(request, 'role', 'admin') == 'viewer':
-        return jsonify(dict(total=len(rows), people=[]))
+        return jsonify(dict(total=_count(sql, {}), people=[]))
 
+    rows = fetch_all(sql, {})
     return jsonify(dict(total=len(rows), people=rows))
 
 # --------- POSITION MANAGEMENT ---------
-@app.post("/api/positions")
-@require_auth
-def add_position():
-    body = request.get_json(force=True, silent=True) or {}
-    required = ['idpers', 'idtheme', 'libcontr', 'libtemp']
-    if any(k not in body for k in required):
-        abort(400, "champs manquants")
-
-    # Get theme label
-    theme_row = fetch_one('SELECT THEME FROM THEMES WHERE "CS_TH_COD#" = :tid', {"tid": int(body['idtheme'])})
-    theme_label = theme_row['theme'] if theme_row else None
-
-    binds = {
+ROLE_IDS = {'Expert': 1, 'Contributeur': 2, 'Utilisateur': 3}
+POSITION_FIELDS = ['idpers', 'idtheme', 'libcontr', 'libtemp']
+POSITIONS_BULK_MAX = int(os.getenv('CSR_POSITIONS_BULK_MAX', '5000'))
+
+# Both return the written manual rows for propagation.add_sources /
+# remove_sources.  Labels are stored as LABELS codes (_add_labels first).
+INSERT_POSITION_SQL = """
+  INSERT INTO POSITIONS (
+    IDPERS, IDCONTRIBUTION, CODE_CONTRIBUTION, IDTEMPORALITE, CODE_TEMPORALITE,
+    IDTHEME, IDSTRUCTURE, CODE_STRUCTURE,
+    IDTYPESTRUCTURE, CODE_TYPESTRUCTURE, AUTO
+  ) VALUES (
+    :idpers,
+    :idcontr, {libcontr},
+    :idtemp,  {libtemp},
+    :idtheme,
+    :idstruct, {libstruct},
+    :idtypestruct, {libtypestruct},
+    0
+  )
+  RETURNING {carried}, IDTHEME
+""".format(carried=propagation.CARRIED_SQL,
+           **{k: label_codes.code_sql(':' + k) for k in ('libcontr', 'libtemp', 'libstruct', 'libtypestruct')})
+
+DELETE_POSITION_SQL = """
+  DELETE FROM POSITIONS
+  WHERE IDPERS = :idpers
+    AND IDTHEME = :idtheme
+    AND CODE_CONTRIBUTION = {libcontr}
+    AND CODE_TEMPORALITE = {libtemp}
+    AND AUTO = 0
+  RETURNING {carried}, IDTHEME
+""".format(carried=propagation.CARRIED_SQL,
+           libcontr=label_codes.code_sql(':libcontr'), libtemp=label_codes.code_sql(':libtemp'))
+
+
+def _add_labels(cur, binds):
+    """Give a LABELS code to the labels of a position about to be inserted."""
+    label_codes.add(cur, [binds[k] for k in ('libcontr', 'libtemp', 'libstruct', 'libtypestruct')])
+
+
+def _position_binds(body):
+    return {
       'idpers': int(body['idpers']),
-      'idcontr': {'Expert':1,'Contributeur':2,'Utilisateur':3}.get(body['libcontr'],2),
+      'idcontr': ROLE_IDS.get(body['libcontr'], 2),
       'libcontr': body['libcontr'],
       'idtemp': 1 if body['libtemp']=='Présent' else 2,
       'libtemp': body['libtemp'],
       'idtheme': int(body['idtheme']),
-      'libtheme': theme_label,
       'idstruct': body.get('idstruct'),
       'libstruct': body.get('libstruct'),
       'idtypestruct': body.get('idtypestruct'),
       'libtypestruct': body.get('libtypestruct')
     }
 
-    sql = """
-      INSERT INTO POSITIONNEMENT (
-        IDPERS, IDCONTRIBUTION, LIBCONTRIBUTION, IDTEMPORALITE, LIBELLETEMPORALITE,
-        IDTHEME, LIBELLETHEME, IDSTRUCTURE, LIBELLESTRUCTURE,
-        IDTYPESTRUCTURE, LIBELLETYPESTRUCTURE, AUTO_GENERE
-      ) VALUES (
-        :idpers,
-        :idcontr, :libcontr,
-        :idtemp,  :libtemp,
-        :idtheme, :libtheme,
-        :idstruct, :libstruct,
-        :idtypestruct, :libtypestruct,
-        NULL
-      )
-    """
-    execute(sql, binds)
 
-    # Propagate to parent themes (like Oracle trigger TRG_POS_PARENT)
-    _propagate_for_person(binds['idpers'], binds['idcontr'], int(body['idtheme']), binds.get('idstruct'))
+@app.post("/api/positions")
+@require_auth
+def add_position():
+    body = request.get_json(force=True, silent=True) or {}
+    if any(k not in body for k in POSITION_FIELDS):
+        abort(400, "champs manquants")
+
+    # One unit of work: labels, insert, propagation, stats, one commit
+    with transaction() as cur:
+        binds = _position_binds(body)
+        _add_labels(cur, binds)
+        rows = cur.execute(INSERT_POSITION_SQL, binds).fetchall()
+        # Propagate to parent themes (like Oracle trigger TRG_POS_PARENT)
+        propagation.add_sources(cur, rows)
+        _positions_changed([binds['idpers']])
 
     return jsonify(ok=True)
 
@@ -286,135 +419,122 @@ def add_position():
 @require_auth
 def delete_position():
     body = request.get_json(force=True, silent=True) or {}
-    required = ['idpers', 'idtheme', 'libcontr', 'libtemp']
-    if any(k not in body for k in required):
+    if any(k not in body for k in POSITION_FIELDS):
         abort(400, "champs manquants")
 
-    binds = {
-        'idpers': int(body['idpers']),
-        'idtheme': int(body['idtheme']),
-        'libcontr': body['libcontr'],
-        'libtemp': body['libtemp'],
-    }
-
-    # Delete the manual position
-    sql = """
-      DELETE FROM POSITIONNEMENT
-      WHERE IDPERS = :idpers
-        AND IDTHEME = :idtheme
-        AND LIBCONTRIBUTION = :libcontr
-        AND LIBELLETEMPORALITE = :libtemp
-        AND (AUTO_GENERE IS NULL OR AUTO_GENERE <> 'O')
-    """
-    execute(sql, binds)
-    # Also clean up auto-propagated entries that no longer have a source
-    _cleanup_orphan_auto(int(body['idpers']))
+    binds = _position_binds(body)
+    with transaction() as cur:
+        # Delete the manual position
+        rows = cur.execute(DELETE_POSITION_SQL, binds).fetchall()
+        # Decrement the ancestors' source counts, auto entries left
+        # without a source go away
+        propagation.remove_sources(cur, rows)
+        _positions_changed([binds['idpers']])
     return jsonify(ok=True)
 
 
-def _propagate_for_person(idpers, idcontrib, idtheme, idstruct):
-    """Propagate a single manual position to all parent themes.
-
-    Mirrors the Oracle procedure PROPAGER_POSITIONNEMENT_PARENT.
-    Walks up the theme hierarchy and creates AUTO_GENERE='O' entries.
-    """
-    sql = """
-        INSERT INTO POSITIONNEMENT (
-            IDPERS, IDCONTRIBUTION, LIBCONTRIBUTION,
-            IDTEMPORALITE, LIBELLETEMPORALITE,
-            IDTHEME, LIBELLETHEME,
-            IDSTRUCTURE, LIBELLESTRUCTURE,
-            IDTYPESTRUCTURE, LIBELLETYPESTRUCTURE,
-            IDSTRUCTUREPARENTE, LIBELLESTRUCTUREPARENTE,
-            AUTO_GENERE
-        )
-        WITH RECURSIVE anc AS (
-            SELECT
-                p.IDPERS, p.IDCONTRIBUTION, p.LIBCONTRIBUTION,
-                p.IDTEMPORALITE, p.LIBELLETEMPORALITE,
-                tp."CS_TH_COD#" AS IDTHEME, tp.THEME AS LIBELLETHEME,
-                p.IDSTRUCTURE, p.LIBELLESTRUCTURE,
-                p.IDTYPESTRUCTURE, p.LIBELLETYPESTRUCTURE,
-                p.IDSTRUCTUREPARENTE, p.LIBELLESTRUCTUREPARENTE
-            FROM POSITIONNEMENT p
-            JOIN THEMES tc ON tc."CS_TH_COD#" = p.IDTHEME
-            JOIN THEMES tp ON tp."CS_TH_COD#" = tc.THEME_PARENT
-            WHERE p.IDPERS = :idpers
-              AND p.IDCONTRIBUTION = :idcontrib
-              AND p.IDTHEME = :idtheme
-              AND COALESCE(p.IDSTRUCTURE, -1) = COALESCE(:idstruct, -1)
-              AND p.AUTO_GENERE IS NULL
-              AND tc.THEME_PARENT IS NOT NULL
-            UNION
-            SELECT
-                a.IDPERS, a.IDCONTRIBUTION, a.LIBCONTRIBUTION,
-                a.IDTEMPORALITE, a.LIBELLETEMPORALITE,
-                gp."CS_TH_COD#", gp.THEME,
-                a.IDSTRUCTURE, a.LIBELLESTRUCTURE,
-                a.IDTYPESTRUCTURE, a.LIBELLETYPESTRUCTURE,
-                a.IDSTRUCTUREPARENTE, a.LIBELLESTRUCTUREPARENTE
-            FROM anc a
-            JOIN THEMES t ON t."CS_TH_COD#" = a.IDTHEME
-            JOIN THEMES gp ON gp."CS_TH_COD#" = t.THEME_PARENT
-            WHERE t.THEME_PARENT IS NOT NULL
-        )
-        SELECT DISTINCT
-            a.IDPERS, a.IDCONTRIBUTION, a.LIBCONTRIBUTION,
-            a.IDTEMPORALITE, a.LIBELLETEMPORALITE,
-            a.IDTHEME, a.LIBELLETHEME,
-            a.IDSTRUCTURE, a.LIBELLESTRUCTURE,
-            a.IDTYPESTRUCTURE, a.LIBELLETYPESTRUCTURE,
-            a.IDSTRUCTUREPARENTE, a.LIBELLESTRUCTUREPARENTE,
-            'O' AS AUTO_GENERE
-        FROM anc a
-        WHERE NOT EXISTS (
-            SELECT 1 FROM POSITIONNEMENT p2
-            WHERE p2.IDPERS = a.IDPERS
-              AND p2.IDCONTRIBUTION = a.IDCONTRIBUTION
-              AND p2.IDTHEME = a.IDTHEME
-              AND COALESCE(p2.IDSTRUCTURE, -1) = COALESCE(a.IDSTRUCTURE, -1)
-        )
-    """
-    execute(sql, {'idpers': idpers, 'idcontrib': idcontrib,
-                  'idtheme': idtheme, 'idstruct': idstruct})
-
+_persons_lock = threading.Lock()
+_persons = {"version": None, "ids": frozenset()}
+
+
+def _person_ids():
+    """PERSONNE ids, reloaded when DB_META.data_version changes."""
+    version = data_version()
+    if _persons["version"] != version:
+        with _persons_lock:
+            if _persons["version"] != version:
+                ids = frozenset(r["id"] for r in fetch_all('SELECT "PE_PE_COD#" AS id FROM PERSONNE', {}))
+                _persons.update(version=version, ids=ids)
+    return _persons["ids"]
+
+
+def _bulk_item_error(item, themes, persons):
+    """Validation message for one bulk operation, None if it is valid."""
+    if not isinstance(item, dict):
+        return "opération invalide"
+    if item.get('op') not in ('add', 'delete'):
+        return "op doit valoir 'add' ou 'delete'"
+    if any(k not in item for k in POSITION_FIELDS):
+        return "champs manquants"
+    try:
+        idpers, idtheme = int(item['idpers']), int(item['idtheme'])
+    except (TypeError, ValueError):
+        return "idpers et idtheme doivent être des entiers"
+    if idpers not in persons:
+        return f"personne {idpers} inconnue"
+    if idtheme not in themes:
+        return f"thème {idtheme} inconnu"
+    return None
+
+
+@app.post("/api/positions/bulk")
+@require_auth
+@require_admin
+def bulk_positions():
+    """Apply many add/delete operations in one transaction.
 
-def _cleanup_orphan_auto(idpers):
-    """Remove auto-propagated entries for a person that no longer have
-    a manual source in any child theme."""
-    sql = """
-        DELETE FROM POSITIONNEMENT
-        WHERE IDPERS = :idpers
-          AND AUTO_GENERE = 'O'
-          AND NOT EXISTS (
-            -- keep only if there's still a manual position on a descendant
-            WITH RECURSIVE descs AS (
-                SELECT "CS_TH_COD#" AS tid FROM THEMES
-                WHERE THEME_PARENT = POSITIONNEMENT.IDTHEME
-                UNION ALL
-                SELECT t."CS_TH_COD#" FROM THEMES t
-                JOIN descs d ON t.THEME_PARENT = d.tid
-            )
-            SELECT 1 FROM POSITIONNEMENT p2
-            JOIN descs ON descs.tid = p2.IDTHEME
-            WHERE p2.IDPERS = :idpers
-              AND p2.AUTO_GENERE IS NULL
-          )
+    Body: {"operations": [{"op": "add"|"delete", idpers, idtheme, libcontr,
+    libtemp, idstruct?, ...}, ...]}.  Invalid items are reported and
+    skipped; the valid ones are written together, then propagation and
+    the STATS_* refresh run once for all affected persons.
     """
-    execute(sql, {'idpers': idpers})
+    body = request.get_json(force=True, silent=True) or {}
+    if not isinstance(body, dict):
+        abort(400, "le corps doit être un objet JSON")
+    items = body.get('operations')
+    if not isinstance(items, list):
+        abort(400, "operations doit être une liste")
+    if len(items) > POSITIONS_BULK_MAX:
+        abort(413, f"au plus {POSITIONS_BULK_MAX} opérations par requête")
+
+    themes = get_theme_index()
+    persons = _person_ids()
+    results = []
+    affected = set()
+    with transaction() as cur:
+        for i, item in enumerate(items):
+            error = _bulk_item_error(item, themes, persons)
+            if error:
+                results.append({"index": i, "ok": False, "error": error})
+                continue
+            binds = _position_binds(item)
+            if item['op'] == 'add':
+                _add_labels(cur, binds)
+                rows = cur.execute(INSERT_POSITION_SQL, binds).fetchall()
+            else:
+                rows = cur.execute(DELETE_POSITION_SQL, binds).fetchall()
+            affected.add(binds['idpers'])
+            results.append({"index": i, "ok": True, "op": item['op'], "rows": len(rows)})
+        if affected:
+            propagation.propagate(cur, affected)
+            stats_tables.refresh_persons(cur, affected)
+            bump_data_version(cur)
+
+    applied = sum(1 for r in results if r["ok"])
+    return jsonify(applied=applied, failed=len(results) - applied, results=results)
+
+
+def _positions_changed(person_ids):
+    """Apply a positions change of `person_ids` to the STATS_* aggregates
+    and bump DB_META.data_version (invalidates the stats response cache).
+    Called inside the writer's transaction()."""
+    with cursor() as cur:
+        stats_tables.refresh_persons(cur, person_ids)
+        bump_data_version(cur)
 
 
 # --------- PROPAGATION STATS ---------
 @app.get("/api/stats/propagation")
 @require_auth
+@cached_by_data_version
 def propagation_stats():
     """Return auto vs manual breakdown for the dashboard."""
     summary = fetch_all("""
         SELECT
             COUNT(*) AS total,
-            SUM(CASE WHEN AUTO_GENERE IS NULL THEN 1 ELSE 0 END) AS manual,
-            SUM(CASE WHEN AUTO_GENERE = 'O' THEN 1 ELSE 0 END)  AS auto
-        FROM POSITIONNEMENT
+            SUM(CASE WHEN AUTO = 0 THEN 1 ELSE 0 END) AS manual,
+            SUM(AUTO) AS auto
+        FROM POSITIONS
     """, {})
 
     # Top themes by auto-generated count
@@ -422,14 +542,14 @@ def propagation_stats():
         SELECT
             t.THEME AS theme,
             p.IDTHEME AS id_theme,
-            SUM(CASE WHEN p.AUTO_GENERE IS NULL THEN 1 ELSE 0 END) AS manual,
-            SUM(CASE WHEN p.AUTO_GENERE = 'O'    THEN 1 ELSE 0 END) AS auto,
+            SUM(CASE WHEN p.AUTO = 0 THEN 1 ELSE 0 END) AS manual,
+            SUM(p.AUTO) AS auto,
             COUNT(DISTINCT p.IDPERS) AS people
-        FROM POSITIONNEMENT p
+        FROM POSITIONS p
         JOIN THEMES t ON t."CS_TH_COD#" = p.IDTHEME
         GROUP BY p.IDTHEME, t.THEME
-        HAVING auto > 0
-        ORDER BY auto DESC
+        HAVING SUM(p.AUTO) > 0
+        ORDER BY SUM(p.AUTO) DESC
         LIMIT 20
     """, {})
 
@@ -437,14 +557,17 @@ def propagation_stats():
     sample = fetch_all("""
         SELECT
             per.PE_PE_NOM || ' ' || per.PE_PE_PRENOM AS personne,
-            p.LIBELLETHEME AS theme,
-            p.LIBCONTRIBUTION AS role,
-            p.LIBELLETEMPORALITE AS temporalite,
-            p.AUTO_GENERE AS mode
-        FROM POSITIONNEMENT p
+            t.THEME AS theme,
+            lc.LABEL AS role,
+            lt.LABEL AS temporalite,
+            'O' AS mode
+        FROM POSITIONS p
         JOIN PERSONNE per ON per."PE_PE_COD#" = p.IDPERS
-        WHERE p.AUTO_GENERE = 'O'
-        ORDER BY p.LIBELLETHEME
+        JOIN THEMES t ON t."CS_TH_COD#" = p.IDTHEME
+        LEFT JOIN LABELS lc ON lc.CODE = p.CODE_CONTRIBUTION
+        LEFT JOIN LABELS lt ON lt.CODE = p.CODE_TEMPORALITE
+        WHERE p.AUTO = 1
+        ORDER BY t.THEME
         LIMIT 30
     """, {})
 
@@ -459,11 +582,19 @@ def propagation_stats():
 
 
 # ---------- AUTOCOMPLETE ----------
+# 'memory': in-process completers (autocomplete.py), refreshed with
+# data_version; 'fts': SQL lookups on the FTS5 tables (search_index.py).
+AUTOCOMPLETE = os.getenv('CSR_AUTOCOMPLETE', 'memory').strip().lower()
+if AUTOCOMPLETE == 'memory':
+    autocomplete.warm_up()
+
 @app.get("/api/people/find")
 @require_auth
 @require_admin
 def people_find():
     q = (request.args.get("q") or "").strip().lower()
+    if AUTOCOMPLETE == 'memory':
+        return jsonify(autocomplete.get_completer('people').complete(q, 25))
 
     if len(q) == 0:
         sql = """
@@ -478,32 +609,60 @@ def people_find():
         rows = fetch_all(sql, {})
         return jsonify(rows)
 
-    binds = {"q": f"%{q}%"}
-    id_clause = ""
-    if q.isdigit():
-        id_clause = ' OR CAST(per."PE_PE_COD#" AS TEXT) LIKE :qid'
-        binds["qid"] = f"{q}%"
+    if q.isascii() and q.isdigit():
+        # Identifiers starting with q: one rowid range per length
+        sql = """
+        SELECT
+            per."PE_PE_COD#"   AS idpers,
+            per.PE_PE_NOM    AS nom,
+            per.PE_PE_PRENOM AS prenom
+        FROM json_each(:ranges) r
+        JOIN PERSONNE per
+          ON per."PE_PE_COD#" BETWEEN json_extract(r.value, '$[0]') AND json_extract(r.value, '$[1]')
+        ORDER BY per.PE_PE_NOM, per.PE_PE_PRENOM
+        LIMIT 25
+        """
+        top = fetch_one('SELECT MAX("PE_PE_COD#") AS m FROM PERSONNE', {})['m'] or 0
+        rows = fetch_all(sql, {"ranges": json.dumps(_id_prefix_ranges(q, top))})
+        return jsonify(rows)
 
-    sql = f"""
+    match = search_index.match_expr(q)
+    if match is None:
+        return jsonify([])
+    # Name words first (bm25 weights: nom 2, prenom 1)
+    sql = """
     SELECT
         per."PE_PE_COD#"   AS idpers,
         per.PE_PE_NOM    AS nom,
         per.PE_PE_PRENOM AS prenom
-    FROM PERSONNE per
-    WHERE LOWER(per.PE_PE_NOM) LIKE :q
-       OR LOWER(per.PE_PE_PRENOM) LIKE :q
-       {id_clause}
-    ORDER BY per.PE_PE_NOM, per.PE_PE_PRENOM
+    FROM PERSONNE_FTS f
+    JOIN PERSONNE per ON per."PE_PE_COD#" = f.rowid
+    WHERE PERSONNE_FTS MATCH :match
+    ORDER BY bm25(PERSONNE_FTS, 2.0, 1.0), per.PE_PE_NOM, per.PE_PE_PRENOM
     LIMIT 25
     """
-    rows = fetch_all(sql, binds)
+    rows = fetch_all(sql, {"match": match})
     return jsonify(rows)
 
 
+def _id_prefix_ranges(q, top):
+    """[lo, hi] ranges covering the integers up to `top` whose decimal
+    form starts with the digits `q`."""
+    if q.startswith('0'):
+        return [[0, 0]] if q == '0' else []
+    lo, hi, out = int(q), int(q), []
+    while lo <= top:
+        out.append([lo, hi])
+        lo, hi = lo * 10, hi * 10 + 9
+    return out
+
+
 @app.get("/api/themes/find")
 @require_auth
 def themes_find():
     q = (request.args.get("q") or "").strip().lower()
+    if AUTOCOMPLETE == 'memory':
+        return jsonify(autocomplete.get_completer('themes').complete(q, 25))
 
     if len(q) == 0:
         sql = """
@@ -517,16 +676,20 @@ def themes_find():
         rows = fetch_all(sql, {})
         return jsonify(rows)
 
+    match = search_index.match_expr(q)
+    if match is None:
+        return jsonify([])
     sql = """
     SELECT
         t."CS_TH_COD#" AS id,
         t.THEME      AS label
-    FROM THEMES t
-    WHERE LOWER(t.THEME) LIKE :q
-    ORDER BY t.THEME
+    FROM THEMES_FTS f
+    JOIN THEMES t ON t."CS_TH_COD#" = f.rowid
+    WHERE THEMES_FTS MATCH :match
+    ORDER BY f.rank, t.THEME
     LIMIT 25
     """
-    rows = fetch_all(sql, {"q": f"%{q}%"})
+    rows = fetch_all(sql, {"match": match})
     return jsonify(rows)
 
 
@@ -544,58 +707,258 @@ def _star(v):
     return s
 
 def _role_temp_mode_where(alias="p"):
+    # On POSITIONS: the :r / :t labels are compared through their code
     w = []
-    w.append(f"(:r = '*' OR {alias}.LIBCONTRIBUTION = :r)")
-    w.append(f"(:t = '*' OR {alias}.LIBELLETEMPORALITE = :t)")
-    w.append(f"(:m = '*' OR (:m = 'AUTO' AND {alias}.AUTO_GENERE = 'O') OR (:m = 'MANU' AND ({alias}.AUTO_GENERE IS NULL OR {alias}.AUTO_GENERE <> 'O')))")
+    w.append(f"(:r = '*' OR {alias}.CODE_CONTRIBUTION = {label_codes.code_sql(':r')})")
+    w.append(f"(:t = '*' OR {alias}.CODE_TEMPORALITE = {label_codes.code_sql(':t')})")
+    w.append(f"(:m = '*' OR (:m = 'AUTO' AND {alias}.AUTO = 1) OR (:m = 'MANU' AND {alias}.AUTO = 0))")
     return " AND ".join(w)
 
 def _bind_ids(prefix, ids, binds):
-    names = []
+    names = _bind_names(prefix, len(ids))
     for i, v in enumerate(ids, 1):
-        k = f"{prefix}{i}"
-        binds[k] = int(v)
-        names.append(f":{k}")
+        binds[f"{prefix}{i}"] = int(v)
     return names
 
-def _themes_descendants_cte(ids_bindnames):
-    """Return a CTE that recursively finds all descendants of given theme IDs."""
-    ids_csv = ", ".join(ids_bindnames)
-    return f"""
-    WITH RECURSIVE theme_desc AS (
-        SELECT "CS_TH_COD#" AS tid FROM THEMES WHERE "CS_TH_COD#" IN ({ids_csv})
-        UNION ALL
-        SELECT t."CS_TH_COD#" FROM THEMES t JOIN theme_desc td ON t.THEME_PARENT = td.tid
-    )
-    """
+def _bind_names(prefix, n):
+    return [f":{prefix}{i}" for i in range(1, n + 1)]
 
-def _themes_set_sql(ids_bindnames, include_desc=True):
-    ids_csv = ", ".join(ids_bindnames)
+def _theme_in(name, include_desc=True):
+    """`IN (...)` fragment matching the JSON array of theme ids bound
+    under :name.  With include_desc the set is expanded to all
+    descendants through THEME_CLOSURE."""
     if include_desc:
         return f"""IN (
-            SELECT tid FROM (
-                WITH RECURSIVE td AS (
-                    SELECT "CS_TH_COD#" AS tid FROM THEMES WHERE "CS_TH_COD#" IN ({ids_csv})
-                    UNION ALL
-                    SELECT t."CS_TH_COD#" FROM THEMES t JOIN td ON t.THEME_PARENT = td.tid
-                )
-                SELECT tid FROM td
-            )
+            SELECT c.descendant FROM THEME_CLOSURE c
+            WHERE c.ancestor IN (SELECT value FROM json_each(:{name}))
         )"""
-    else:
-        return f"IN ({ids_csv})"
+    return f"IN (SELECT value FROM json_each(:{name}))"
+
+def _themes_set_sql(name, ids, binds, include_desc=True):
+    """Bind a theme set as one JSON array under :name and return the
+    matching `IN (...)` fragment (see _theme_in)."""
+    binds[name] = json.dumps([int(v) for v in ids])
+    return _theme_in(name, include_desc)
+
+def _is_star_list(v):
+    return v == '*' or v == ['*']
+
+def _query_binds(body):
+    """Bind values of every CSR query, derived from the request body
+    alone: the builders only produce SQL text referencing these names."""
+    binds = {"r": _star(body.get("role")),
+             "t": _star(body.get("temporalite")),
+             "m": _star(body.get("mode"))}
+    # theme sets: whole set as JSON (:th) + one JSON singleton per id
+    # (:th1, :th2... for the ALL variants)
+    for field, name in (("theme_ids", "th"), ("exclude_theme_ids", "ex")):
+        ids = body.get(field) or []
+        if ids:
+            _themes_set_sql(name, ids, binds)
+            for i, v in enumerate(ids, 1):
+                binds[f"{name}{i}"] = json.dumps([int(v)])
+    for field, prefix in (("structure_ids", "s"), ("include_structures", "si"),
+                          ("exclude_structures", "sp")):
+        ids = body.get(field) or []
+        if ids and not _is_star_list(ids):
+            _bind_ids(prefix, ids, binds)
+    for field, name in (("structure_id", "sid"), ("person_id", "pid"), ("root_theme_id", "rt")):
+        if body.get(field):
+            binds[name] = int(body[field])
+    return binds
+
+# Empty result, for a request missing its mandatory ids
+NO_ROWS_SQL = "SELECT 1 WHERE 0"
+
+
+# --------- PAGINATION / STREAMING ---------
+# run_query and people_search read three optional body fields:
+#   "limit": n      one page of at most n rows (PAGE_MAX at most), replied
+#                   as {"rows": [...], "next": cursor or null}
+#   "after": cursor the page following the one whose "next" was `cursor`
+#   "stream": true  NDJSON, one row per line as the cursor reads them
+#                   (then {"next": ...} as last line when paged)
+# Pages are keyset-based: the query is wrapped in
+#   SELECT * FROM (...) WHERE (k1, k2...) > (:after1, :after2...)
+#   ORDER BY k1, k2... LIMIT n + 1
+# over a total order of its output columns (the keyset of the query, NULL
+# read as ''), and the cursor carries the keyset of the last row sent: a
+# page costs a bounded top-N sort wherever it lies, and rows written
+# between two pages neither shift nor repeat the others.
+PAGE_MAX     = int(os.getenv('CSR_PAGE_MAX', '1000'))
+STREAM_BATCH = int(os.getenv('CSR_STREAM_BATCH', '200'))
+
+PEOPLE_KEYSET = ("NOM", "PRENOM", "IDPERS", "IDSTRUCTURE", "LIBELLESTRUCTURE")
+THEMES_KEYSET = ("THEME", "IDTHEME")
+
+
+def _encode_cursor(row, keyset):
+    values = [row[k.lower()] if row[k.lower()] is not None else '' for k in keyset]
+    return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii')
+
+
+def _decode_cursor(after, keyset):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(str(after).encode('ascii')))
+    except (ValueError, UnicodeError):
+        values = None
+    if not isinstance(values, list) or len(values) != len(keyset):
+        abort(400, description="after : curseur invalide")
+    return values
+
+
+def _page_sql(sql, binds, body, keyset):
+    """Wrap `sql` for the page asked by `body`; returns (sql, binds, limit),
+    limit being None for an unpaged request."""
+    if body.get('limit') is None:
+        if body.get('after') is not None:
+            abort(400, description="after : limit requis")
+        return sql, binds, None
+    try:
+        limit = int(body['limit'])
+    except (TypeError, ValueError):
+        limit = 0
+    if limit < 1:
+        abort(400, description="limit : entier positif attendu")
+    limit = min(limit, PAGE_MAX)
+    if sql == NO_ROWS_SQL:
+        return sql, binds, limit
+
+    keys = ", ".join(f"COALESCE({k}, '')" for k in keyset)
+    binds = dict(binds, page_limit=limit + 1)
+    where = ""
+    if body.get('after') is not None:
+        names = _bind_names("after", len(keyset))
+        for i, v in enumerate(_decode_cursor(body['after'], keyset), 1):
+            binds[f"after{i}"] = v
+        where = f"WHERE ({keys}) > ({', '.join(names)})"
+    sql = f"SELECT * FROM ({sql}) {where} ORDER BY {keys} LIMIT :page_limit"
+    return sql, binds, limit
+
+
+# --------- VIEWER COUNTS ---------
+# Viewers only get the number of distinct persons of a nominative result.
+# The database computes it from the same SQL text, wrapped as
+#   SELECT COUNT(DISTINCT IDPERS) AS total FROM (<sql minus its final ORDER BY>)
+# (COUNT(*) for a result without persons, e.g. themes_of_person), so that
+# no nominative row is fetched.
+_FINAL_ORDER_BY = re.compile(r"\s+ORDER BY[^()']*$", re.IGNORECASE)
+
+
+def _count_sql(sql, column=None):
+    if sql == NO_ROWS_SQL:
+        return "SELECT 0 AS total"
+    what = f"DISTINCT {column}" if column else "*"
+    return f"SELECT COUNT({what}) AS total FROM ({_FINAL_ORDER_BY.sub('', sql)})"
+
+
+def _count(sql, binds, column=None):
+    return fetch_one(_count_sql(sql, column), binds)['total']
+
+
+def _rows_response(sql, binds, body, keyset):
+    """Reply with the rows of `sql`: whole list, one page or an NDJSON
+    stream, according to `body` (see above)."""
+    sql, binds, limit = _page_sql(sql, binds, body, keyset)
+
+    if _as_bool(body.get('stream')):
+        def generate():
+            batches = db.fetch_batches(sql, binds, STREAM_BATCH)
+            sent, last, more = 0, None, False
+            try:
+                for batch in batches:
+                    if limit is not None and sent + len(batch) > limit:
+                        # the look-ahead row: there is a next page
+                        batch, more = batch[:limit - sent], True
+                    if batch:
+                        sent, last = sent + len(batch), batch[-1]
+                        yield ''.join(json.dumps(r) + '\n' for r in batch).encode('utf-8')
+                    if more:
+                        break
+            finally:
+                batches.close()
+            if limit is not None:
+                nxt = _encode_cursor(last, keyset) if more else None
+                yield (json.dumps({"next": nxt}) + '\n').encode('utf-8')
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+    rows = fetch_all(sql, binds)
+    if limit is None:
+        return jsonify(rows)
+    nxt = _encode_cursor(rows[limit - 1], keyset) if len(rows) > limit else None
+    return jsonify({"rows": rows[:limit], "next": nxt})
+
 
+# --------- CSR QUERY REGISTRY ---------
+# The SQL text of a CSR query only depends on the "shape" of its body
+# (which id lists are given and how long they are, match, include_desc),
+# never on the values, which are bound by _query_binds().  The text built
+# for a shape is kept in _compiled, so a repeated query skips the builder,
+# and being byte-identical it also hits the prepared-statement cache of
+# every pooled connection (db.STMT_CACHE) instead of being parsed and
+# planned again.
+COMPILED_QUERIES_MAX = int(os.getenv('CSR_COMPILED_QUERIES_MAX', '512'))
 
 CSR_QUERIES = {}
 
-def register_query(qid, label, params, sql_builder):
-    CSR_QUERIES[qid] = {"id": qid, "label": label, "params": params, "sql_builder": sql_builder}
+def register_query(qid, label, params, sql_builder, keyset):
+    """`keyset`: output columns giving the rows a total order (pagination)."""
+    CSR_QUERIES[qid] = {"id": qid, "label": label, "params": params,
+                        "sql_builder": sql_builder, "keyset": keyset}
+
+def _query_shape(q, body):
+    """Cache key of the SQL text built for `body`, from the params spec."""
+    shape = [q["id"]]
+    for name, kind in sorted(q["params"].items()):
+        v = body.get(name)
+        if kind == "int[]":
+            shape.append('*' if _is_star_list(v) else len(v or []))
+        elif kind == "bool":
+            shape.append(_as_bool(body.get(name, True)))
+        elif kind == "int":
+            shape.append(bool(v))
+        elif name == "match":
+            shape.append((v or "ANY").upper())
+    return tuple(shape)
+
+
+class CompiledQueries:
+    """Bounded LRU of SQL text per query shape."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get(self, q, body):
+        """(sql, binds) for `body`; the builder only runs on a new shape."""
+        key = _query_shape(q, body)
+        with self._lock:
+            sql = self._entries.get(key)
+            if sql is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+        if sql is not None:
+            return sql, _query_binds(body)
+        sql, binds = q["sql_builder"](body)
+        with self._lock:
+            self.misses += 1
+            self._entries[key] = sql
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return sql, binds
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "max_entries": self.max_entries,
+                    "hits": self.hits, "misses": self.misses}
+
+
+_compiled = CompiledQueries(COMPILED_QUERIES_MAX)
 
 # -------------- Q1 ------------------
 def _q_people_with_no_theme(body):
-    role  = _star(body.get("role"))
-    temp  = _star(body.get("temporalite"))
-    mode  = _star(body.get("mode"))
 
     sql = f"""
       SELECT
@@ -606,73 +969,56 @@ def _q_people_with_no_theme(body):
         NULL AS LIBELLESTRUCTURE
       FROM PERSONNE per
       WHERE NOT EXISTS (
-        SELECT 1 FROM POSITIONNEMENT p
+        SELECT 1 FROM POSITIONS p
         WHERE p.IDPERS = per."PE_PE_COD#"
           AND {_role_temp_mode_where('p')}
       )
       ORDER BY per.PE_PE_NOM, per.PE_PE_PRENOM
     """
-    binds = {"r": role, "t": temp, "m": mode}
-    return sql, binds
+    return sql, _query_binds(body)
 
 register_query(
     "people_with_no_theme",
     "Chercheurs sans positionnement thématique",
     {"role":"str","temporalite":"str","mode":"str"},
-    _q_people_with_no_theme
+    _q_people_with_no_theme,
+    PEOPLE_KEYSET
 )
 
 # -------------- Q2 ------------------
 def _q_people_by_themes(body):
     ids = body.get("theme_ids", []) or []
     if not ids:
-        return "SELECT 1 WHERE 0", {}
+        return NO_ROWS_SQL, {}
     match = (body.get("match") or "ANY").upper()
     if match not in ("ANY", "ALL"):
         match = "ANY"
     inc   = _as_bool(body.get("include_desc", True))
-    role  = _star(body.get("role"))
-    temp  = _star(body.get("temporalite"))
-    mode  = _star(body.get("mode"))
-
-    binds = {"r": role, "t": temp, "m": mode}
-    idnames = _bind_ids("th", ids, binds)
-    theme_in = _themes_set_sql(idnames, inc)
 
     if match == "ANY":
+        theme_in = _theme_in("th", inc)
         sql = f"""
         SELECT DISTINCT
           per."PE_PE_COD#" AS IDPERS, per.PE_PE_NOM AS NOM, per.PE_PE_PRENOM AS PRENOM,
-          p.IDSTRUCTURE, p.LIBELLESTRUCTURE
+          p.IDSTRUCTURE, ls.LABEL AS LIBELLESTRUCTURE
         FROM PERSONNE per
-        JOIN POSITIONNEMENT p ON p.IDPERS = per."PE_PE_COD#"
+        JOIN POSITIONS p ON p.IDPERS = per."PE_PE_COD#"
+        LEFT JOIN LABELS ls ON ls.CODE = p.CODE_STRUCTURE
         WHERE p.IDTHEME {theme_in}
           AND {_role_temp_mode_where('p')}
         ORDER BY per.PE_PE_NOM, per.PE_PE_PRENOM
         """
-        return sql, binds
+        return sql, _query_binds(body)
 
     # ALL
     exists_clauses = []
-    for i, n in enumerate(idnames, 1):
-        if inc:
-            one_sub = f"""
-            SELECT tid FROM (
-                WITH RECURSIVE td AS (
-                    SELECT "CS_TH_COD#" AS tid FROM THEMES WHERE "CS_TH_COD#" = {n}
-                    UNION ALL
-                    SELECT t."CS_TH_COD#" FROM THEMES t JOIN td ON t.THEME_PARENT = td.tid
-                )
-                SELECT tid FROM td
-            )
-            """
-        else:
-            one_sub = f"SELECT {n}"
+    for i in range(1, len(ids) + 1):
+        one_in = _theme_in(f"th{i}", inc)
         exists_clauses.append(f"""
           EXISTS (
-            SELECT 1 FROM POSITIONNEMENT px
+            SELECT 1 FROM POSITIONS px
             WHERE px.IDPERS = per."PE_PE_COD#"
-              AND px.IDTHEME IN ({one_sub})
+              AND px.IDTHEME {one_in}
               AND {_role_temp_mode_where('px')}
           )
         """)
@@ -684,61 +1030,53 @@ def _q_people_by_themes(body):
       WHERE {' AND '.join(exists_clauses)}
       ORDER BY per.PE_PE_NOM, per.PE_PE_PRENOM
     """
-    return sql, binds
+    return sql, _query_binds(body)
 
 register_query(
     "people_by_themes",
     "Chercheurs positionnés sur des thèmes donnés",
     {"theme_ids":"int[]","match":"str","include_desc":"bool","role":"str","temporalite":"str","mode":"str"},
-    _q_people_by_themes
+    _q_people_by_themes,
+    PEOPLE_KEYSET
 )
 
 # -------------- Q3 ------------------
 def _q_people_by_themes_with_exclusion(body):
     ids_inc = body.get("theme_ids", []) or []
     if not ids_inc:
-        return "SELECT 1 WHERE 0", {}
+        return NO_ROWS_SQL, {}
     ids_exc = body.get("exclude_theme_ids", []) or []
     match = (body.get("match") or "ANY").upper()
     if match not in ("ANY", "ALL"): match = "ANY"
     inc_desc = _as_bool(body.get("include_desc", True))
-    role  = _star(body.get("role"))
-    temp  = _star(body.get("temporalite"))
-    mode  = _star(body.get("mode"))
-
-    binds = {"r": role, "t": temp, "m": mode}
-    in_names = _bind_ids("inc", ids_inc, binds)
-    in_sql = _themes_set_sql(in_names, inc_desc)
+    in_sql = _theme_in("th", inc_desc)
 
     out_sql = None
     if ids_exc:
-        out_names = _bind_ids("ex", ids_exc, binds)
-        out_sql = _themes_set_sql(out_names, inc_desc)
+        out_sql = _theme_in("ex", inc_desc)
 
     if match == "ANY":
         sql = f"""
         SELECT DISTINCT per."PE_PE_COD#" AS IDPERS, per.PE_PE_NOM AS NOM, per.PE_PE_PRENOM AS PRENOM,
-               p.IDSTRUCTURE, p.LIBELLESTRUCTURE
+               p.IDSTRUCTURE, ls.LABEL AS LIBELLESTRUCTURE
         FROM PERSONNE per
-        JOIN POSITIONNEMENT p ON p.IDPERS = per."PE_PE_COD#"
+        JOIN POSITIONS p ON p.IDPERS = per."PE_PE_COD#"
+        LEFT JOIN LABELS ls ON ls.CODE = p.CODE_STRUCTURE
         WHERE p.IDTHEME {in_sql}
           {"AND p.IDTHEME NOT " + out_sql if out_sql else ""}
           AND {_role_temp_mode_where('p')}
         ORDER BY per.PE_PE_NOM, per.PE_PE_PRENOM
         """
-        return sql, binds
+        return sql, _query_binds(body)
 
     exists_in = []
-    for n in in_names:
-        if inc_desc:
-            one_sub = f"""SELECT tid FROM (WITH RECURSIVE td AS (SELECT "CS_TH_COD#" AS tid FROM THEMES WHERE "CS_TH_COD#" = {n} UNION ALL SELECT t."CS_TH_COD#" FROM THEMES t JOIN td ON t.THEME_PARENT = td.tid) SELECT tid FROM td)"""
-        else:
-            one_sub = f"SELECT {n}"
-        exists_in.append(f"""EXISTS (SELECT 1 FROM POSITIONNEMENT px WHERE px.IDPERS = per."PE_PE_COD#" AND px.IDTHEME IN ({one_sub}) AND {_role_temp_mode_where('px')})""")
+    for i in range(1, len(ids_inc) + 1):
+        one_in = _theme_in(f"th{i}", inc_desc)
+        exists_in.append(f"""EXISTS (SELECT 1 FROM POSITIONS px WHERE px.IDPERS = per."PE_PE_COD#" AND px.IDTHEME {one_in} AND {_role_temp_mode_where('px')})""")
 
     not_exists_out = ""
     if out_sql:
-        not_exists_out = f"""AND NOT EXISTS (SELECT 1 FROM POSITIONNEMENT py WHERE py.IDPERS = per."PE_PE_COD#" AND py.IDTHEME {out_sql} AND {_role_temp_mode_where('py')})"""
+        not_exists_out = f"""AND NOT EXISTS (SELECT 1 FROM POSITIONS py WHERE py.IDPERS = per."PE_PE_COD#" AND py.IDTHEME {out_sql} AND {_role_temp_mode_where('py')})"""
 
     sql = f"""
       SELECT per."PE_PE_COD#" AS IDPERS, per.PE_PE_NOM AS NOM, per.PE_PE_PRENOM AS PRENOM,
@@ -747,13 +1085,14 @@ def _q_people_by_themes_with_exclusion(body):
       WHERE {' AND '.join(exists_in)} {not_exists_out}
       ORDER BY per.PE_PE_NOM, per.PE_PE_PRENOM
     """
-    return sql, binds
+    return sql, _query_binds(body)
 
 register_query(
     "people_by_themes_excluding",
     "Chercheurs sur un thème, excluant un autre",
     {"theme_ids":"int[]","exclude_theme_ids":"int[]","match":"str","include_desc":"bool","role":"str","temporalite":"str","mode":"str"},
-    _q_people_by_themes_with_exclusion
+    _q_people_by_themes_with_exclusion,
+    PEOPLE_KEYSET
 )
 
 # -------------- Q4 ------------------
@@ -761,38 +1100,30 @@ def _q_people_of_structure_by_themes(body):
     struct_id = body.get("structure_id")
     ids = body.get("theme_ids", []) or []
     if not struct_id or not ids:
-        return "SELECT 1 WHERE 0", {}
+        return NO_ROWS_SQL, {}
     match = (body.get("match") or "ANY").upper()
     if match not in ("ANY", "ALL"): match = "ANY"
     inc   = _as_bool(body.get("include_desc", True))
-    role  = _star(body.get("role"))
-    temp  = _star(body.get("temporalite"))
-    mode  = _star(body.get("mode"))
-
-    binds = {"sid": int(struct_id), "r": role, "t": temp, "m": mode}
-    idnames = _bind_ids("th", ids, binds)
-    theme_in = _themes_set_sql(idnames, inc)
 
     if match == "ANY":
+        theme_in = _theme_in("th", inc)
         sql = f"""
         SELECT DISTINCT per."PE_PE_COD#" AS IDPERS, per.PE_PE_NOM AS NOM, per.PE_PE_PRENOM AS PRENOM,
-               p.IDSTRUCTURE, p.LIBELLESTRUCTURE
+               p.IDSTRUCTURE, ls.LABEL AS LIBELLESTRUCTURE
         FROM PERSONNE per
-        JOIN POSITIONNEMENT p ON p.IDPERS = per."PE_PE_COD#"
+        JOIN POSITIONS p ON p.IDPERS = per."PE_PE_COD#"
+        LEFT JOIN LABELS ls ON ls.CODE = p.CODE_STRUCTURE
         WHERE p.IDSTRUCTURE = :sid
           AND p.IDTHEME {theme_in}
           AND {_role_temp_mode_where('p')}
         ORDER BY per.PE_PE_NOM, per.PE_PE_PRENOM
         """
-        return sql, binds
+        return sql, _query_binds(body)
 
     exists_parts = []
-    for n in idnames:
-        if inc:
-            one_sub = f"""SELECT tid FROM (WITH RECURSIVE td AS (SELECT "CS_TH_COD#" AS tid FROM THEMES WHERE "CS_TH_COD#" = {n} UNION ALL SELECT t."CS_TH_COD#" FROM THEMES t JOIN td ON t.THEME_PARENT = td.tid) SELECT tid FROM td)"""
-        else:
-            one_sub = f"SELECT {n}"
-        exists_parts.append(f"""EXISTS (SELECT 1 FROM POSITIONNEMENT px WHERE px.IDPERS = per."PE_PE_COD#" AND px.IDSTRUCTURE = :sid AND px.IDTHEME IN ({one_sub}) AND {_role_temp_mode_where('px')})""")
+    for i in range(1, len(ids) + 1):
+        one_in = _theme_in(f"th{i}", inc)
+        exists_parts.append(f"""EXISTS (SELECT 1 FROM POSITIONS px WHERE px.IDPERS = per."PE_PE_COD#" AND px.IDSTRUCTURE = :sid AND px.IDTHEME {one_in} AND {_role_temp_mode_where('px')})""")
 
     sql = f"""
       SELECT per."PE_PE_COD#" AS IDPERS, per.PE_PE_NOM AS NOM, per.PE_PE_PRENOM AS PRENOM,
@@ -801,13 +1132,14 @@ def _q_people_of_structure_by_themes(body):
       WHERE {' AND '.join(exists_parts)}
       ORDER BY per.PE_PE_NOM, per.PE_PE_PRENOM
     """
-    return sql, binds
+    return sql, _query_binds(body)
 
 register_query(
     "people_of_structure_by_themes",
     "Chercheurs d'une structure sur des thèmes donnés",
     {"structure_id":"int","theme_ids":"int[]","match":"str","include_desc":"bool","role":"str","temporalite":"str","mode":"str"},
-    _q_people_of_structure_by_themes
+    _q_people_of_structure_by_themes,
+    PEOPLE_KEYSET
 )
 
 # -------------- Q5 ------------------
@@ -816,45 +1148,36 @@ def _q_people_of_structure_by_themes_excl(body):
     ids_inc = body.get("theme_ids", []) or []
     ids_exc = body.get("exclude_theme_ids", []) or []
     if not struct_id or not ids_inc:
-        return "SELECT 1 WHERE 0", {}
+        return NO_ROWS_SQL, {}
     match = (body.get("match") or "ANY").upper()
     if match not in ("ANY", "ALL"): match = "ANY"
     inc   = _as_bool(body.get("include_desc", True))
-    role  = _star(body.get("role"))
-    temp  = _star(body.get("temporalite"))
-    mode  = _star(body.get("mode"))
-
-    binds = {"sid": int(struct_id), "r": role, "t": temp, "m": mode}
-    in_names = _bind_ids("inc", ids_inc, binds)
-    out_names = _bind_ids("ex", ids_exc, binds) if ids_exc else []
-    in_sql = _themes_set_sql(in_names, inc)
-    out_sql = _themes_set_sql(out_names, inc) if out_names else None
+    in_sql = _theme_in("th", inc)
+    out_sql = _theme_in("ex", inc) if ids_exc else None
 
     if match == "ANY":
         sql = f"""
         SELECT DISTINCT per."PE_PE_COD#" AS IDPERS, per.PE_PE_NOM AS NOM, per.PE_PE_PRENOM AS PRENOM,
-               p.IDSTRUCTURE, p.LIBELLESTRUCTURE
+               p.IDSTRUCTURE, ls.LABEL AS LIBELLESTRUCTURE
         FROM PERSONNE per
-        JOIN POSITIONNEMENT p ON p.IDPERS = per."PE_PE_COD#"
+        JOIN POSITIONS p ON p.IDPERS = per."PE_PE_COD#"
+        LEFT JOIN LABELS ls ON ls.CODE = p.CODE_STRUCTURE
         WHERE p.IDSTRUCTURE = :sid
           AND p.IDTHEME {in_sql}
           {"AND p.IDTHEME NOT " + out_sql if out_sql else ""}
           AND {_role_temp_mode_where('p')}
         ORDER BY per.PE_PE_NOM, per.PE_PE_PRENOM
         """
-        return sql, binds
+        return sql, _query_binds(body)
 
     exists_in = []
-    for n in in_names:
-        if inc:
-            one_sub = f"""SELECT tid FROM (WITH RECURSIVE td AS (SELECT "CS_TH_COD#" AS tid FROM THEMES WHERE "CS_TH_COD#" = {n} UNION ALL SELECT t."CS_TH_COD#" FROM THEMES t JOIN td ON t.THEME_PARENT = td.tid) SELECT tid FROM td)"""
-        else:
-            one_sub = f"SELECT {n}"
-        exists_in.append(f"""EXISTS (SELECT 1 FROM POSITIONNEMENT px WHERE px.IDPERS = per."PE_PE_COD#" AND px.IDSTRUCTURE = :sid AND px.IDTHEME IN ({one_sub}) AND {_role_temp_mode_where('px')})""")
+    for i in range(1, len(ids_inc) + 1):
+        one_in = _theme_in(f"th{i}", inc)
+        exists_in.append(f"""EXISTS (SELECT 1 FROM POSITIONS px WHERE px.IDPERS = per."PE_PE_COD#" AND px.IDSTRUCTURE = :sid AND px.IDTHEME {one_in} AND {_role_temp_mode_where('px')})""")
 
     not_exists_out = ""
     if out_sql:
-        not_exists_out = f"""AND NOT EXISTS (SELECT 1 FROM POSITIONNEMENT py WHERE py.IDPERS = per."PE_PE_COD#" AND py.IDSTRUCTURE = :sid AND py.IDTHEME {out_sql} AND {_role_temp_mode_where('py')})"""
+        not_exists_out = f"""AND NOT EXISTS (SELECT 1 FROM POSITIONS py WHERE py.IDPERS = per."PE_PE_COD#" AND py.IDSTRUCTURE = :sid AND py.IDTHEME {out_sql} AND {_role_temp_mode_where('py')})"""
 
     sql = f"""
       SELECT per."PE_PE_COD#" AS IDPERS, per.PE_PE_NOM AS NOM, per.PE_PE_PRENOM AS PRENOM,
@@ -863,37 +1186,36 @@ def _q_people_of_structure_by_themes_excl(body):
       WHERE {' AND '.join(exists_in)} {not_exists_out}
       ORDER BY per.PE_PE_NOM, per.PE_PE_PRENOM
     """
-    return sql, binds
+    return sql, _query_binds(body)
 
 register_query(
     "people_of_structure_by_themes_excluding",
     "Chercheurs d'une structure sur un thème, excluant un autre",
     {"structure_id":"int","theme_ids":"int[]","exclude_theme_ids":"int[]","match":"str","include_desc":"bool","role":"str","temporalite":"str","mode":"str"},
-    _q_people_of_structure_by_themes_excl
+    _q_people_of_structure_by_themes_excl,
+    PEOPLE_KEYSET
 )
 
 # -------------- Q6 ------------------
 def _q_themes_of_person(body):
     pid = body.get("person_id")
-    if not pid: return "SELECT 1 WHERE 0", {}
-    role  = _star(body.get("role"))
-    temp  = _star(body.get("temporalite"))
-    mode  = _star(body.get("mode"))
+    if not pid: return NO_ROWS_SQL, {}
     sql = f"""
       SELECT DISTINCT t."CS_TH_COD#" AS IDTHEME, t.THEME
-      FROM POSITIONNEMENT p
+      FROM POSITIONS p
       JOIN THEMES t ON t."CS_TH_COD#" = p.IDTHEME
       WHERE p.IDPERS = :pid
         AND {_role_temp_mode_where('p')}
       ORDER BY t.THEME
     """
-    return sql, {"pid": int(pid), "r": role, "t": temp, "m": mode}
+    return sql, _query_binds(body)
 
 register_query(
     "themes_of_person",
     "Thèmes d'un chercheur",
     {"person_id":"int","role":"str","temporalite":"str","mode":"str"},
-    _q_themes_of_person
+    _q_themes_of_person,
+    THEMES_KEYSET
 )
 
 # -------------- Q7 ------------------
@@ -901,99 +1223,89 @@ def _q_themes_in_structures(body):
     structs = body.get("structure_ids") or []
     any_or_all = (body.get("match") or "ANY").upper()
     if any_or_all not in ("ANY","ALL"): any_or_all = "ANY"
-    role  = _star(body.get("role"))
-    temp  = _star(body.get("temporalite"))
-    mode  = _star(body.get("mode"))
-    binds = {"r": role, "t": temp, "m": mode}
 
     if not structs or structs == ['*'] or structs == '*':
         sql = f"""
           SELECT DISTINCT t."CS_TH_COD#" AS IDTHEME, t.THEME
-          FROM POSITIONNEMENT p
+          FROM POSITIONS p
           JOIN THEMES t ON t."CS_TH_COD#" = p.IDTHEME
           WHERE {_role_temp_mode_where('p')}
           ORDER BY t.THEME
         """
-        return sql, binds
+        return sql, _query_binds(body)
 
-    snames = _bind_ids("s", structs, binds)
+    snames = _bind_names("s", len(structs))
 
     if any_or_all == "ANY":
         sql = f"""
           SELECT DISTINCT t."CS_TH_COD#" AS IDTHEME, t.THEME
-          FROM POSITIONNEMENT p
+          FROM POSITIONS p
           JOIN THEMES t ON t."CS_TH_COD#" = p.IDTHEME
           WHERE p.IDSTRUCTURE IN ({", ".join(snames)})
             AND {_role_temp_mode_where('p')}
           ORDER BY t.THEME
         """
-        return sql, binds
+        return sql, _query_binds(body)
 
     sql = f"""
       SELECT t."CS_TH_COD#" AS IDTHEME, t.THEME
-      FROM POSITIONNEMENT p
+      FROM POSITIONS p
       JOIN THEMES t ON t."CS_TH_COD#" = p.IDTHEME
       WHERE p.IDSTRUCTURE IN ({", ".join(snames)}) AND {_role_temp_mode_where('p')}
       GROUP BY t."CS_TH_COD#", t.THEME
       HAVING COUNT(DISTINCT p.IDSTRUCTURE) = {len(snames)}
       ORDER BY t.THEME
     """
-    return sql, binds
+    return sql, _query_binds(body)
 
 register_query(
     "themes_in_structures",
     "Thèmes couverts par une structure",
     {"structure_ids":"int[]","match":"str","role":"str","temporalite":"str","mode":"str"},
-    _q_themes_in_structures
+    _q_themes_in_structures,
+    THEMES_KEYSET
 )
 
 # -------------- Q8 ------------------
 def _q_themes_not_in_structures(body):
     structs = body.get("structure_ids") or []
-    if not structs: return "SELECT 1 WHERE 0", {}
-    role  = _star(body.get("role"))
-    temp  = _star(body.get("temporalite"))
-    mode  = _star(body.get("mode"))
-    binds = {"r": role, "t": temp, "m": mode}
-    snames = _bind_ids("s", structs, binds)
+    if not structs: return NO_ROWS_SQL, {}
+    snames = _bind_names("s", len(structs))
 
     sql = f"""
       SELECT t."CS_TH_COD#" AS IDTHEME, t.THEME
       FROM THEMES t
       WHERE NOT EXISTS (
-        SELECT 1 FROM POSITIONNEMENT p
+        SELECT 1 FROM POSITIONS p
         WHERE p.IDTHEME = t."CS_TH_COD#"
           AND p.IDSTRUCTURE IN ({", ".join(snames)})
           AND {_role_temp_mode_where('p')}
       )
       ORDER BY t.THEME
     """
-    return sql, binds
+    return sql, _query_binds(body)
 
 register_query(
     "themes_not_in_structures",
     "Thèmes non couverts par une structure",
     {"structure_ids":"int[]","role":"str","temporalite":"str","mode":"str"},
-    _q_themes_not_in_structures
+    _q_themes_not_in_structures,
+    THEMES_KEYSET
 )
 
 # -------------- Q9 ------------------
 def _q_themes_in_S_not_in_Sp(body):
     S  = body.get("include_structures") or []
     Sp = body.get("exclude_structures") or []
-    if not S: return "SELECT 1 WHERE 0", {}
-    role  = _star(body.get("role"))
-    temp  = _star(body.get("temporalite"))
-    mode  = _star(body.get("mode"))
-    binds = {"r": role, "t": temp, "m": mode}
-    s1 = _bind_ids("s", S, binds)
-    s2 = _bind_ids("sp", Sp, binds) if Sp else []
+    if not S: return NO_ROWS_SQL, {}
+    s1 = _bind_names("si", len(S))
+    s2 = _bind_names("sp", len(Sp)) if Sp else []
 
     not_in_sp = ""
     if s2:
         not_in_sp = f"""
         AND NOT EXISTS (
-          SELECT 1 FROM POSITIONNEMENT p2
+          SELECT 1 FROM POSITIONS p2
           WHERE p2.IDTHEME = t."CS_TH_COD#"
             AND p2.IDSTRUCTURE IN ({", ".join(s2)})
             AND {_role_temp_mode_where('p2')}
@@ -1002,168 +1314,317 @@ def _q_themes_in_S_not_in_Sp(body):
 
     sql = f"""
       SELECT DISTINCT t."CS_TH_COD#" AS IDTHEME, t.THEME
-      FROM POSITIONNEMENT p
+      FROM POSITIONS p
       JOIN THEMES t ON t."CS_TH_COD#" = p.IDTHEME
       WHERE p.IDSTRUCTURE IN ({", ".join(s1)})
         AND {_role_temp_mode_where('p')}
         {not_in_sp}
       ORDER BY t.THEME
     """
-    return sql, binds
+    return sql, _query_binds(body)
 
 register_query(
     "themes_in_S_not_in_Sp",
     "Thèmes présents dans une structure mais absents d'une autre",
     {"include_structures":"int[]","exclude_structures":"int[]","role":"str","temporalite":"str","mode":"str"},
-    _q_themes_in_S_not_in_Sp
+    _q_themes_in_S_not_in_Sp,
+    THEMES_KEYSET
 )
 
 # -------------- Q10 ------------------
 def _q_subthemes_of_X_in_S(body):
     root = body.get("root_theme_id")
-    if not root: return "SELECT 1 WHERE 0", {}
+    if not root: return NO_ROWS_SQL, {}
     structs = body.get("structure_ids") or []
     match = (body.get("match") or "ANY").upper()
     if match not in ("ANY", "ALL"): match = "ANY"
-    role  = _star(body.get("role"))
-    temp  = _star(body.get("temporalite"))
-    mode  = _star(body.get("mode"))
-
-    binds = {"r": role, "t": temp, "m": mode, "rt": int(root)}
     sfilter = ""
     if structs:
-        sn = _bind_ids("s", structs, binds)
+        sn = _bind_names("s", len(structs))
         sfilter = f" AND p.IDSTRUCTURE IN ({', '.join(sn)})"
 
-    # Descendants of root (excluding root itself)
-    sub_cte = """
-    WITH RECURSIVE sub_themes AS (
-        SELECT "CS_TH_COD#" AS tid FROM THEMES WHERE THEME_PARENT = :rt
-        UNION ALL
-        SELECT t."CS_TH_COD#" FROM THEMES t JOIN sub_themes st ON t.THEME_PARENT = st.tid
-    )
-    """
-
     if match == "ANY":
         sql = f"""
-          {sub_cte}
           SELECT DISTINCT t."CS_TH_COD#" AS IDTHEME, t.THEME
-          FROM POSITIONNEMENT p
+          FROM POSITIONS p
           JOIN THEMES t ON t."CS_TH_COD#" = p.IDTHEME
-          WHERE p.IDTHEME IN (SELECT tid FROM sub_themes)
+          WHERE p.IDTHEME IN (SELECT descendant FROM THEME_CLOSURE WHERE ancestor = :rt AND depth > 0)
             {sfilter}
             AND {_role_temp_mode_where('p')}
           ORDER BY t.THEME
         """
-        return sql, binds
+        return sql, _query_binds(body)
 
     if not structs:
         return _q_subthemes_of_X_in_S({**body, "match": "ANY"})
 
     sql = f"""
-      {sub_cte}
       SELECT t."CS_TH_COD#" AS IDTHEME, t.THEME
-      FROM POSITIONNEMENT p
+      FROM POSITIONS p
       JOIN THEMES t ON t."CS_TH_COD#" = p.IDTHEME
-      WHERE p.IDTHEME IN (SELECT tid FROM sub_themes)
+      WHERE p.IDTHEME IN (SELECT descendant FROM THEME_CLOSURE WHERE ancestor = :rt AND depth > 0)
         AND p.IDSTRUCTURE IN ({', '.join([f':s{i}' for i in range(1, len(structs)+1)])})
         AND {_role_temp_mode_where('p')}
       GROUP BY t."CS_TH_COD#", t.THEME
       HAVING COUNT(DISTINCT p.IDSTRUCTURE) = {len(structs)}
       ORDER BY t.THEME
     """
-    return sql, binds
+    return sql, _query_binds(body)
 
 register_query(
     "subthemes_of_X_in_S",
     "Sous-thèmes d'un thème couverts par une structure",
     {"root_theme_id":"int","structure_ids":"int[]","match":"str","role":"str","temporalite":"str","mode":"str"},
-    _q_subthemes_of_X_in_S
+    _q_subthemes_of_X_in_S,
+    THEMES_KEYSET
 )
 
 # -------------- Q11 ------------------
 def _q_subthemes_of_X_not_in_S(body):
     root = body.get("root_theme_id")
     structs = body.get("structure_ids") or []
-    if not root: return "SELECT 1 WHERE 0", {}
-    role  = _star(body.get("role"))
-    temp  = _star(body.get("temporalite"))
-    mode  = _star(body.get("mode"))
-    binds = {"rt": int(root), "r": role, "t": temp, "m": mode}
+    if not root: return NO_ROWS_SQL, {}
 
     sfilter = ""
     if structs:
-        sn = _bind_ids("s", structs, binds)
+        sn = _bind_names("s", len(structs))
         sfilter = f" AND p.IDSTRUCTURE IN ({', '.join(sn)})"
 
-    sub_cte = """
-    WITH RECURSIVE sub_themes AS (
-        SELECT "CS_TH_COD#" AS tid FROM THEMES WHERE THEME_PARENT = :rt
-        UNION ALL
-        SELECT t."CS_TH_COD#" FROM THEMES t JOIN sub_themes st ON t.THEME_PARENT = st.tid
-    )
-    """
-
     sql = f"""
-      {sub_cte}
       SELECT t."CS_TH_COD#" AS IDTHEME, t.THEME
       FROM THEMES t
-      WHERE t."CS_TH_COD#" IN (SELECT tid FROM sub_themes)
+      WHERE t."CS_TH_COD#" IN (SELECT descendant FROM THEME_CLOSURE WHERE ancestor = :rt AND depth > 0)
         AND NOT EXISTS (
-          SELECT 1 FROM POSITIONNEMENT p
+          SELECT 1 FROM POSITIONS p
           WHERE p.IDTHEME = t."CS_TH_COD#"
             {sfilter}
             AND {_role_temp_mode_where('p')}
         )
       ORDER BY t.THEME
     """
-    return sql, binds
+    return sql, _query_binds(body)
 
 register_query(
     "subthemes_of_X_not_in_S",
     "Sous-thèmes d'un thème non couverts par une structure",
     {"root_theme_id":"int","structure_ids":"int[]","role":"str","temporalite":"str","mode":"str"},
-    _q_subthemes_of_X_not_in_S
+    _q_subthemes_of_X_not_in_S,
+    THEMES_KEYSET
 )
 
 # -------------- Q12 ------------------
 def _q_people_of_structure(body):
     struct_id = body.get("structure_id")
     if not struct_id:
-        return "SELECT 1 WHERE 0", {}
-    role  = _star(body.get("role"))
-    temp  = _star(body.get("temporalite"))
-    mode  = _star(body.get("mode"))
+        return NO_ROWS_SQL, {}
 
     sql = f"""
       SELECT DISTINCT
         per."PE_PE_COD#" AS IDPERS,
         per.PE_PE_NOM    AS NOM,
         per.PE_PE_PRENOM AS PRENOM,
-        p.LIBCONTRIBUTION AS ROLE,
-        p.LIBELLETEMPORALITE AS TEMPORALITE,
+        lc.LABEL AS ROLE,
+        lt.LABEL AS TEMPORALITE,
         GROUP_CONCAT(DISTINCT t.THEME) AS THEMES,
         p.IDSTRUCTURE,
         COALESCE(s.acronyme, CAST(p.IDSTRUCTURE AS TEXT)) AS STRUCTURE_ACRONYME
-      FROM POSITIONNEMENT p
+      FROM POSITIONS p
       JOIN PERSONNE per  ON per."PE_PE_COD#" = p.IDPERS
       JOIN THEMES t      ON t."CS_TH_COD#"  = p.IDTHEME
       LEFT JOIN STRUCTURES s ON s.id = p.IDSTRUCTURE
+      LEFT JOIN LABELS lc ON lc.CODE = p.CODE_CONTRIBUTION
+      LEFT JOIN LABELS lt ON lt.CODE = p.CODE_TEMPORALITE
       WHERE p.IDSTRUCTURE = :sid
         AND {_role_temp_mode_where('p')}
       GROUP BY per."PE_PE_COD#", per.PE_PE_NOM, per.PE_PE_PRENOM,
-               p.LIBCONTRIBUTION, p.LIBELLETEMPORALITE, p.IDSTRUCTURE
-      ORDER BY per.PE_PE_NOM, per.PE_PE_PRENOM, p.LIBCONTRIBUTION
+               lc.LABEL, lt.LABEL, p.IDSTRUCTURE
+      ORDER BY per.PE_PE_NOM, per.PE_PE_PRENOM, lc.LABEL
     """
-    return sql, {"sid": int(struct_id), "r": role, "t": temp, "m": mode}
+    return sql, _query_binds(body)
 
 register_query(
     "people_of_structure",
     "Chercheurs d'une structure",
     {"structure_id":"int","role":"str","temporalite":"str","mode":"str"},
-    _q_people_of_structure
+    _q_people_of_structure,
+    ("NOM", "PRENOM", "ROLE", "IDPERS", "TEMPORALITE", "IDSTRUCTURE")
 )
 
+# --------- BITMAP SET ENGINE ---------
+# With CSR_SET_ENGINE=bitmap (default), the queries of BITMAP_QUERIES are
+# computed on the bitsets of bitmap_index.py (|, &, & ~) instead of
+# correlated EXISTS over THEME_CLOSURE.  SQL then only fetches the rows
+# of the resulting ids (BM_*_SQL, constant texts), so that pagination,
+# streaming and viewer counts apply unchanged.  A function returning None
+# leaves the request to the SQL builder ('*' lists of structures).
+SET_ENGINE = os.getenv('CSR_SET_ENGINE', 'bitmap').strip().lower()
+
+BM_PEOPLE_SQL = """
+  SELECT per."PE_PE_COD#" AS IDPERS, per.PE_PE_NOM AS NOM, per.PE_PE_PRENOM AS PRENOM,
+         :sid AS IDSTRUCTURE, NULL AS LIBELLESTRUCTURE
+  FROM json_each(:ids) j
+  JOIN PERSONNE per ON per."PE_PE_COD#" = j.value
+  ORDER BY per.PE_PE_NOM, per.PE_PE_PRENOM
+"""
+
+BM_PEOPLE_EXCEPT_SQL = """
+  SELECT per."PE_PE_COD#" AS IDPERS, per.PE_PE_NOM AS NOM, per.PE_PE_PRENOM AS PRENOM,
+         NULL AS IDSTRUCTURE, NULL AS LIBELLESTRUCTURE
+  FROM PERSONNE per
+  WHERE per."PE_PE_COD#" NOT IN (SELECT value FROM json_each(:ids))
+  ORDER BY per.PE_PE_NOM, per.PE_PE_PRENOM
+"""
+
+# :groups = [[IDSTRUCTURE, LIBELLESTRUCTURE, [IDPERS...]], ...]
+BM_POSITIONS_SQL = """
+  SELECT DISTINCT per."PE_PE_COD#" AS IDPERS, per.PE_PE_NOM AS NOM, per.PE_PE_PRENOM AS PRENOM,
+         json_extract(g.value, '$[0]') AS IDSTRUCTURE, json_extract(g.value, '$[1]') AS LIBELLESTRUCTURE
+  FROM json_each(:groups) g
+  JOIN json_each(g.value, '$[2]') j
+  JOIN PERSONNE per ON per."PE_PE_COD#" = j.value
+  ORDER BY per.PE_PE_NOM, per.PE_PE_PRENOM
+"""
+
+BM_THEMES_SQL = """
+  SELECT t."CS_TH_COD#" AS IDTHEME, t.THEME
+  FROM json_each(:ids) j
+  JOIN THEMES t ON t."CS_TH_COD#" = j.value
+  ORDER BY t.THEME
+"""
+
+
+def _bm_facets(bm, body):
+    return bm.facets(_star(body.get("role")), _star(body.get("temporalite")), _star(body.get("mode")))
+
+def _bm_match(body):
+    match = (body.get("match") or "ANY").upper()
+    return match if match in ("ANY", "ALL") else "ANY"
+
+def _bm_people(bm, bits, sid=None):
+    return BM_PEOPLE_SQL, {"ids": json.dumps(bm.person_list(bits)), "sid": sid}
+
+def _bm_themes(bm, bits):
+    return BM_THEMES_SQL, {"ids": json.dumps(bm.theme_list(bits))}
+
+def _bm_people_with_no_theme(bm, body):
+    positioned = bm.persons(None, _bm_facets(bm, body))
+    return BM_PEOPLE_EXCEPT_SQL, {"ids": json.dumps(bm.person_list(positioned))}
+
+def _bm_people_by_themes(bm, body, by_structure=False, excluding=False):
+    """Q2 to Q5: ANY keeps the positions on the included themes minus the
+    excluded ones; ALL intersects the persons of each included theme and
+    removes those of the excluded themes."""
+    ids = body.get("theme_ids") or []
+    sid = int(body["structure_id"]) if by_structure and body.get("structure_id") else None
+    if not ids or (by_structure and sid is None):
+        return NO_ROWS_SQL, {}
+    exc = (body.get("exclude_theme_ids") or []) if excluding else []
+    inc = _as_bool(body.get("include_desc", True))
+    facets = _bm_facets(bm, body)
+
+    if _bm_match(body) == "ANY":
+        themes = bm.expand(ids, inc) - bm.expand(exc, inc)
+        groups = bm.groups(themes, facets, sid)
+        data = [[s, label, bm.person_list(bits)] for (s, label), bits in groups.items()]
+        return BM_POSITIONS_SQL, {"groups": json.dumps(data)}
+
+    bits = None
+    for tid in ids:
+        one = bm.persons([tid], facets, sid, inc)
+        bits = one if bits is None else bits & one
+    if exc:
+        bits &= ~bm.persons(exc, facets, sid, inc)
+    return _bm_people(bm, bits, sid)
+
+def _bm_structures(body, field):
+    """Structure ids of `field`, None for a '*' list."""
+    ids = body.get(field) or []
+    return None if _is_star_list(ids) else [int(v) for v in ids]
+
+def _bm_covered_all(bm, structs, facets):
+    """Themes covered by every structure of `structs` (COUNT(DISTINCT) =
+    len(structs) in SQL: nothing if the list repeats an id)."""
+    if len(set(structs)) != len(structs):
+        return 0
+    bits = bm.all_themes()
+    for s in structs:
+        bits &= bm.covered([s], facets)
+    return bits
+
+def _bm_themes_in_structures(bm, body):
+    structs = _bm_structures(body, "structure_ids")
+    facets = _bm_facets(bm, body)
+    if not structs:
+        return _bm_themes(bm, bm.covered(None, facets))
+    if _bm_match(body) == "ANY":
+        return _bm_themes(bm, bm.covered(structs, facets))
+    return _bm_themes(bm, _bm_covered_all(bm, structs, facets))
+
+def _bm_themes_not_in_structures(bm, body):
+    structs = _bm_structures(body, "structure_ids")
+    if structs is None:
+        return None
+    if not structs:
+        return NO_ROWS_SQL, {}
+    return _bm_themes(bm, bm.all_themes() & ~bm.covered(structs, _bm_facets(bm, body)))
+
+def _bm_themes_in_S_not_in_Sp(bm, body):
+    S, Sp = _bm_structures(body, "include_structures"), _bm_structures(body, "exclude_structures")
+    if S is None or Sp is None:
+        return None
+    if not S:
+        return NO_ROWS_SQL, {}
+    facets = _bm_facets(bm, body)
+    return _bm_themes(bm, bm.covered(S, facets) & ~bm.covered(Sp, facets))
+
+def _bm_subthemes_of_X_in_S(bm, body):
+    structs = _bm_structures(body, "structure_ids")
+    if structs is None:
+        return None
+    if not body.get("root_theme_id"):
+        return NO_ROWS_SQL, {}
+    facets = _bm_facets(bm, body)
+    if not structs:
+        covered = bm.covered(None, facets)
+    elif _bm_match(body) == "ANY":
+        covered = bm.covered(structs, facets)
+    else:
+        covered = _bm_covered_all(bm, structs, facets)
+    return _bm_themes(bm, bm.subtree(body["root_theme_id"]) & covered)
+
+def _bm_subthemes_of_X_not_in_S(bm, body):
+    structs = _bm_structures(body, "structure_ids")
+    if structs is None:
+        return None
+    if not body.get("root_theme_id"):
+        return NO_ROWS_SQL, {}
+    covered = bm.covered(structs or None, _bm_facets(bm, body))
+    return _bm_themes(bm, bm.subtree(body["root_theme_id"]) & ~covered)
+
+BITMAP_QUERIES = {
+    "people_with_no_theme": _bm_people_with_no_theme,
+    "people_by_themes": _bm_people_by_themes,
+    "people_by_themes_excluding":
+        lambda bm, body: _bm_people_by_themes(bm, body, excluding=True),
+    "people_of_structure_by_themes":
+        lambda bm, body: _bm_people_by_themes(bm, body, by_structure=True),
+    "people_of_structure_by_themes_excluding":
+        lambda bm, body: _bm_people_by_themes(bm, body, by_structure=True, excluding=True),
+    "themes_in_structures": _bm_themes_in_structures,
+    "themes_not_in_structures": _bm_themes_not_in_structures,
+    "themes_in_S_not_in_Sp": _bm_themes_in_S_not_in_Sp,
+    "subthemes_of_X_in_S": _bm_subthemes_of_X_in_S,
+    "subthemes_of_X_not_in_S": _bm_subthemes_of_X_not_in_S,
+}
+
+
+def _csr_sql(q, body):
+    """(sql, binds) of a CSR query: bitmap engine when it covers the
+    request, SQL builder (through _compiled) otherwise."""
+    fn = BITMAP_QUERIES.get(q["id"]) if SET_ENGINE == 'bitmap' else None
+    out = fn(bitmap_index.get_bitmaps(), body) if fn else None
+    return out if out is not None else _compiled.get(q, body)
+
 @app.get("/api/queries")
 @require_auth
 def list_queries():
@@ -1186,44 +1647,67 @@ def run_query(qid):
     if not q:
         abort(404, description=f"Query '{qid}' not found")
     body = request.get_json(force=True, silent=True) or {}
-    sql, binds = q["sql_builder"](body)
-    rows = fetch_all(sql, binds)
+    sql, binds = _csr_sql(q, body)
 
     # Viewer: return aggregated count instead of nominative data
     if getattr(request, 'role', 'admin') == 'viewer' and qid in VIEWER_COUNT_QUERIES:
-        # Count distinct persons
-        ids_col = next((k for k in ('idpers', 'IDPERS') if rows and k in rows[0]), None)
-        if ids_col:
-            n = len(set(r[ids_col] for r in rows))
-        else:
-            n = len(rows)
-        return jsonify([{"total_personnes": n}])
+        # Count distinct persons (rows when the result has none)
+        column = 'IDPERS' if 'IDPERS' in q["keyset"] else None
+        return jsonify([{"total_personnes": _count(sql, binds, column)}])
 
-    return jsonify(rows)
+    return _rows_response(sql, binds, body, q["keyset"])
 
 @app.get("/api/structures/find")
 @require_auth
 def structures_find():
     q = (request.args.get("q") or "").strip().lower()
-    sql = """
-      SELECT DISTINCT
-             p.IDSTRUCTURE AS id,
-             COALESCE(p.LIBELLESTRUCTURE, CAST(p.IDSTRUCTURE AS TEXT)) AS label,
-             COALESCE(s.acronyme, CAST(p.IDSTRUCTURE AS TEXT)) AS acronyme
-      FROM POSITIONNEMENT p
-      LEFT JOIN STRUCTURES s ON s.id = p.IDSTRUCTURE
-      WHERE p.IDSTRUCTURE IS NOT NULL
-        AND (:q = '' OR LOWER(COALESCE(p.LIBELLESTRUCTURE,'')) LIKE :likeq
-             OR CAST(p.IDSTRUCTURE AS TEXT) LIKE :likeq
-             OR LOWER(COALESCE(s.acronyme,'')) LIKE :likeq)
-      ORDER BY label
+    if AUTOCOMPLETE == 'memory':
+        return jsonify(autocomplete.get_completer('structures').complete(q, 25))
+    # STRUCTURE_LABELS: (structure, label) pairs in use, see search_index
+    columns = """
+             l.IDSTRUCTURE AS id,
+             COALESCE(NULLIF(l.LIBELLESTRUCTURE, ''), CAST(l.IDSTRUCTURE AS TEXT)) AS label,
+             COALESCE(s.acronyme, CAST(l.IDSTRUCTURE AS TEXT)) AS acronyme
+    """
+    if not q:
+        sql = f"""
+          SELECT {columns}
+          FROM STRUCTURE_LABELS l
+          LEFT JOIN STRUCTURES s ON s.id = l.IDSTRUCTURE
+          ORDER BY label
+          LIMIT 25
+        """
+        return jsonify(fetch_all(sql, {}))
+
+    match = search_index.match_expr(q)
+    if match is None:
+        return jsonify([])
+    # Words of the acronym, full name or label, or digits of the id
+    sql = f"""
+      SELECT {columns}
+      FROM STRUCTURE_LABELS l
+      LEFT JOIN STRUCTURES s ON s.id = l.IDSTRUCTURE
+      LEFT JOIN (SELECT rowid, rank FROM STRUCTURES_FTS WHERE STRUCTURES_FTS MATCH :match) f
+        ON f.rowid = l.id
+      WHERE f.rowid IS NOT NULL OR CAST(l.IDSTRUCTURE AS TEXT) LIKE :likeq
+      ORDER BY f.rank IS NULL, f.rank, label
       LIMIT 25
     """
-    likeq = f"%{q}%"
-    rows = fetch_all(sql, {"q": q, "likeq": likeq})
+    rows = fetch_all(sql, {"match": match, "likeq": f"%{q}%"})
     return jsonify(rows)
 
 # --------- DASHBOARD STATS ---------
+# overview, top/themes, top/structures, distribution, themes_per_person,
+# all_structures and themes_coverage read the STATS_COUNT aggregates
+# maintained by stats_tables.py (see DIMENSIONS there).
+# With CSR_STATS_ENGINE=columns (default), overview, top/themes,
+# themes_per_person, themes_coverage and people_count are computed on the
+# columnar snapshot of analytics.py instead; 'sql' keeps the queries below.
+STATS_ENGINE = os.getenv('CSR_STATS_ENGINE', 'columns').strip().lower()
+
+def _stats_mode():
+    """'all' with ?mode=all, 'manu' otherwise (same rule as _manu_filter)."""
+    return "all" if (request.args.get("mode") or "manu").lower() == "all" else "manu"
 
 def _manu_filter(alias=""):
     """Return SQL clause to filter manual-only positionings when ?mode=manu.
@@ -1232,194 +1716,164 @@ def _manu_filter(alias=""):
     if mode == "all":
         return "1=1"  # no filter
     pfx = (alias + ".") if alias else ""
-    return f"({pfx}AUTO_GENERE IS NULL OR {pfx}AUTO_GENERE <> 'O')"
+    return f"{pfx}AUTO = 0"
 
 @app.get("/api/stats/overview")
 @require_auth
+@cached_by_data_version
 def stats_overview():
-    mf = _manu_filter()
-    sql = f"""
+    if STATS_ENGINE == 'columns':
+        return jsonify(analytics.get_columns().overview(_stats_mode()))
+    sql = """
     SELECT
-      (SELECT COUNT(DISTINCT IDPERS) FROM POSITIONNEMENT WHERE LIBELLETEMPORALITE = 'Présent' AND {mf}) AS people_present,
+      (SELECT COALESCE(SUM(cnt), 0) FROM STATS_COUNT WHERE mode = :m AND dim = 'bucket') AS people_present,
       (SELECT COUNT(*) FROM PERSONNE)
-        - (SELECT COUNT(DISTINCT IDPERS) FROM POSITIONNEMENT WHERE LIBELLETEMPORALITE = 'Présent' AND {mf}) AS non_positionnes,
-      (SELECT COUNT(DISTINCT IDTHEME) FROM POSITIONNEMENT WHERE LIBELLETEMPORALITE = 'Présent' AND {mf}) AS themes_active,
-      (SELECT COUNT(DISTINCT IDSTRUCTURE)
-         FROM POSITIONNEMENT WHERE LIBELLETEMPORALITE = 'Présent' AND IDSTRUCTURE IS NOT NULL AND {mf}) AS structures_active,
-      (SELECT ROUND(AVG(cnt), 2) FROM (
-         SELECT IDPERS, COUNT(DISTINCT IDTHEME) cnt
-         FROM POSITIONNEMENT WHERE LIBELLETEMPORALITE = 'Présent' AND {mf} GROUP BY IDPERS
-      )) AS themes_per_person
+        - (SELECT COALESCE(SUM(cnt), 0) FROM STATS_COUNT WHERE mode = :m AND dim = 'bucket') AS non_positionnes,
+      (SELECT COUNT(*) FROM STATS_COUNT WHERE mode = :m AND dim = 'theme') AS themes_active,
+      (SELECT COUNT(*) FROM STATS_COUNT WHERE mode = :m AND dim = 'structure_id') AS structures_active,
+      (SELECT ROUND(CAST(SUM(key_id * cnt) AS REAL) / SUM(cnt), 2)
+         FROM STATS_COUNT WHERE mode = :m AND dim = 'bucket') AS themes_per_person
     """
-    row = fetch_one(sql, {})
+    row = fetch_one(sql, {"m": _stats_mode()})
     return jsonify(row)
 
 
 @app.get("/api/stats/top/themes")
 @require_auth
+@cached_by_data_version
 def stats_top_themes():
     limit = int(request.args.get("limit", 10))
-    mf = _manu_filter("p")
-    sql = f"""
+    if STATS_ENGINE == 'columns':
+        return jsonify(analytics.get_columns().top_themes(_stats_mode(), limit))
+    sql = """
     SELECT
         t."CS_TH_COD#" AS id,
         t.THEME      AS label,
-        COUNT(DISTINCT p.IDPERS) AS cnt
-    FROM POSITIONNEMENT p
-    JOIN THEMES t ON t."CS_TH_COD#" = p.IDTHEME
-    WHERE p.LIBELLETEMPORALITE = 'Présent'
-      AND {mf}
-    GROUP BY t."CS_TH_COD#", t.THEME
-    ORDER BY cnt DESC
+        s.cnt
+    FROM STATS_COUNT s
+    JOIN THEMES t ON t."CS_TH_COD#" = s.key_id
+    WHERE s.mode = :m AND s.dim = 'theme'
+    ORDER BY s.cnt DESC
     LIMIT :limit
     """
-    rows = fetch_all(sql, {"limit": limit})
+    rows = fetch_all(sql, {"m": _stats_mode(), "limit": limit})
     return jsonify(rows)
 
 
 @app.get("/api/stats/top/structures")
 @require_auth
+@cached_by_data_version
 def stats_top_structures():
     limit = int(request.args.get("limit", 10))
-    mf = _manu_filter("p")
-    sql = f"""
-    SELECT
-        p.IDSTRUCTURE AS id,
-        COALESCE(p.LIBELLESTRUCTURE, CAST(p.IDSTRUCTURE AS TEXT)) AS label,
-        COUNT(DISTINCT p.IDPERS) AS cnt
-    FROM POSITIONNEMENT p
-    WHERE p.IDSTRUCTURE IS NOT NULL
-      AND p.LIBELLETEMPORALITE = 'Présent'
-      AND {mf}
-    GROUP BY p.IDSTRUCTURE, COALESCE(p.LIBELLESTRUCTURE, CAST(p.IDSTRUCTURE AS TEXT))
+    sql = """
+    SELECT key_id AS id, key_label AS label, cnt
+    FROM STATS_COUNT
+    WHERE mode = :m AND dim = 'structure'
     ORDER BY cnt DESC
     LIMIT :limit
     """
-    rows = fetch_all(sql, {"limit": limit})
+    rows = fetch_all(sql, {"m": _stats_mode(), "limit": limit})
     return jsonify(rows)
 
 
 @app.get("/api/stats/distribution")
 @require_auth
+@cached_by_data_version
 def stats_distribution():
-    mf = _manu_filter()
-    sql_role = f"""
-      SELECT COALESCE(LIBCONTRIBUTION,'(N/A)') AS label,
-             COUNT(DISTINCT IDPERS) AS cnt
-      FROM POSITIONNEMENT
-      WHERE LIBELLETEMPORALITE = 'Présent'
-        AND {mf}
-      GROUP BY COALESCE(LIBCONTRIBUTION,'(N/A)')
-      ORDER BY cnt DESC
-    """
-    sql_temp = f"""
-      SELECT COALESCE(LIBELLETEMPORALITE,'(N/A)') AS label,
-             COUNT(DISTINCT IDPERS) AS cnt
-      FROM POSITIONNEMENT
-      WHERE {mf}
-      GROUP BY COALESCE(LIBELLETEMPORALITE,'(N/A)')
+    sql = """
+      SELECT key_label AS label, cnt
+      FROM STATS_COUNT
+      WHERE mode = :m AND dim = :dim
       ORDER BY cnt DESC
     """
-    role = fetch_all(sql_role, {})
-    temp = fetch_all(sql_temp, {})
+    role = fetch_all(sql, {"m": _stats_mode(), "dim": "role"})
+    temp = fetch_all(sql, {"m": _stats_mode(), "dim": "temp"})
     return jsonify({"role": role, "temporalite": temp})
 
 
 @app.get("/api/stats/themes_no_expert")
 @require_auth
+@cached_by_data_version
 def stats_themes_no_expert():
     """Themes covered by Contributeur/Utilisateur only, with no Expert (Présent)."""
     mf_p = _manu_filter("p")
     mf_pe = _manu_filter("pe")
+    tix = get_theme_index()
     sql = f"""
-    WITH RECURSIVE anc AS (
-      SELECT "CS_TH_COD#" AS tid, THEME_PARENT AS pid,
-             CAST(THEME AS TEXT) AS path
-      FROM THEMES
-      UNION ALL
-      SELECT anc.tid, p.THEME_PARENT,
-             p.THEME || ' › ' || anc.path
-      FROM anc
-      JOIN THEMES p ON p."CS_TH_COD#" = anc.pid
-    )
     SELECT t."CS_TH_COD#" AS id, t.THEME AS label,
-           t.NIVEAU + 1 AS niveau,
-           (SELECT a.path FROM anc a WHERE a.tid = t."CS_TH_COD#" AND a.pid IS NULL
-            LIMIT 1) AS hierarchy
+           t.NIVEAU + 1 AS niveau
     FROM THEMES t
-    WHERE NOT EXISTS (
-        SELECT 1 FROM THEMES child WHERE child.THEME_PARENT = t."CS_TH_COD#"
-      )
+    WHERE t."CS_TH_COD#" IN (SELECT value FROM json_each(:leaves))
       AND EXISTS (
-        SELECT 1 FROM POSITIONNEMENT p
+        SELECT 1 FROM POSITIONS p
         WHERE p.IDTHEME = t."CS_TH_COD#"
-          AND p.LIBELLETEMPORALITE = 'Présent'
+          AND p.CODE_TEMPORALITE = {label_codes.PRESENT}
           AND {mf_p}
       )
       AND NOT EXISTS (
-        SELECT 1 FROM POSITIONNEMENT pe
+        SELECT 1 FROM POSITIONS pe
         WHERE pe.IDTHEME = t."CS_TH_COD#"
-          AND pe.LIBCONTRIBUTION = 'Expert'
-          AND pe.LIBELLETEMPORALITE = 'Présent'
+          AND pe.CODE_CONTRIBUTION = {label_codes.EXPERT}
+          AND pe.CODE_TEMPORALITE = {label_codes.PRESENT}
           AND {mf_pe}
       )
     ORDER BY t.THEME
     """
-    rows = fetch_all(sql, {})
+    rows = fetch_all(sql, {"leaves": json.dumps(tix.leaves())})
+    for r in rows:
+        r["hierarchy"] = tix.root_path(r["id"])
     return jsonify(rows)
 
 
 @app.get("/api/stats/themes_per_person")
 @require_auth
+@cached_by_data_version
 def stats_themes_per_person():
     """Distribution: how many people cover 1, 2, 3... N themes (Présent only)."""
-    mf = _manu_filter()
-    sql = f"""
-    SELECT theme_count AS bucket, COUNT(*) AS people
-    FROM (
-      SELECT IDPERS, COUNT(DISTINCT IDTHEME) AS theme_count
-      FROM POSITIONNEMENT
-      WHERE LIBELLETEMPORALITE = 'Présent'
-        AND {mf}
-      GROUP BY IDPERS
-    )
-    GROUP BY theme_count
-    ORDER BY theme_count
+    if STATS_ENGINE == 'columns':
+        return jsonify(analytics.get_columns().themes_per_person(_stats_mode()))
+    sql = """
+    SELECT key_id AS bucket, cnt AS people
+    FROM STATS_COUNT
+    WHERE mode = :m AND dim = 'bucket'
+    ORDER BY key_id
     """
-    rows = fetch_all(sql, {})
+    rows = fetch_all(sql, {"m": _stats_mode()})
     return jsonify(rows)
 
 
 @app.get("/api/stats/top_structures_diversity")
 @require_auth
+@cached_by_data_version
 def stats_top_structures_diversity():
     """Top structures by number of distinct themes covered."""
     mf = _manu_filter("pos")
     sql = f"""
     SELECT 
-        COALESCE(s.acronyme || ' — ', '') || pos.LIBELLESTRUCTURE AS label, 
+        COALESCE(s.acronyme || ' — ', '') || ls.LABEL AS label, 
         COUNT(DISTINCT pos.IDTHEME) AS total
-    FROM POSITIONNEMENT pos
+    FROM POSITIONS pos
+    JOIN LABELS ls ON ls.CODE = pos.CODE_STRUCTURE
     LEFT JOIN STRUCTURES s ON s.id = pos.IDSTRUCTURE
-    WHERE pos.LIBELLETEMPORALITE = 'Présent'
-      AND pos.LIBELLESTRUCTURE IS NOT NULL
+    WHERE pos.CODE_TEMPORALITE = {label_codes.PRESENT}
       AND {mf}
-    GROUP BY pos.IDSTRUCTURE, pos.LIBELLESTRUCTURE, s.acronyme
+    GROUP BY pos.IDSTRUCTURE, ls.LABEL, s.acronyme
     ORDER BY total DESC
     """
     return jsonify(fetch_all(sql, {}))
 
 @app.get("/api/stats/top_researchers")
 @require_auth
+@cached_by_data_version
 def stats_top_researchers():
     """Top 15 researchers with the highest number of present themes.
     Viewers see anonymised labels ('Chercheur #1', etc.)."""
     mf = _manu_filter("pos")
     sql = f"""
     SELECT p."PE_PE_COD#" AS id, p.PE_PE_NOM || ' ' || p.PE_PE_PRENOM AS label, COUNT(DISTINCT pos.IDTHEME) AS total
-    FROM POSITIONNEMENT pos
+    FROM POSITIONS pos
     JOIN PERSONNE p ON p."PE_PE_COD#" = pos.IDPERS
-    WHERE pos.LIBELLETEMPORALITE = 'Présent'
+    WHERE pos.CODE_TEMPORALITE = {label_codes.PRESENT}
       AND {mf}
     GROUP BY p."PE_PE_COD#", p.PE_PE_NOM, p.PE_PE_PRENOM
     ORDER BY total DESC
@@ -1433,64 +1887,71 @@ def stats_top_researchers():
 
 @app.get("/api/stats/all_structures")
 @require_auth
+@cached_by_data_version
 def stats_all_structures():
     """Return all structures with their member count (Présent only), sorted by count."""
-    mf = _manu_filter("p")
-    sql = f"""
+    sql = """
     SELECT
-        p.IDSTRUCTURE AS id,
-        COALESCE(s.acronyme, CAST(p.IDSTRUCTURE AS TEXT)) AS acronyme,
-        COALESCE(p.LIBELLESTRUCTURE, CAST(p.IDSTRUCTURE AS TEXT)) AS label,
-        COUNT(DISTINCT p.IDPERS) AS cnt
-    FROM POSITIONNEMENT p
-    LEFT JOIN STRUCTURES s ON s.id = p.IDSTRUCTURE
-    WHERE p.IDSTRUCTURE IS NOT NULL
-      AND p.LIBELLETEMPORALITE = 'Présent'
-      AND {mf}
-    GROUP BY p.IDSTRUCTURE
-    ORDER BY cnt DESC
+        c.key_id AS id,
+        COALESCE(s.acronyme, CAST(c.key_id AS TEXT)) AS acronyme,
+        (SELECT MIN(l.key_label) FROM STATS_COUNT l
+          WHERE l.mode = c.mode AND l.dim = 'structure' AND l.key_id = c.key_id) AS label,
+        c.cnt
+    FROM STATS_COUNT c
+    LEFT JOIN STRUCTURES s ON s.id = c.key_id
+    WHERE c.mode = :m AND c.dim = 'structure_id'
+    ORDER BY c.cnt DESC
     """
-    rows = fetch_all(sql, {})
+    rows = fetch_all(sql, {"m": _stats_mode()})
     return jsonify(rows)
 
 
 @app.get("/api/stats/themes_coverage")
 @require_auth
+@cached_by_data_version
 def stats_themes_coverage():
     """Return level-1 themes (NIVEAU=1) with role breakdown (Expert/Contributeur/Utilisateur)."""
-    mf = _manu_filter("p")
-    sql = f"""
+    if STATS_ENGINE == 'columns':
+        return jsonify(analytics.get_columns().themes_coverage(_stats_mode()))
+    sql = """
     SELECT
         t."CS_TH_COD#" AS id,
         t.THEME AS label,
-        COUNT(DISTINCT CASE WHEN p.LIBCONTRIBUTION = 'Expert' THEN p.IDPERS END) AS experts,
-        COUNT(DISTINCT CASE WHEN p.LIBCONTRIBUTION = 'Contributeur' THEN p.IDPERS END) AS contributeurs,
-        COUNT(DISTINCT CASE WHEN p.LIBCONTRIBUTION = 'Utilisateur' THEN p.IDPERS END) AS utilisateurs,
-        COUNT(DISTINCT p.IDPERS) AS total
+        COALESCE(e.cnt, 0) AS experts,
+        COALESCE(c.cnt, 0) AS contributeurs,
+        COALESCE(u.cnt, 0) AS utilisateurs,
+        tot.cnt AS total
     FROM THEMES t
-    JOIN POSITIONNEMENT p ON p.IDTHEME = t."CS_TH_COD#"
+    JOIN STATS_COUNT tot
+      ON tot.mode = :m AND tot.dim = 'theme' AND tot.key_id = t."CS_TH_COD#" AND tot.key_label = ''
+    LEFT JOIN STATS_COUNT e
+      ON e.mode = :m AND e.dim = 'theme_role' AND e.key_id = t."CS_TH_COD#" AND e.key_label = 'Expert'
+    LEFT JOIN STATS_COUNT c
+      ON c.mode = :m AND c.dim = 'theme_role' AND c.key_id = t."CS_TH_COD#" AND c.key_label = 'Contributeur'
+    LEFT JOIN STATS_COUNT u
+      ON u.mode = :m AND u.dim = 'theme_role' AND u.key_id = t."CS_TH_COD#" AND u.key_label = 'Utilisateur'
     WHERE t.NIVEAU = 1
-      AND p.LIBELLETEMPORALITE = 'Présent'
-      AND {mf}
-    GROUP BY t."CS_TH_COD#", t.THEME
     ORDER BY total DESC
     """
-    rows = fetch_all(sql, {})
+    rows = fetch_all(sql, {"m": _stats_mode()})
     return jsonify(rows)
 
 @app.get("/api/stats/people_count")
 @require_auth
+@cached_by_data_version
 def people_count():
     sid = request.args.get("structure_id", type=int)
     tid = request.args.get("theme_id", type=int)
     limit = int(request.args.get("limit", 15))
     mf = _manu_filter("p")
+    if STATS_ENGINE == 'columns' and (sid or tid):
+        return jsonify(analytics.get_columns().people_count(_stats_mode(), sid or None, tid or None, limit))
 
     if sid and tid:
         sql = f"""
           SELECT COUNT(DISTINCT p.IDPERS) AS cnt
-          FROM POSITIONNEMENT p
-          WHERE p.LIBELLETEMPORALITE = 'Présent'
+          FROM POSITIONS p
+          WHERE p.CODE_TEMPORALITE = {label_codes.PRESENT}
             AND p.IDSTRUCTURE = :sid
             AND p.IDTHEME = :tid
             AND {mf}
@@ -1503,9 +1964,9 @@ def people_count():
         SELECT t."CS_TH_COD#" AS id,
                t.THEME      AS label,
                COUNT(DISTINCT p.IDPERS) AS cnt
-        FROM POSITIONNEMENT p
+        FROM POSITIONS p
         JOIN THEMES t ON t."CS_TH_COD#" = p.IDTHEME
-        WHERE p.LIBELLETEMPORALITE = 'Présent'
+        WHERE p.CODE_TEMPORALITE = {label_codes.PRESENT}
           AND p.IDSTRUCTURE = :sid
           AND {mf}
         GROUP BY t."CS_TH_COD#", t.THEME
@@ -1518,14 +1979,15 @@ def people_count():
     if tid and not sid:
         sql = f"""
         SELECT p.IDSTRUCTURE AS id,
-               COALESCE(p.LIBELLESTRUCTURE, CAST(p.IDSTRUCTURE AS TEXT)) AS label,
+               COALESCE(ls.LABEL, CAST(p.IDSTRUCTURE AS TEXT)) AS label,
                COUNT(DISTINCT p.IDPERS) AS cnt
-        FROM POSITIONNEMENT p
-        WHERE p.LIBELLETEMPORALITE = 'Présent'
+        FROM POSITIONS p
+        LEFT JOIN LABELS ls ON ls.CODE = p.CODE_STRUCTURE
+        WHERE p.CODE_TEMPORALITE = {label_codes.PRESENT}
           AND p.IDTHEME = :tid
           AND p.IDSTRUCTURE IS NOT NULL
           AND {mf}
-        GROUP BY p.IDSTRUCTURE, COALESCE(p.LIBELLESTRUCTURE, CAST(p.IDSTRUCTURE AS TEXT))
+        GROUP BY p.IDSTRUCTURE, COALESCE(ls.LABEL, CAST(p.IDSTRUCTURE AS TEXT))
         ORDER BY cnt DESC
         LIMIT :limit
         """
@@ -1535,5 +1997,136 @@ def people_count():
     abort(400, description="Provide structure_id and/or theme_id")
 
 
+# Cube: distinct persons of the positions kept by any combination of
+# filters, grouped along one dimension.  Read from the bitsets of
+# bitmap_index.py (cells per theme, structure and facet, rolled up along
+# the theme hierarchy), so drill-downs run no SQL.
+CUBE_MODES = {"manu": "MANU", "auto": "AUTO", "all": "*"}
+
+def _cube_row(bm, by, key):
+    """{id, label} of a group of PositionBitmaps.cube(), None to drop it."""
+    if by == "theme":
+        return {"id": key, "label": bm.themes.label(key)} if key in bm.themes else None
+    if by == "structure":
+        return None if key is None else {"id": key, "label": bm.structure_labels.get(key) or str(key)}
+    if by == "auto":
+        return {"id": "auto" if key else "manu", "label": "Auto" if key else "Manuel"}
+    label = bm.labels.get(key)
+    return {"id": label, "label": label or "(N/A)"}
+
+@app.get("/api/stats/cube")
+@require_auth
+@cached_by_data_version
+def stats_cube():
+    """Distinct persons grouped by ?by=theme|structure|role|temporalite|auto,
+    filtered by structure_id and theme_id (repeatable), include_desc, role,
+    temporalite and mode (manu|auto|all)."""
+    by = (request.args.get("by") or "theme").strip().lower()
+    if by not in bitmap_index.CUBE_DIMENSIONS:
+        abort(400, description=f"Dimension inconnue : {by}")
+    mode = CUBE_MODES.get((request.args.get("mode") or "manu").lower(), "MANU")
+    structures = request.args.getlist("structure_id", type=int) or None
+    themes = request.args.getlist("theme_id", type=int) or None
+    include_desc = _as_bool(request.args.get("include_desc", "1"))
+    limit = request.args.get("limit", -1, type=int)
+
+    bm = bitmap_index.get_bitmaps()
+    facets = bm.facets(_star(request.args.get("role")), _star(request.args.get("temporalite")), mode)
+    rows, total = [], 0
+    for key, bits in bm.cube(by, themes, facets, structures, include_desc).items():
+        row = _cube_row(bm, by, key)
+        if row is not None and bits:
+            rows.append({**row, "cnt": bits.bit_count()})
+            total |= bits
+    rows.sort(key=lambda r: (-r["cnt"], str(r["id"])))
+    return jsonify({"by": by, "total": total.bit_count(),
+                    "rows": rows if limit < 0 else rows[:limit]})
+
+
+# --------- DASHBOARD (batched) ---------
+# One round trip for the whole dashboard: every widget is one of the
+# GET /api/stats/* endpoints above, run in-process against a single pooled
+# connection and read snapshot (db.read_snapshot), behind the same
+# response cache.  Body:
+#   {"mode": "manu", "stream": false,
+#    "widgets": ["overview", {"id": "top/themes", "limit": 10, "key": "top10"}, ...]}
+# Reply: {"mode", "data_version", "widgets": {key: payload}, "errors": {key: {...}}}
+# or, with "stream": true, one NDJSON line {"id", "status", "data"} per widget.
+def _stats_widgets():
+    """widget id -> view function (inside @require_auth) of GET /api/stats/*."""
+    out = {}
+    for rule in app.url_map.iter_rules():
+        if rule.rule.startswith('/api/stats/') and 'GET' in rule.methods and not rule.arguments:
+            view = app.view_functions[rule.endpoint]
+            out[rule.rule[len('/api/stats/'):]] = getattr(view, '__wrapped__', view)
+    return out
+
+
+def _widget_specs(body):
+    mode = str(body.get('mode') or 'manu')
+    specs = []
+    for w in body.get('widgets') or []:
+        if isinstance(w, str):
+            w = {'id': w}
+        if not isinstance(w, dict) or not w.get('id'):
+            abort(400, description="widgets: liste d'identifiants ou d'objets {id, ...}")
+        args = {k: str(v) for k, v in w.items() if k not in ('id', 'key') and v is not None}
+        args.setdefault('mode', mode)
+        specs.append((str(w.get('key') or w['id']), str(w['id']), args))
+    if not specs:
+        abort(400, description="widgets requis")
+    return mode, specs
+
+
+def _run_widget(views, wid, args):
+    """Run one widget in a nested request context; returns (status, JSON bytes)."""
+    view = views.get(wid)
+    if view is None:
+        return 404, json.dumps({"error": f"Widget inconnu : {wid}"}).encode('utf-8')
+    role, user = getattr(request, 'role', 'admin'), getattr(request, 'user', None)
+    with app.test_request_context('/api/stats/' + wid, query_string=args):
+        request.role, request.user = role, user
+        try:
+            resp = app.make_response(view())
+        except HTTPException as e:
+            return e.code, json.dumps({"error": e.description}).encode('utf-8')
+    if resp.status_code != 200:
+        return resp.status_code, json.dumps({"error": resp.status}).encode('utf-8')
+    return 200, resp.get_data()
+
+
+@app.post("/api/stats/dashboard")
+@require_auth
+def stats_dashboard():
+    body = request.get_json(force=True, silent=True) or {}
+    mode, specs = _widget_specs(body)
+    views = _stats_widgets()
+
+    if _as_bool(body.get('stream')):
+        def generate():
+            with read_snapshot():
+                for key, wid, args in specs:
+                    status, data = _run_widget(views, wid, args)
+                    yield (b'{"id": ' + json.dumps(key).encode('utf-8')
+                           + b', "status": ' + str(status).encode()
+                           + b', "data": ' + data.strip() + b'}\n')
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+    widgets, errors = [], {}
+    with read_snapshot():
+        version = data_version()
+        for key, wid, args in specs:
+            status, data = _run_widget(views, wid, args)
+            if status == 200:
+                widgets.append(json.dumps(key).encode('utf-8') + b': ' + data.strip())
+            else:
+                errors[key] = {"status": status, "error": json.loads(data).get("error")}
+    out = (b'{"mode": ' + json.dumps(mode).encode('utf-8')
+           + b', "data_version": ' + str(version).encode()
+           + b', "widgets": {' + b', '.join(widgets) + b'}'
+           + b', "errors": ' + json.dumps(errors, ensure_ascii=False).encode('utf-8') + b'}')
+    return Response(out, mimetype='application/json')
+
+
 if __name__ == "__main__":
     app.run(debug=True, use_reloader=False, host="127.0.0.1", port=5000)
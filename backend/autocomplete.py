@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+autocomplete.py - In-memory autocomplete behind the /find endpoints.
+
+A Completer holds the entries of one picker (people, themes or
+structures) in display order, with two indexes over their lower-cased,
+accent-folded text (fold()):
+
+  * a prefix trie of the words: the node of a prefix lists, in display
+    order, the entries having a word that starts with it;
+  * a trigram index of the whole text, for substrings inside words
+    ("pont" -> "Dupont"), each candidate being checked against the text.
+
+complete(q, k) returns the first k entries whose words start with every
+word of q, then, for q of 3 characters or more, the other entries
+containing q.  No SQLite access at query time.
+
+The completers are loaded in the background at startup (warm_up) and
+rebuilt on the first lookup of their picker after a change of the
+DB_META key they follow (VERSION_KEYS), each under its own lock.
+"""
+import re
+import threading
+import unicodedata
+
+from db import data_version, fetch_all, fetch_one, wait_ready
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def fold(text):
+    """Lower case without accents: 'Modélisation' -> 'modelisation'."""
+    text = unicodedata.normalize("NFKD", (text or "").casefold())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+class Completer:
+    """Immutable lookup structure over (payload, words, text) entries
+    given in display order."""
+
+    def __init__(self, entries, version=None):
+        self.version = version
+        self.payloads = []
+        self.texts = []
+        self.trie = ({}, [])       # node: (children by char, entry ids)
+        self.trigrams = {}         # trigram -> entry ids
+        for i, (payload, words, text) in enumerate(entries):
+            self.payloads.append(payload)
+            for word in {w for word in words for w in _WORD_RE.findall(fold(word))}:
+                node = self.trie
+                for ch in word:
+                    node = node[0].setdefault(ch, ({}, []))
+                    if not node[1] or node[1][-1] != i:
+                        node[1].append(i)
+            text = fold(text)
+            self.texts.append(text)
+            for j in range(len(text) - 2):
+                ids = self.trigrams.setdefault(text[j:j + 3], [])
+                if not ids or ids[-1] != i:
+                    ids.append(i)
+
+    def __len__(self):
+        return len(self.payloads)
+
+    def _prefixed(self, word):
+        node = self.trie
+        for ch in word:
+            node = node[0].get(ch)
+            if node is None:
+                return []
+        return node[1]
+
+    def _word_hits(self, words):
+        """Entries having, for every word, a word starting with it."""
+        lists = sorted((self._prefixed(w) for w in set(words)), key=len)
+        if len(lists) == 1 or not lists[0]:
+            return lists[0]
+        others = [set(ids) for ids in lists[1:]]
+        return [i for i in lists[0] if all(i in s for s in others)]
+
+    def _substring_hits(self, q):
+        """Entries whose text contains `q` (at least 3 characters)."""
+        lists = sorted((self.trigrams.get(q[j:j + 3], ()) for j in range(len(q) - 2)), key=len)
+        if not lists[0]:
+            return []
+        others = [set(ids) for ids in lists[1:]]
+        return [i for i in lists[0]
+                if all(i in s for s in others) and q in self.texts[i]]
+
+    def complete(self, q, k=25):
+        """Payloads of the first `k` entries matching `q` (see module doc)."""
+        q = fold(q).strip()
+        if not q:
+            return self.payloads[:k]
+        words = _WORD_RE.findall(q)
+        hits = self._word_hits(words) if words else []
+        out = hits[:k]
+        if len(out) < k and len(q) >= 3:
+            seen = set(out)
+            for i in self._substring_hits(q):
+                if i not in seen:
+                    out.append(i)
+                    if len(out) == k:
+                        break
+        return [self.payloads[i] for i in out]
+
+
+# ── Pickers ──────────────────────────────────────────────────────────
+# Each loader returns the entries of a picker in the order of the
+# matching SQL endpoint (payload = its JSON row).
+def _people():
+    rows = fetch_all("""
+        SELECT "PE_PE_COD#" AS idpers, PE_PE_NOM AS nom, PE_PE_PRENOM AS prenom
+        FROM PERSONNE
+        ORDER BY PE_PE_NOM, PE_PE_PRENOM
+    """, {})
+    return [(r, (r["nom"], r["prenom"], str(r["idpers"])), f"{r['nom']} {r['prenom'] or ''}")
+            for r in rows]
+
+
+def _themes():
+    rows = fetch_all("""
+        SELECT "CS_TH_COD#" AS id, THEME AS label FROM THEMES ORDER BY THEME
+    """, {})
+    return [(r, (r["label"],), r["label"]) for r in rows]
+
+
+def _structures():
+    rows = fetch_all("""
+        SELECT l.IDSTRUCTURE AS id,
+               COALESCE(NULLIF(l.LIBELLESTRUCTURE, ''), CAST(l.IDSTRUCTURE AS TEXT)) AS label,
+               COALESCE(s.acronyme, CAST(l.IDSTRUCTURE AS TEXT)) AS acronyme,
+               s.libelle
+        FROM STRUCTURE_LABELS l
+        LEFT JOIN STRUCTURES s ON s.id = l.IDSTRUCTURE
+        ORDER BY label
+    """, {})
+    out = []
+    for r in rows:
+        libelle = r.pop("libelle") or ""
+        words = (r["acronyme"], r["label"], libelle, str(r["id"]))
+        out.append((r, words, f"{r['label']} {r['acronyme']} {libelle} {r['id']}"))
+    return out
+
+
+LOADERS = {"people": _people, "themes": _themes, "structures": _structures}
+
+# DB_META key of each picker: position writes only move data_version, which
+# the structures follow (STRUCTURE_LABELS tracks POSITIONS)
+VERSION_KEYS = {"people": "persons_version", "themes": "themes_version",
+                "structures": "data_version"}
+
+_locks = {kind: threading.Lock() for kind in LOADERS}
+_completers = {}
+
+
+def _version(kind):
+    """Current version of picker `kind`; data_version for a database built
+    without its key."""
+    row = fetch_one("SELECT value FROM DB_META WHERE key = :key", {"key": VERSION_KEYS[kind]})
+    return row["value"] if row else str(data_version())
+
+
+def get_completer(kind):
+    """Process-wide Completer of picker `kind`, rebuilt if its source changed."""
+    version = _version(kind)
+    c = _completers.get(kind)
+    if c is not None and c.version == version:
+        return c
+    with _locks[kind]:
+        c = _completers.get(kind)
+        if c is None or c.version != version:
+            c = _completers[kind] = Completer(LOADERS[kind](), version)
+        return c
+
+
+def warm_up():
+    """Load every completer in a background thread once the database is ready."""
+    def run():
+        try:
+            if wait_ready():
+                for kind in LOADERS:
+                    get_completer(kind)
+        except Exception as e:
+            print(f"  [autocomplete] Échec du préchargement : {e}")
+
+    threading.Thread(target=run, name="csr-autocomplete", daemon=True).start()
+
+
+def stats():
+    return {kind: {"entries": len(c), VERSION_KEYS[kind]: c.version}
+            for kind, c in list(_completers.items())}
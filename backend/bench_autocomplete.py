@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+bench_autocomplete.py - Latency of the /find autocompletes.
+
+Replays what a user types in the three pickers (every prefix of real
+names, themes and acronyms, plus a few substrings taken inside words)
+and times, per keystroke:
+
+  like             the former LOWER(...) LIKE '%q%' queries (reference)
+  memory           Completer.complete() alone (autocomplete.py)
+  endpoint fts     GET /api/<picker>/find with CSR_AUTOCOMPLETE=fts
+  endpoint memory  GET /api/<picker>/find with CSR_AUTOCOMPLETE=memory
+
+The endpoint lines include the request overhead (auth, JSON).
+Reports the median and 95th percentile in microseconds.
+
+Usage:  python bench_autocomplete.py [-n REPEAT]
+"""
+import io
+import os
+import statistics
+import sys
+import time
+from contextlib import redirect_stdout
+
+if sys.platform == "win32":
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding="utf-8", errors="replace")
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Queries before the FTS5 index (search_index.py), for comparison
+LIKE_SQL = {
+    "people": """
+        SELECT per."PE_PE_COD#" AS idpers, per.PE_PE_NOM AS nom, per.PE_PE_PRENOM AS prenom
+        FROM PERSONNE per
+        WHERE LOWER(per.PE_PE_NOM) LIKE :q OR LOWER(per.PE_PE_PRENOM) LIKE :q
+        ORDER BY per.PE_PE_NOM, per.PE_PE_PRENOM
+        LIMIT 25
+    """,
+    "themes": """
+        SELECT t."CS_TH_COD#" AS id, t.THEME AS label
+        FROM THEMES t
+        WHERE LOWER(t.THEME) LIKE :q
+        ORDER BY t.THEME
+        LIMIT 25
+    """,
+    "structures": """
+        SELECT DISTINCT
+               p.IDSTRUCTURE AS id,
+               COALESCE(p.LIBELLESTRUCTURE, CAST(p.IDSTRUCTURE AS TEXT)) AS label,
+               COALESCE(s.acronyme, CAST(p.IDSTRUCTURE AS TEXT)) AS acronyme
+        FROM POSITIONNEMENT p
+        LEFT JOIN STRUCTURES s ON s.id = p.IDSTRUCTURE
+        WHERE p.IDSTRUCTURE IS NOT NULL
+          AND (LOWER(COALESCE(p.LIBELLESTRUCTURE, '')) LIKE :q
+               OR CAST(p.IDSTRUCTURE AS TEXT) LIKE :q
+               OR LOWER(COALESCE(s.acronyme, '')) LIKE :q)
+        ORDER BY label
+        LIMIT 25
+    """,
+}
+
+
+def typed_queries(words, limit=40):
+    """Keystroke sequences for up to `limit` words, plus inner substrings."""
+    out = []
+    for w in sorted({w.lower() for w in words if w and len(w) >= 3})[:limit]:
+        out += [w[:i] for i in range(1, min(len(w), 8) + 1)]
+        if len(w) >= 6:
+            out.append(w[2:6])
+    return out
+
+
+def _time(fn, queries, repeat):
+    samples = []
+    for _ in range(repeat):
+        for q in queries:
+            t0 = time.perf_counter()
+            fn(q)
+            samples.append((time.perf_counter() - t0) * 1e6)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.95) - 1]
+
+
+def main(repeat=5):
+    with redirect_stdout(io.StringIO()):
+        import db
+        import app as app_module
+        import autocomplete
+        db.wait_ready()
+
+    words = {
+        "people": [r["w"] for r in db.fetch_all("SELECT PE_PE_NOM AS w FROM PERSONNE", {})],
+        "themes": [w for r in db.fetch_all("SELECT THEME AS w FROM THEMES", {})
+                   for w in (r["w"] or "").split()],
+        "structures": [r["w"] for r in db.fetch_all(
+            "SELECT acronyme AS w FROM STRUCTURES WHERE acronyme IS NOT NULL", {})],
+    }
+
+    client = app_module.app.test_client()
+    tok = client.post("/api/login", json={"username": "admin", "password": "admin"}).get_json()["access_token"]
+    headers = {"Authorization": "Bearer " + tok}
+
+    def endpoint(kind, mode):
+        def call(q):
+            app_module.AUTOCOMPLETE = mode
+            client.get(f"/api/{kind}/find", query_string={"q": q}, headers=headers)
+        return call
+
+    initial = app_module.AUTOCOMPLETE
+    print(f"  {'picker':<11}{'backend':<18}{'median µs':>11}{'p95 µs':>11}")
+    try:
+        for kind in ("people", "themes", "structures"):
+            queries = typed_queries(words[kind])
+            completer = autocomplete.get_completer(kind)
+            runs = {
+                "like": lambda q, k=kind: db.fetch_all(LIKE_SQL[k], {"q": f"%{q}%"}),
+                "memory": lambda q, c=completer: c.complete(q, 25),
+                "endpoint fts": endpoint(kind, "fts"),
+                "endpoint memory": endpoint(kind, "memory"),
+            }
+            for name, fn in runs.items():
+                med, p95 = _time(fn, queries, repeat)
+                print(f"  {kind:<11}{name:<18}{med:>11.1f}{p95:>11.1f}")
+            print(f"  {'':<11}({len(queries)} requêtes x {repeat})")
+    finally:
+        app_module.AUTOCOMPLETE = initial
+
+
+if __name__ == "__main__":
+    n = 5
+    if "-n" in sys.argv:
+        n = int(sys.argv[sys.argv.index("-n") + 1])
+    main(n)
@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+"""
+bitmap_index.py - In-memory bitmaps of POSITIONS for the CSR set queries.
+
+Most CSR queries (people_by_themes with match ALL, the *_excluding
+variants, themes_in_S_not_in_Sp...) are unions, intersections and
+differences of sets of persons or of themes.  A PositionBitmaps snapshot
+keeps those sets as Python ints used as bitsets:
+
+  * person bitsets: bit i = i-th IDPERS of POSITIONS (ascending),
+    one per cell (IDTHEME, IDSTRUCTURE, LIBELLESTRUCTURE, facet), merged
+    per (theme, structure, facet) for the theme alone and for its whole
+    subtree (computed bottom-up once, so include_desc costs nothing);
+  * theme bitsets: bit i = i-th theme of the ThemeIndex pre-order, so
+    that a subtree is a contiguous range of bits, one per
+    (IDSTRUCTURE, facet);
+
+a facet being (CODE_CONTRIBUTION, CODE_TEMPORALITE, AUTO), the label
+codes of LABELS.
+A query keeps the facets matching its role / temporality / mode filters
+(facets()), then combines bitsets with |, & and & ~; SQL only fetches
+the rows of the resulting ids afterwards (app.py, BITMAP_QUERIES).
+
+The same cells, rolled up along the theme hierarchy, are the cube of
+GET /api/stats/cube: cube() groups them along one dimension and the
+distinct-person counts are popcounts of the merged bitsets.
+
+The snapshot is rebuilt on the first query after a change of
+DB_META.data_version or of the theme index.
+"""
+import threading
+
+from db import data_version, fetch_all, read_snapshot
+from theme_index import get_theme_index
+
+# Reads the idx_pos_struct_cover index only
+LOAD_SQL = """
+    SELECT IDPERS AS idpers, IDTHEME AS idtheme, IDSTRUCTURE AS idstructure,
+           CODE_STRUCTURE AS label, CODE_CONTRIBUTION AS role,
+           CODE_TEMPORALITE AS temp, AUTO AS auto
+    FROM POSITIONS
+"""
+LABELS_SQL = "SELECT CODE AS code, LABEL AS label FROM LABELS"
+
+# Key of the positions of every structure (IDSTRUCTURE NULL included)
+ANY = "*"
+
+# Grouping dimensions of cube(): theme, structure, then the facet fields
+CUBE_DIMENSIONS = ("theme", "structure", "role", "temporalite", "auto")
+
+
+def _bits(slots):
+    """Bitset with the given bit numbers set."""
+    if not slots:
+        return 0
+    buf = bytearray((max(slots) >> 3) + 1)
+    for s in slots:
+        buf[s >> 3] |= 1 << (s & 7)
+    return int.from_bytes(buf, "little")
+
+
+def _slots(bits):
+    """Bit numbers set in `bits`, ascending."""
+    return [i for i, c in enumerate(reversed(bin(bits)[2:])) if c == "1"]
+
+
+class PositionBitmaps:
+    """Immutable snapshot of POSITIONS; build with
+    PositionBitmaps(rows of LOAD_SQL, ThemeIndex, version, {code: label})."""
+
+    def __init__(self, rows, themes, version=None, labels=None):
+        self.version = version
+        self.themes = themes
+        self.labels = labels or {}
+        self.person_ids = sorted({r["idpers"] for r in rows})
+        person_slot = {pid: i for i, pid in enumerate(self.person_ids)}
+
+        cells = {}       # (theme, structure, label, facet) -> person slots
+        covered = {}     # (structure, facet) -> theme slots
+        for r in rows:
+            facet = (r["role"], r["temp"], bool(r["auto"]))
+            key = (r["idtheme"], r["idstructure"], self.labels.get(r["label"]), facet)
+            cells.setdefault(key, set()).add(person_slot[r["idpers"]])
+            i = themes.pos.get(r["idtheme"])
+            if i is not None and themes.pre[i] >= 0:
+                covered.setdefault((r["idstructure"], facet), set()).add(themes.pre[i])
+
+        self.cells = {}          # theme -> [(structure, label, facet, persons)]
+        self.direct = {}         # theme -> {structure or ANY: {facet: persons}}
+        for (tid, sid, label, facet), slots in cells.items():
+            bits = _bits(slots)
+            self.cells.setdefault(tid, []).append((sid, label, facet, bits))
+            by_sid = self.direct.setdefault(tid, {})
+            for key in (sid, ANY):
+                by_facet = by_sid.setdefault(key, {})
+                by_facet[facet] = by_facet.get(facet, 0) | bits
+        self.structures = {}     # structure (None included) -> {facet: themes}
+        for (sid, facet), slots in covered.items():
+            self.structures.setdefault(sid, {})[facet] = _bits(slots)
+        self.facet_set = {key[3] for key in cells}
+        self.structure_labels = {}   # structure -> smallest of its labels
+        for _, sid, label, _ in cells:
+            if label is not None:
+                self.structure_labels[sid] = min(label, self.structure_labels.get(sid, label))
+        self.n_cells = len(cells)
+
+        # Every theme merged: the apex of cube()
+        self.apex = {}           # structure or ANY -> {facet: persons}
+        for by_sid in self.direct.values():
+            for key, by_facet in by_sid.items():
+                into = self.apex.setdefault(key, {})
+                for facet, bits in by_facet.items():
+                    into[facet] = into.get(facet, 0) | bits
+
+        # Same as direct for a theme and its descendants, children first
+        self.with_desc = {}
+        for node in reversed(themes.order):
+            merged = {k: dict(v) for k, v in self.direct.get(themes.ids[node], {}).items()}
+            for child in themes.children[node]:
+                for key, by_facet in self.with_desc[themes.ids[child]].items():
+                    into = merged.setdefault(key, {})
+                    for facet, bits in by_facet.items():
+                        into[facet] = into.get(facet, 0) | bits
+            self.with_desc[themes.ids[node]] = merged
+
+    # ── Filters ─────────────────────────────────────────────────────
+    def facets(self, role="*", temp="*", mode="*"):
+        """Facets kept by the filters of app._role_temp_mode_where ('*' = any,
+        otherwise a label)."""
+        labels = self.labels
+
+        def keep(facet):
+            r, t, auto = facet
+            return ((role == "*" or labels.get(r) == role) and (temp == "*" or labels.get(t) == temp)
+                    and (mode == "*" or (mode == "AUTO" and auto) or (mode == "MANU" and not auto)))
+        return frozenset(f for f in self.facet_set if keep(f))
+
+    def expand(self, theme_ids, include_desc=True):
+        """Theme ids of a query: with their descendants if include_desc."""
+        if include_desc:
+            return set(self.themes.descendants(theme_ids))
+        return {int(t) for t in theme_ids}
+
+    # ── Person sets ─────────────────────────────────────────────────
+    def persons(self, theme_ids, facets, structure=None, include_desc=True):
+        """Persons with a position on one of `theme_ids` (every theme if
+        None) or, with include_desc, on one of their descendants, of a
+        kept facet and, if given, in `structure`."""
+        table = self.with_desc if include_desc else self.direct
+        key = ANY if structure is None else structure
+        bits = 0
+        for tid in (self.direct if theme_ids is None else theme_ids):
+            for facet, b in table.get(int(tid), {}).get(key, {}).items():
+                if facet in facets:
+                    bits |= b
+        return bits
+
+    def groups(self, theme_ids, facets, structure=None):
+        """Positions on `theme_ids` (see expand()) of a kept facet and, if
+        given, in `structure`, as {(IDSTRUCTURE, LIBELLESTRUCTURE): persons}:
+        the distinct rows of the ANY queries."""
+        out = {}
+        for tid in theme_ids:
+            for sid, label, facet, b in self.cells.get(tid, ()):
+                if facet in facets and (structure is None or sid == structure):
+                    out[sid, label] = out.get((sid, label), 0) | b
+        return out
+
+    def cube(self, by, theme_ids, facets, structures=None, include_desc=True):
+        """Persons of the positions kept by the filters, grouped along `by`
+        (one of CUBE_DIMENSIONS) as {key: persons}.  Filters as persons(),
+        `structures` being a list (None = any structure); with by='theme'
+        each theme stands for its whole subtree if include_desc."""
+        if theme_ids is None and by == "theme":
+            table = self.with_desc if include_desc else self.direct
+            tids = table
+        elif theme_ids is None:
+            table, tids = {None: self.apex}, [None]
+        else:
+            table = self.with_desc if include_desc else self.direct
+            tids = [int(t) for t in theme_ids]
+        field = CUBE_DIMENSIONS.index(by) - 2     # facet field of the others
+        out = {}
+        for tid in tids:
+            by_sid = table.get(tid, {})
+            if structures is not None:
+                sids = structures
+            else:
+                sids = [s for s in by_sid if s != ANY] if by == "structure" else [ANY]
+            for sid in sids:
+                for facet, b in by_sid.get(sid, {}).items():
+                    if facet in facets:
+                        key = tid if by == "theme" else sid if by == "structure" else facet[field]
+                        out[key] = out.get(key, 0) | b
+        return out
+
+    def tree_counts(self, facets, roles):
+        """{theme: (direct, subtree)} distinct persons of a kept facet on
+        the theme alone and on its whole subtree (the bottom-up merge of
+        with_desc), each as {"total": n, name: n for name, code in roles}."""
+        def count(by_facet):
+            total, by_role = 0, {}
+            for facet, b in by_facet.items():
+                if facet in facets:
+                    total |= b
+                    by_role[facet[0]] = by_role.get(facet[0], 0) | b
+            out = {"total": total.bit_count()}
+            for name, code in roles.items():
+                out[name] = by_role.get(code, 0).bit_count()
+            return out
+
+        return {tid: (count(self.direct.get(tid, {}).get(ANY, {})), count(merged.get(ANY, {})))
+                for tid, merged in self.with_desc.items()}
+
+    def person_list(self, bits):
+        return [self.person_ids[i] for i in _slots(bits)]
+
+    # ── Theme sets ──────────────────────────────────────────────────
+    def covered(self, structures, facets):
+        """Themes with a position of a kept facet in one of `structures`
+        (in any structure, or none, if `structures` is None)."""
+        bits = 0
+        for sid in (self.structures if structures is None else structures):
+            for facet, b in self.structures.get(sid, {}).items():
+                if facet in facets:
+                    bits |= b
+        return bits
+
+    def all_themes(self):
+        return (1 << len(self.themes.order)) - 1
+
+    def subtree(self, tid, strict=True):
+        """Themes of the subtree of `tid` (without `tid` if strict)."""
+        i = self.themes.pos.get(int(tid))
+        if i is None or self.themes.pre[i] < 0:
+            return 0
+        lo = self.themes.pre[i] + (1 if strict else 0)
+        return ((1 << (self.themes.post[i] + 1 - lo)) - 1) << lo
+
+    def theme_list(self, bits):
+        t = self.themes
+        return [t.ids[t.order[i]] for i in _slots(bits)]
+
+
+_lock = threading.Lock()
+_bitmaps = None
+
+
+def _load(themes):
+    """PositionBitmaps of the current data, version and rows read in one
+    snapshot."""
+    with read_snapshot():
+        version = data_version()
+        rows = fetch_all(LOAD_SQL, {})
+        labels = {r["code"]: r["label"] for r in fetch_all(LABELS_SQL, {})}
+    return PositionBitmaps(rows, themes, version, labels)
+
+
+def get_bitmaps():
+    """Process-wide PositionBitmaps, rebuilt if the data or THEMES changed.
+
+    The rebuild runs outside _lock, on the caller's connection, and is then
+    swapped in: callers never wait on each other (concurrent ones after a
+    write may each build a snapshot; the newest is kept).
+    """
+    global _bitmaps
+    version = data_version()
+    themes = get_theme_index()
+    bm = _bitmaps
+    if bm is not None and bm.version == version and bm.themes is themes:
+        return bm
+    bm = _load(themes)
+    with _lock:
+        if _bitmaps is None or _bitmaps.version <= bm.version:
+            _bitmaps = bm
+    return bm
+
+
+def stats():
+    bm = _bitmaps
+    if bm is None:
+        return {"loaded": False}
+    return {"loaded": True, "data_version": bm.version, "persons": len(bm.person_ids),
+            "cells": bm.n_cells, "facets": len(bm.facet_set)}
@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+"""
+check_query_plans.py - EXPLAIN QUERY PLAN regression check for app.py.
+
+Replays every registered endpoint (all GET /api/* routes, people search,
+every CSR query of CSR_QUERIES, position writes) against a throw-away copy
+of csr.db, captures each SQL statement actually executed and runs
+EXPLAIN QUERY PLAN on it.  The script exits with status 1 if any plan
+falls back to a full scan of a fact table (see FACT_TABLES); scans of
+the small reference tables (THEMES, PERSONNE, STRUCTURES...) and covering
+index scans are accepted.
+
+Usage:  python check_query_plans.py [-v]
+"""
+import base64
+import io
+import json
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+from contextlib import redirect_stdout
+
+if sys.platform == "win32":
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding="utf-8", errors="replace")
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Tables that grow with the data: a plain SCAN of these is a regression.
+FACT_TABLES = {"POSITIONS", "POSITIONNEMENT", "THEME_CLOSURE", "STATS_MEMBER", "STATS_COUNT"}
+
+_SQL_KEYWORDS = {"WHERE", "JOIN", "ON", "LEFT", "INNER", "CROSS", "GROUP", "ORDER",
+                 "USING", "WITH", "SET", "LIMIT", "HAVING", "UNION", "AND", "OR", "AS"}
+_FROM_RE = re.compile(r'\b(?:FROM|JOIN|INTO|UPDATE)\s+("?[A-Za-z_][\w#]*"?)(?:\s+(?:AS\s+)?([A-Za-z_]\w*))?',
+                      re.IGNORECASE)
+_SCAN_RE = re.compile(r"^SCAN (\S+)")
+
+
+def _aliases(sql):
+    """Map every alias (and bare table name) used in `sql` to its table."""
+    out = {}
+    for table, alias in _FROM_RE.findall(sql):
+        table = table.strip('"').upper()
+        out[table] = table
+        if alias and alias.upper() not in _SQL_KEYWORDS:
+            out[alias.upper()] = table
+    return out
+
+
+def full_scans(conn, sql):
+    """Return the plan lines of `sql` that fully scan a fact table."""
+    aliases = _aliases(sql)
+    bad = []
+    for row in conn.execute("EXPLAIN QUERY PLAN " + sql):
+        detail = row[-1]
+        m = _SCAN_RE.match(detail)
+        if not m or "COVERING INDEX" in detail or "VIRTUAL TABLE" in detail:
+            continue
+        if aliases.get(m.group(1).upper(), m.group(1).upper()) in FACT_TABLES:
+            bad.append(detail)
+    return bad
+
+
+def _samples(db):
+    """Pick real ids from the database to feed the endpoints."""
+    one = lambda sql: (db.fetch_one(sql, {}) or {}).get("v")
+    return {
+        "root": one('SELECT "CS_TH_COD#" AS v FROM THEMES WHERE THEME_PARENT IS NULL ORDER BY 1 LIMIT 1'),
+        "themes": [r["v"] for r in db.fetch_all(
+            'SELECT IDTHEME AS v FROM POSITIONS GROUP BY IDTHEME ORDER BY COUNT(*) DESC LIMIT 2', {})],
+        "structs": [r["v"] for r in db.fetch_all(
+            "SELECT IDSTRUCTURE AS v FROM POSITIONS WHERE IDSTRUCTURE IS NOT NULL "
+            "GROUP BY IDSTRUCTURE ORDER BY COUNT(*) DESC LIMIT 2", {})],
+        "person": one("SELECT IDPERS AS v FROM POSITIONS WHERE AUTO = 0 ORDER BY 1 LIMIT 1"),
+    }
+
+
+def _csr_bodies(spec, smp):
+    """Sample request bodies for a CSR query from its `params` spec."""
+    base = {}
+    for name in spec:
+        if name in ("theme_ids",):
+            base[name] = smp["themes"][:2]
+        elif name == "exclude_theme_ids":
+            base[name] = smp["themes"][1:2]
+        elif name in ("structure_ids", "include_structures"):
+            base[name] = smp["structs"][:2]
+        elif name == "exclude_structures":
+            base[name] = smp["structs"][1:2]
+        elif name == "structure_id":
+            base[name] = smp["structs"][0]
+        elif name == "person_id":
+            base[name] = smp["person"]
+        elif name == "root_theme_id":
+            base[name] = smp["root"]
+    bodies = [base, {**base, "role": "Expert", "temporalite": "Présent", "mode": "MANU"}]
+    if "match" in spec:
+        bodies += [{**b, "match": "ALL"} for b in list(bodies)]
+    if "include_desc" in spec:
+        bodies += [{**b, "include_desc": False} for b in list(bodies)]
+    return bodies
+
+
+def _cursor(values):
+    """Pagination cursor ("after") carrying `values` as keyset."""
+    return base64.urlsafe_b64encode(json.dumps(values).encode("utf-8")).decode("ascii")
+
+
+def registered_calls(app_module, smp):
+    """(method, url, json) for every endpoint that touches the database."""
+    calls = []
+    extra = {
+        "/api/stats/people_count": [f"structure_id={smp['structs'][0]}&theme_id={smp['themes'][0]}",
+                                    f"structure_id={smp['structs'][0]}",
+                                    f"theme_id={smp['themes'][0]}"],
+        "/api/people/find": ["q=", "q=an", "q=1"],
+        "/api/themes/find": ["q=", "q=learn"],
+        "/api/structures/find": ["q=", "q=sig"],
+    }
+    for rule in app_module.app.url_map.iter_rules():
+        path = rule.rule
+        if not path.startswith("/api/") or rule.arguments or "GET" not in rule.methods:
+            continue
+        for args in extra.get(path, [""]):
+            for mode in ("manu", "all"):
+                sep = "&" if args else ""
+                calls.append(("GET", f"{path}?{args}{sep}mode={mode}", None))
+
+    widgets = [r.rule[len("/api/stats/"):] for r in app_module.app.url_map.iter_rules()
+               if r.rule.startswith("/api/stats/") and "GET" in r.methods and not r.arguments]
+    for mode in ("manu", "all"):
+        calls.append(("POST", "/api/stats/dashboard", {"mode": mode, "widgets": widgets}))
+
+    for inc in (True, False):
+        calls.append(("POST", "/api/people/search",
+                      {"theme_ids": smp["themes"], "include_desc": inc, "role": "Expert",
+                       "temporalite": "Présent", "mode": "MANU", "structure_id": smp["structs"][0]}))
+    calls.append(("POST", "/api/people/search",
+                  {"theme_ids": smp["themes"], "limit": 5,
+                   "after": _cursor([""] * len(app_module.PEOPLE_SEARCH_KEYSET))}))
+    for qid, q in app_module.CSR_QUERIES.items():
+        bodies = _csr_bodies(q["params"], smp)
+        for body in bodies:
+            calls.append(("POST", f"/api/queries/{qid}", body))
+        # keyset page after the first row of the keyset order
+        after = _cursor([""] * len(q["keyset"]))
+        calls.append(("POST", f"/api/queries/{qid}", {**bodies[0], "limit": 5, "after": after}))
+
+    pos = {"idpers": smp["person"], "idtheme": smp["themes"][0], "libcontr": "Expert",
+           "libtemp": "Présent", "idstruct": smp["structs"][0]}
+    calls.append(("POST", "/api/positions", pos))
+    calls.append(("DELETE", "/api/positions", pos))
+    calls.append(("POST", "/api/positions/bulk",
+                  {"operations": [{**pos, "op": "add"}, {**pos, "op": "delete"}]}))
+    return calls
+
+
+def main(verbose=False):
+    with redirect_stdout(io.StringIO()):
+        import db
+        import app as app_module
+        db.wait_ready()
+
+    # Work on a copy so that the position writes leave csr.db untouched
+    tmpdir = tempfile.mkdtemp(prefix="csr_plans_")
+    tmp_path = os.path.join(tmpdir, "csr.db")
+    src = sqlite3.connect(db.DB_PATH)
+    dst = sqlite3.connect(tmp_path)
+    src.backup(dst)
+    src.close()
+    dst.close()
+    db.DB_PATH = tmp_path
+    db.pool.reset()
+
+    statements = {}
+    current = {"call": None}
+
+    def _traced_factory(factory=db.pool._factory):
+        conn = factory()
+        conn.set_trace_callback(
+            lambda sql: statements.setdefault(sql.strip(), current["call"]))
+        return conn
+    db.pool._factory = _traced_factory
+
+    smp = _samples(db)
+    client = app_module.app.test_client()
+    tokens = {}
+    for user, pwd in (("admin", "admin"), ("guest", "")):
+        r = client.post("/api/login", json={"username": user, "password": pwd})
+        tokens[user] = r.get_json()["access_token"]
+
+    calls = registered_calls(app_module, smp)
+    for method, url, body in calls:
+        for user, tok in tokens.items():
+            current["call"] = f"{method} {url} [{user}]"
+            r = client.open(url, method=method, json=body,
+                            headers={"Authorization": "Bearer " + tok})
+            if r.status_code >= 500:
+                print(f"  [ERR] {current['call']} -> HTTP {r.status_code}")
+
+    check = sqlite3.connect(tmp_path)
+    failures = 0
+    checked = 0
+    for sql, origin in statements.items():
+        if origin is None:  # issued by _samples(), not by an endpoint
+            continue
+        head = sql.lstrip("( \n").split(None, 1)[0].upper() if sql else ""
+        if head not in ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE"):
+            continue
+        checked += 1
+        bad = full_scans(check, sql)
+        if bad:
+            failures += 1
+            print(f"  [FAIL] {origin}")
+            for line in bad:
+                print(f"         {line}")
+            if verbose:
+                print("         " + " ".join(sql.split())[:400])
+    check.close()
+
+    print(f"\n  {len(calls)} endpoint calls, {checked} distinct statements checked, "
+          f"{failures} with full scans of {', '.join(sorted(FACT_TABLES))}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(verbose="-v" in sys.argv))
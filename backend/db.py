@@ -4,20 +4,29 @@ db.py - SQLite database access layer for CSR prototype.
 Drop-in replacement for the Oracle-based version.
 Same API: fetch_all(), fetch_one(), execute()
 
-Auto-rebuild: on import, checks that the DB file exists and contains
-all expected tables.  If anything is missing the database is rebuilt
-automatically via init_db.main().
+Connections come from a bounded pool (see ConnectionPool) so the pragmas
+are applied once per connection rather than once per query.
+
+Auto-update: on import, an existing database is migrated in place
+(init_db.migrate_db) and the CSV dump changes are applied by a background
+worker (init_db.import_delta).  A missing database, or one too old to
+migrate, is rebuilt by the worker into a temporary file which is then
+swapped in atomically; see status() / wait_ready().
 """
 import os
+import queue
 import sqlite3
+import threading
+import time
 from contextlib import contextmanager
 
 DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
 DB_PATH  = os.getenv("CSR_DB_PATH", os.path.join(DATA_DIR, "csr.db"))
 
 # ── Schema version tracking ──────────────────────────────────────────
-# We compare the version stored in DB_META against init_db.SCHEMA_VERSION.
-# Any mismatch (or missing DB / table) triggers a full rebuild.
+# An existing database is updated in place by init_db.update() (schema
+# migrations + delta import of the CSV dump).  A missing database, or one
+# too old to migrate, triggers a full rebuild.
 
 
 def _db_schema_version():
@@ -43,48 +52,395 @@ def _db_schema_version():
 
 
 def _ensure_db():
-    """Rebuild the database if it is missing or its schema version is outdated."""
+    """Migrate the database in place, then start the background worker:
+    delta import of the dump, or full rebuild if the database is missing
+    or cannot be migrated to the current schema version."""
     # Import here to read SCHEMA_VERSION without circular issues
     import init_db
 
     current = _db_schema_version()
     expected = init_db.SCHEMA_VERSION
 
-    if current == expected:
-        return  # all good
+    if current is not None and init_db.migrate_db():
+        _start_worker("updating", _delta_job)
+        return
 
+    # The code only reads the current schema: nothing is served (503)
+    # until the rebuilt database is installed
     if current is None:
-        print(f"\n  [db.py] Base absente ou sans version — reconstruction...")
+        print(f"\n  [db.py] Base absente ou sans version — reconstruction en arrière-plan...")
     else:
-        print(f"\n  [db.py] Version schéma obsolète ({current} → {expected}) — reconstruction...")
+        print(f"\n  [db.py] Version schéma obsolète ({current} → {expected}) — "
+              f"reconstruction en arrière-plan, API indisponible (503) jusqu'à la fin...")
+    _set_status(ready=False)
+    _start_worker("building", _rebuild_job)
 
-    init_db.main()
-    print("  [db.py] Base reconstruite avec succès !\n")
 
+# ── Background worker ────────────────────────────────────────────────
+# The app serves the current file while the worker runs a delta import.
+# `ready` is False while there is no database of the current schema
+# (missing, or too old to migrate: full rebuild); app.py answers 503 in
+# that case.
+_status_lock = threading.Lock()
+_status = {"ready": True, "state": "ready", "error": None,
+           "started": None, "finished": None}
+_idle = threading.Event()
+_idle.set()
 
-# ── Run the check once at import time ────────────────────────────────
-_ensure_db()
+
+def _set_status(**values):
+    with _status_lock:
+        _status.update(values)
+
+
+def status():
+    """Database readiness (exposed through /api/health)."""
+    with _status_lock:
+        return dict(_status)
+
+
+def ready():
+    """True when a usable database is being served."""
+    with _status_lock:
+        return _status["ready"]
+
+
+def wait_ready(timeout=None):
+    """Block until the background worker is done; returns ready()."""
+    _idle.wait(timeout)
+    return ready()
+
+
+def _delta_job():
+    import init_db
+    init_db.import_delta()
+
+
+def _rebuild_job():
+    import init_db
+    tmp = DB_PATH + ".build"
+    init_db.build(tmp)
+    # Swap: wait for in-flight queries, close every connection, rename
+    with pool.paused(timeout=SWAP_TIMEOUT):
+        init_db.install(tmp, DB_PATH)
+    print("  [db.py] Base reconstruite et installée !\n")
+
+
+def _start_worker(state, job):
+    def run():
+        try:
+            job()
+            _set_status(ready=True, state="ready", error=None)
+        except Exception as e:
+            print(f"  [db.py] Échec de la tâche '{state}' : {e}")
+            _set_status(state="failed", error=str(e))
+        finally:
+            _set_status(finished=time.time())
+            _idle.set()
+
+    _idle.clear()
+    _set_status(state=state, started=time.time(), finished=None, error=None)
+    threading.Thread(target=run, name=f"csr-db-{state}", daemon=True).start()
+
+
+# ── Connection pool ──────────────────────────────────────────────────
+# Connections are opened once, prepared with the pragmas below and then
+# recycled through a bounded queue instead of being opened per query.
+POOL_SIZE        = int(os.getenv("CSR_DB_POOL_SIZE", "8"))
+POOL_TIMEOUT     = float(os.getenv("CSR_DB_POOL_TIMEOUT", "10"))
+# Idle connections older than this (seconds) are pinged before reuse.
+POOL_HEALTHCHECK = float(os.getenv("CSR_DB_POOL_HEALTHCHECK", "30"))
+# Max wait (seconds) for in-flight queries before swapping a rebuilt file in.
+SWAP_TIMEOUT     = float(os.getenv("CSR_DB_SWAP_TIMEOUT", "30"))
+# Extra attempts (exponential backoff) when BEGIN IMMEDIATE still finds
+# the write lock taken after the connection's busy timeout.
+TX_RETRIES       = int(os.getenv("CSR_DB_TX_RETRIES", "5"))
+TX_BACKOFF       = 0.05
+# Prepared statements kept per connection (sqlite3 default: 128); the CSR
+# query builders emit one SQL text per query shape, see app._compiled.
+STMT_CACHE       = int(os.getenv("CSR_DB_STMT_CACHE", "512"))
 
 
 def get_conn():
     """Get a new SQLite connection with row factory."""
-    conn = sqlite3.connect(DB_PATH)
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False, cached_statements=STMT_CACHE)
     conn.row_factory = sqlite3.Row
     conn.execute("PRAGMA journal_mode=WAL")
     conn.execute("PRAGMA foreign_keys=ON")
     return conn
 
 
+class ConnectionPool:
+    """Bounded pool of prepared SQLite connections.
+
+    Connections are created lazily up to `size`; a caller that finds the
+    pool exhausted blocks for at most `timeout` seconds.  Each checkout
+    runs a cheap `SELECT 1` health check when the connection has been idle
+    for longer than `healthcheck` seconds, and broken connections are
+    replaced transparently.
+    """
+
+    def __init__(self, factory, size=POOL_SIZE, timeout=POOL_TIMEOUT,
+                 healthcheck=POOL_HEALTHCHECK):
+        self._factory = factory
+        self.size = max(1, int(size))
+        self.timeout = timeout
+        self.healthcheck = healthcheck
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._paused = False
+        self._generation = 0
+        self._open = 0
+        self._metrics = {"created": 0, "reused": 0, "discarded": 0,
+                         "waits": 0, "timeouts": 0, "in_use": 0, "peak_in_use": 0,
+                         "busy_retries": 0}
+
+    def _new(self):
+        conn = self._factory()
+        with self._lock:
+            self._metrics["created"] += 1
+        return conn
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        with self._lock:
+            self._open -= 1
+            self._metrics["discarded"] += 1
+
+    def _checkout(self):
+        while True:
+            try:
+                conn, gen, idle_since = self._idle.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    can_open = self._open < self.size
+                    if can_open:
+                        self._open += 1
+                if can_open:
+                    try:
+                        return self._new(), self._generation
+                    except Exception:
+                        with self._lock:
+                            self._open -= 1
+                        raise
+                with self._lock:
+                    self._metrics["waits"] += 1
+                try:
+                    conn, gen, idle_since = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    with self._lock:
+                        self._metrics["timeouts"] += 1
+                    raise RuntimeError(
+                        f"Pool SQLite saturé ({self.size} connexions) — délai dépassé")
+
+            if gen != self._generation:
+                self._discard(conn)
+                continue
+            if time.monotonic() - idle_since > self.healthcheck:
+                try:
+                    conn.execute("SELECT 1").fetchone()
+                except sqlite3.Error:
+                    self._discard(conn)
+                    continue
+            with self._lock:
+                self._metrics["reused"] += 1
+            return conn, gen
+
+    def _checkin(self, conn, gen, broken=False):
+        if not broken and conn.in_transaction:
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                broken = True
+        if broken or gen != self._generation:
+            self._discard(conn)
+        else:
+            self._idle.put((conn, gen, time.monotonic()))
+
+    def _release(self):
+        with self._cond:
+            self._metrics["in_use"] -= 1
+            self._cond.notify_all()
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection for the duration of the `with` block."""
+        with self._cond:
+            while self._paused:
+                self._cond.wait()
+            self._metrics["in_use"] += 1
+            self._metrics["peak_in_use"] = max(self._metrics["peak_in_use"],
+                                               self._metrics["in_use"])
+        try:
+            conn, gen = self._checkout()
+        except Exception:
+            self._release()
+            raise
+        broken = False
+        try:
+            yield conn
+        except sqlite3.DatabaseError as e:
+            # "database disk image is malformed" & co. → do not recycle
+            broken = type(e) is sqlite3.DatabaseError
+            raise
+        finally:
+            self._checkin(conn, gen, broken)
+            self._release()
+
+    def reset(self):
+        """Drop every idle connection; busy ones are closed on check-in.
+
+        Must be called whenever the database file is replaced on disk.
+        """
+        with self._lock:
+            self._generation += 1
+        while True:
+            try:
+                conn, _gen, _ts = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+    @contextmanager
+    def paused(self, timeout=None):
+        """Hold new checkouts, wait (at most `timeout` s) for the borrowed
+        connections to come back and close them all; the database file can
+        then be replaced inside the `with` block."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            self._paused = True
+            while self._metrics["in_use"]:
+                left = None if deadline is None else deadline - time.monotonic()
+                if left is not None and left <= 0:
+                    self._paused = False
+                    self._cond.notify_all()
+                    raise RuntimeError("Connexions SQLite toujours actives — remplacement annulé")
+                self._cond.wait(left)
+        try:
+            self.reset()
+            yield
+        finally:
+            with self._cond:
+                self._paused = False
+                self._cond.notify_all()
+
+    def count(self, metric):
+        with self._lock:
+            self._metrics[metric] += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self._metrics, size=self.size, open=self._open,
+                        idle=self._idle.qsize(), paused=self._paused)
+
+
+pool = ConnectionPool(get_conn)
+
+
+def pool_stats():
+    """Return connection pool metrics (exposed through /api/health)."""
+    return pool.stats()
+
+
+# ── Run the check once at import time ────────────────────────────────
+_ensure_db()
+
+
+# Connection pinned to the current thread by read_snapshot() / transaction()
+_snapshot = threading.local()
+
+
+@contextmanager
+def read_snapshot():
+    """Serve every query of the current thread from one pooled connection
+    inside a single read transaction, so that consecutive fetch_* calls
+    see the same state of the database.  Read-only: the transaction is
+    rolled back on exit.  Nested calls reuse the outer snapshot.
+    """
+    if getattr(_snapshot, "conn", None) is not None:
+        yield _snapshot.conn
+        return
+    with pool.connection() as conn:
+        conn.execute("BEGIN")
+        _snapshot.conn, _snapshot.write = conn, False
+        try:
+            yield conn
+        finally:
+            _snapshot.conn = None
+            conn.rollback()
+
+
+def _is_busy(e):
+    return (getattr(e, "sqlite_errorcode", None) == sqlite3.SQLITE_BUSY
+            or "database is locked" in str(e))
+
+
+def _begin_immediate(conn):
+    """BEGIN IMMEDIATE, retried with backoff while the write lock is taken."""
+    for attempt in range(TX_RETRIES + 1):
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            return
+        except sqlite3.OperationalError as e:
+            if not _is_busy(e) or attempt == TX_RETRIES:
+                raise
+            pool.count("busy_retries")
+            time.sleep(TX_BACKOFF * 2 ** attempt)
+
+
+@contextmanager
+def transaction():
+    """Unit of work for a write request.
+
+    Takes the write lock up front (BEGIN IMMEDIATE, see _begin_immediate)
+    on one pooled connection and pins it to the current thread, so that
+    every fetch_*/execute/cursor() call inside the block joins the same
+    transaction.  Commits once on exit, rolls everything back on error.
+    Nested calls join the outer transaction.  Yields a cursor.
+    """
+    pinned = getattr(_snapshot, "conn", None)
+    if pinned is not None:
+        if not getattr(_snapshot, "write", False):
+            raise RuntimeError("transaction() impossible dans read_snapshot()")
+        cur = pinned.cursor()
+        try:
+            yield cur
+        finally:
+            cur.close()
+        return
+    with pool.connection() as conn:
+        _begin_immediate(conn)
+        _snapshot.conn, _snapshot.write = conn, True
+        cur = conn.cursor()
+        try:
+            yield cur
+            conn.commit()
+        finally:
+            _snapshot.conn = None
+            cur.close()
+
+
 @contextmanager
 def cursor():
-    conn = get_conn()
-    cur = conn.cursor()
-    try:
-        yield cur
-        conn.commit()
-    finally:
-        cur.close()
-        conn.close()
+    pinned = getattr(_snapshot, "conn", None)
+    if pinned is not None:
+        cur = pinned.cursor()
+        try:
+            yield cur
+        finally:
+            cur.close()
+        return
+    with pool.connection() as conn:
+        cur = conn.cursor()
+        try:
+            yield cur
+            conn.commit()
+        finally:
+            cur.close()
 
 
 def _convert_named_binds(sql, binds):
@@ -120,8 +476,40 @@ def fetch_one(sql, binds):
         return dict(zip(cols, row))
 
 
+def fetch_batches(sql, binds, size=500):
+    """Execute query and yield its rows as lists of at most `size` dicts,
+    read from the cursor as they are consumed (the pooled connection is
+    held until the generator is exhausted or closed)."""
+    sql, binds = _convert_named_binds(sql, binds)
+    with cursor() as cur:
+        cur.execute(sql, binds)
+        cols = [desc[0].lower() for desc in cur.description]
+        while True:
+            rows = cur.fetchmany(size)
+            if not rows:
+                return
+            yield [dict(zip(cols, row)) for row in rows]
+
+
 def execute(sql, binds):
     """Execute a write query (INSERT/UPDATE/DELETE)."""
     sql, binds = _convert_named_binds(sql, binds)
     with cursor() as cur:
         cur.execute(sql, binds)
+
+
+# ── Data version ─────────────────────────────────────────────────────
+# DB_META.data_version is a monotonically increasing counter: init_db seeds
+# it with the build time (ms) and every positions write bumps it by one.
+# Response caches compare it to know whether a cached payload is stale.
+
+def data_version():
+    """Current data version (0 if the key is missing)."""
+    row = fetch_one("SELECT value FROM DB_META WHERE key = 'data_version'", {})
+    return int(row["value"]) if row else 0
+
+
+def bump_data_version(cur):
+    """Increment data_version inside the caller's transaction."""
+    import init_db
+    init_db.bump_data_version(cur)
@@ -1,24 +1,36 @@
 # -*- coding: utf-8 -*-
 """
 init_db.py - Import CSV data into SQLite database for CSR prototype.
-Creates tables PERSONNE, THEMES, POSITIONNEMENT and loads data from CSV files.
+Creates tables PERSONNE, THEMES, POSITIONS (+ LABELS, view POSITIONNEMENT)
+and loads data from CSV files.
 """
 import csv
+import hashlib
+import json
 import os
 import sqlite3
 import sys
 import io
+import time
+from collections import Counter
+from contextlib import contextmanager
+from itertools import islice
+
+import label_codes
+import propagation
+import search_index
+import stats_tables
 
 if sys.platform == "win32":
     sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding="utf-8", errors="replace")
 
 DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
-DB_PATH  = os.path.join(DATA_DIR, "csr.db")
+DB_PATH  = os.getenv("CSR_DB_PATH", os.path.join(DATA_DIR, "csr.db"))
 
 # ──────────────────────────────────────────────
 # Schema
 # ──────────────────────────────────────────────
-SCHEMA = """
+SCHEMA = f"""
 -- Themes hierarchy
 CREATE TABLE IF NOT EXISTS THEMES (
     "CS_TH_COD#"   INTEGER PRIMARY KEY,
@@ -30,6 +42,15 @@ CREATE TABLE IF NOT EXISTS THEMES (
 CREATE INDEX IF NOT EXISTS idx_themes_parent ON THEMES(THEME_PARENT);
 CREATE INDEX IF NOT EXISTS idx_themes_label  ON THEMES(THEME);
 
+-- Transitive closure of the themes hierarchy (self rows have depth 0)
+CREATE TABLE IF NOT EXISTS THEME_CLOSURE (
+    ancestor    INTEGER NOT NULL,
+    descendant  INTEGER NOT NULL,
+    depth       INTEGER NOT NULL,
+    PRIMARY KEY (ancestor, descendant)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_closure_desc ON THEME_CLOSURE(descendant, ancestor, depth);
+
 -- Persons
 CREATE TABLE IF NOT EXISTS PERSONNE (
     "PE_PE_COD#"   INTEGER PRIMARY KEY,
@@ -38,32 +59,95 @@ CREATE TABLE IF NOT EXISTS PERSONNE (
 );
 CREATE INDEX IF NOT EXISTS idx_personne_nom ON PERSONNE(PE_PE_NOM);
 
--- Positioning (theme-person-structure assignments)
-CREATE TABLE IF NOT EXISTS POSITIONNEMENT (
-    ROWID_POS          INTEGER PRIMARY KEY AUTOINCREMENT,
-    IDPERS             INTEGER NOT NULL,
-    IDCONTRIBUTION     INTEGER,
-    LIBCONTRIBUTION    TEXT,
-    IDTEMPORALITE      INTEGER,
-    LIBELLETEMPORALITE TEXT,
-    IDTHEME            INTEGER NOT NULL,
-    LIBELLETHEME       TEXT,
-    IDSTRUCTURE        INTEGER,
-    LIBELLESTRUCTURE   TEXT,
-    IDTYPESTRUCTURE    INTEGER,
-    LIBELLETYPESTRUCTURE TEXT,
-    IDSTRUCTUREPARENTE  INTEGER,
-    LIBELLESTRUCTUREPARENTE TEXT,
-    AUTO_GENERE        TEXT DEFAULT NULL,
+-- Labels of the positions, dictionary-encoded (see label_codes.py)
+CREATE TABLE IF NOT EXISTS LABELS (
+    CODE   INTEGER PRIMARY KEY,
+    LABEL  TEXT NOT NULL UNIQUE
+);
+{label_codes.SEED_SQL};
+
+-- Positioning (theme-person-structure assignments), integer codes only:
+-- CODE_* reference LABELS, the theme label is THEMES.THEME
+CREATE TABLE IF NOT EXISTS POSITIONS (
+    ROWID_POS             INTEGER PRIMARY KEY AUTOINCREMENT,
+    IDPERS                INTEGER NOT NULL,
+    IDCONTRIBUTION        INTEGER,
+    CODE_CONTRIBUTION     INTEGER,
+    IDTEMPORALITE         INTEGER,
+    CODE_TEMPORALITE      INTEGER,
+    IDTHEME               INTEGER NOT NULL,
+    IDSTRUCTURE           INTEGER,
+    CODE_STRUCTURE        INTEGER,
+    IDTYPESTRUCTURE       INTEGER,
+    CODE_TYPESTRUCTURE    INTEGER,
+    IDSTRUCTUREPARENTE    INTEGER,
+    CODE_STRUCTUREPARENTE INTEGER,
+    AUTO                  INTEGER NOT NULL DEFAULT 0,  -- 1 = propagated to a parent theme
+    SOURCE_HASH           TEXT DEFAULT NULL,  -- hash of the dump record (csv_records); NULL = added via the API
+    SOURCE_COUNT          INTEGER DEFAULT NULL,  -- auto rows: manual rows of the group below this theme
     FOREIGN KEY (IDPERS)  REFERENCES PERSONNE("PE_PE_COD#"),
     FOREIGN KEY (IDTHEME) REFERENCES THEMES("CS_TH_COD#")
 );
-CREATE INDEX IF NOT EXISTS idx_pos_pers      ON POSITIONNEMENT(IDPERS);
-CREATE INDEX IF NOT EXISTS idx_pos_theme     ON POSITIONNEMENT(IDTHEME);
-CREATE INDEX IF NOT EXISTS idx_pos_struct    ON POSITIONNEMENT(IDSTRUCTURE);
-CREATE INDEX IF NOT EXISTS idx_pos_temp      ON POSITIONNEMENT(LIBELLETEMPORALITE);
-CREATE INDEX IF NOT EXISTS idx_pos_contrib   ON POSITIONNEMENT(LIBCONTRIBUTION);
-CREATE INDEX IF NOT EXISTS idx_pos_auto      ON POSITIONNEMENT(AUTO_GENERE);
+-- Composite / covering indexes, one per access path used by app.py
+-- (checked by check_query_plans.py):
+--   temporality first : dashboard stats (CODE_TEMPORALITE = PRESENT + _manu_filter)
+--   person first      : per-person EXISTS / NOT EXISTS, themes_of_person, cleanup
+--   theme first       : IDTHEME IN (...) filters, per-theme EXISTS, GROUP BY IDTHEME
+--   structure first   : IDSTRUCTURE = / IN (...) filters, GROUP BY IDSTRUCTURE
+CREATE INDEX IF NOT EXISTS idx_pos_temp_cover   ON POSITIONS(
+    CODE_TEMPORALITE, AUTO, IDTHEME, IDPERS, CODE_CONTRIBUTION, IDSTRUCTURE);
+CREATE INDEX IF NOT EXISTS idx_pos_pers_cover   ON POSITIONS(
+    IDPERS, IDTHEME, CODE_CONTRIBUTION, CODE_TEMPORALITE, AUTO, IDSTRUCTURE);
+CREATE INDEX IF NOT EXISTS idx_pos_theme_cover  ON POSITIONS(
+    IDTHEME, CODE_TEMPORALITE, CODE_CONTRIBUTION, AUTO, IDPERS, IDSTRUCTURE);
+CREATE INDEX IF NOT EXISTS idx_pos_struct_cover ON POSITIONS(
+    IDSTRUCTURE, CODE_TEMPORALITE, AUTO, CODE_STRUCTURE, IDPERS, IDTHEME, CODE_CONTRIBUTION);
+-- Manual rows only: propagation sources and orphan cleanup
+CREATE INDEX IF NOT EXISTS idx_pos_manu         ON POSITIONS(IDPERS, IDCONTRIBUTION, IDTHEME)
+    WHERE AUTO = 0;
+CREATE INDEX IF NOT EXISTS idx_pos_auto         ON POSITIONS(AUTO, IDTHEME);
+-- Dump rows only: delta import (multiset diff on SOURCE_HASH)
+CREATE INDEX IF NOT EXISTS idx_pos_source       ON POSITIONS(SOURCE_HASH)
+    WHERE SOURCE_HASH IS NOT NULL;
+
+-- Former layout, for reading only: the labels joined back, AUTO_GENERE
+-- 'O' / NULL (SQLite drops the joins a query does not use)
+CREATE VIEW IF NOT EXISTS POSITIONNEMENT AS
+SELECT p.ROWID_POS, p.IDPERS,
+       p.IDCONTRIBUTION,     lc.LABEL AS LIBCONTRIBUTION,
+       p.IDTEMPORALITE,      lt.LABEL AS LIBELLETEMPORALITE,
+       p.IDTHEME,            t.THEME  AS LIBELLETHEME,
+       p.IDSTRUCTURE,        ls.LABEL AS LIBELLESTRUCTURE,
+       p.IDTYPESTRUCTURE,    ly.LABEL AS LIBELLETYPESTRUCTURE,
+       p.IDSTRUCTUREPARENTE, lp.LABEL AS LIBELLESTRUCTUREPARENTE,
+       CASE WHEN p.AUTO = 1 THEN 'O' END AS AUTO_GENERE,
+       p.SOURCE_HASH, p.SOURCE_COUNT
+FROM POSITIONS p
+LEFT JOIN LABELS lc ON lc.CODE = p.CODE_CONTRIBUTION
+LEFT JOIN LABELS lt ON lt.CODE = p.CODE_TEMPORALITE
+LEFT JOIN THEMES t  ON t."CS_TH_COD#" = p.IDTHEME
+LEFT JOIN LABELS ls ON ls.CODE = p.CODE_STRUCTURE
+LEFT JOIN LABELS ly ON ly.CODE = p.CODE_TYPESTRUCTURE
+LEFT JOIN LABELS lp ON lp.CODE = p.CODE_STRUCTUREPARENTE;
+
+-- Precomputed dashboard aggregates (maintained by stats_tables.py)
+CREATE TABLE IF NOT EXISTS STATS_MEMBER (
+    mode       TEXT NOT NULL,      -- 'manu' | 'all'
+    dim        TEXT NOT NULL,      -- see stats_tables.DIMENSIONS
+    key_id     INTEGER NOT NULL,
+    key_label  TEXT NOT NULL,
+    idpers     INTEGER NOT NULL,
+    PRIMARY KEY (mode, dim, key_id, key_label, idpers)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_stats_member_pers ON STATS_MEMBER(idpers);
+CREATE TABLE IF NOT EXISTS STATS_COUNT (
+    mode       TEXT NOT NULL,
+    dim        TEXT NOT NULL,
+    key_id     INTEGER NOT NULL,
+    key_label  TEXT NOT NULL,
+    cnt        INTEGER NOT NULL,   -- distinct persons
+    PRIMARY KEY (mode, dim, key_id, key_label)
+) WITHOUT ROWID;
 
 -- Users for authentication
 CREATE TABLE IF NOT EXISTS USERS (
@@ -91,7 +175,7 @@ CREATE TABLE IF NOT EXISTS DB_META (
 
 # Bump this version whenever the schema or seed data changes.
 # db.py compares this against the DB to decide if a rebuild is needed.
-SCHEMA_VERSION = "8"
+SCHEMA_VERSION = "16"
 
 # ── Structure acronym mapping ──────────────────────────────────────
 STRUCTURE_ACRONYMS = {
@@ -132,30 +216,178 @@ CONTRIBUTION_MAP = {
 }
 
 
+# ──────────────────────────────────────────────
+# Bulk ingestion helpers
+# ──────────────────────────────────────────────
+# Rows are parsed lazily from the CSV and inserted with executemany in
+# chunks of INGEST_CHUNK rows, one transaction per chunk.
+INGEST_CHUNK = 5000
+
+# Build-time pragmas: the database is recreated from scratch on failure
+# (no schema_version row → rebuild), so durability can be traded for speed.
+INGEST_PRAGMAS = (
+    "PRAGMA synchronous=OFF",
+    "PRAGMA cache_size=-65536",   # 64 MiB
+    "PRAGMA temp_store=MEMORY",
+)
+
+
+def _csv_rows(path):
+    """Yield the rows of a UTF-8 CSV file as dicts."""
+    with open(path, encoding="utf-8", newline="") as f:
+        yield from csv.DictReader(f)
+
+
+def csv_records(path):
+    """Yield (record_hash, fields) for every non-empty record of a CSV
+    file, after the header.  The hash fingerprints the raw record, so a
+    delta import only parses the records it has not seen before."""
+    with open(path, encoding="utf-8", newline="") as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        for fields in reader:
+            if fields:
+                yield (hashlib.blake2b("\x1f".join(fields).encode("utf-8"),
+                                       digest_size=8).hexdigest(), fields)
+
+
+def csv_header(path):
+    with open(path, encoding="utf-8", newline="") as f:
+        return next(csv.reader(f), [])
+
+
+def _int_or_none(value):
+    value = (value or "").strip()
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+
+def insert_chunks(conn, sql, rows, chunk=INGEST_CHUNK, commit=True):
+    """executemany `sql` over the iterable `rows`, committing every `chunk`
+    rows (unless `commit` is False: the caller owns the transaction).
+    Returns the number of rows inserted."""
+    rows = iter(rows)
+    total = 0
+    while True:
+        batch = list(islice(rows, chunk))
+        if not batch:
+            return total
+        conn.executemany(sql, batch)
+        if commit:
+            conn.commit()
+        total += len(batch)
+
+
+@contextmanager
+def deferred_indexes(conn, *tables):
+    """Drop the secondary indexes of `tables` for the duration of a bulk
+    load and recreate them afterwards (one sorted build per index)."""
+    marks = ",".join("?" * len(tables))
+    saved = conn.execute(
+        f"SELECT name, sql FROM sqlite_master WHERE type = 'index' "
+        f"AND sql IS NOT NULL AND tbl_name IN ({marks})", tables
+    ).fetchall()
+    for name, _sql in saved:
+        conn.execute(f'DROP INDEX "{name}"')
+    try:
+        yield
+    finally:
+        for _name, sql in saved:
+            conn.execute(sql)
+        conn.commit()
+
+
+def parse_themes(path):
+    """Yield (id, label, niveau, parent_id) tuples from Themes.csv."""
+    for row in _csv_rows(path):
+        niveau = int(row["NIVEAU"]) if row["NIVEAU"].strip() else 0
+        yield (int(row["CS_TH_COD#"]), row["THEME"].strip(), niveau,
+               _int_or_none(row["THEME_PARENT"]))
+
+
 def load_themes(conn):
     """Load Themes.csv into THEMES table."""
     path = os.path.join(DATA_DIR, "Themes.csv")
     print(f"  Loading themes from {os.path.basename(path)}...")
 
-    with open(path, encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        count = 0
-        for row in reader:
-            tid = int(row["CS_TH_COD#"])
-            label = row["THEME"].strip()
-            niveau = int(row["NIVEAU"]) if row["NIVEAU"].strip() else 0
-            parent = int(row["THEME_PARENT"]) if row["THEME_PARENT"].strip() else None
-
-            conn.execute(
-                'INSERT OR REPLACE INTO THEMES ("CS_TH_COD#", THEME, NIVEAU, THEME_PARENT) VALUES (?,?,?,?)',
-                (tid, label, niveau, parent)
-            )
-            count += 1
+    count = insert_chunks(
+        conn,
+        'INSERT OR REPLACE INTO THEMES ("CS_TH_COD#", THEME, NIVEAU, THEME_PARENT) VALUES (?,?,?,?)',
+        parse_themes(path)
+    )
 
     print(f"    -> {count} themes loaded")
+    n_links = build_theme_closure(conn)
+    print(f"    -> {n_links} closure links (THEME_CLOSURE)")
     return count
 
 
+def build_theme_closure(conn):
+    """(Re)build THEME_CLOSURE from THEMES.THEME_PARENT.
+
+    One row per (ancestor, descendant) pair, including the (t, t, 0) self
+    rows, so "t and its descendants" is a plain indexed lookup on
+    ancestor and "strict ancestors of t" one on descendant with depth > 0.
+    """
+    conn.execute("DELETE FROM THEME_CLOSURE")
+    conn.execute("""
+        INSERT INTO THEME_CLOSURE (ancestor, descendant, depth)
+        WITH RECURSIVE c(ancestor, descendant, depth) AS (
+            SELECT "CS_TH_COD#", "CS_TH_COD#", 0 FROM THEMES
+            UNION ALL
+            SELECT c.ancestor, t."CS_TH_COD#", c.depth + 1
+            FROM c
+            JOIN THEMES t ON t.THEME_PARENT = c.descendant
+        )
+        SELECT ancestor, descendant, depth FROM c
+    """)
+    return conn.execute("SELECT COUNT(*) FROM THEME_CLOSURE").fetchone()[0]
+
+
+def themes_fingerprint(conn):
+    """Content hash of THEMES, stored in DB_META.themes_version.
+
+    theme_index.ThemeIndex compares it to decide whether its in-memory
+    copy of the hierarchy is stale.
+    """
+    h = hashlib.sha1()
+    for row in conn.execute(
+        'SELECT "CS_TH_COD#", THEME, NIVEAU, THEME_PARENT FROM THEMES ORDER BY 1'
+    ):
+        h.update(repr(tuple(row)).encode("utf-8"))
+    return h.hexdigest()
+
+
+def persons_fingerprint(conn):
+    """Content hash of PERSONNE, stored in DB_META.persons_version.
+
+    autocomplete.py compares it to decide whether its people picker is
+    stale (data_version also moves on every position write).
+    """
+    h = hashlib.sha1()
+    for row in conn.execute(
+        'SELECT "PE_PE_COD#", PE_PE_NOM, PE_PE_PRENOM FROM PERSONNE ORDER BY 1'
+    ):
+        h.update(repr(tuple(row)).encode("utf-8"))
+    return h.hexdigest()
+
+
+def parse_persons(path):
+    """Yield (id, nom, prenom) from positions.csv, skipping consecutive
+    repeats; a person listed twice with different names ends up with the
+    last one (INSERT OR REPLACE)."""
+    last = None
+    for row in _csv_rows(path):
+        person = (int(row["ID_MEMBRE"]), row["PE_PE_NOM"].strip(), row["PE_PE_PRENOM"].strip())
+        if person != last:
+            yield person
+            last = person
+
+
 def load_persons(conn):
     """Load unique persons from positions.csv into PERSONNE table.
 
@@ -165,27 +397,86 @@ def load_persons(conn):
     path = os.path.join(DATA_DIR, "positions.csv")
     print(f"  Loading persons from {os.path.basename(path)}...")
 
-    persons = {}
-    with open(path, encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            pid = int(row["ID_MEMBRE"])
-            nom = row["PE_PE_NOM"].strip()
-            prenom = row["PE_PE_PRENOM"].strip()
-            persons[pid] = (nom, prenom)
-
-    for pid, (nom, prenom) in persons.items():
-        conn.execute(
-            'INSERT OR REPLACE INTO PERSONNE ("PE_PE_COD#", PE_PE_NOM, PE_PE_PRENOM) VALUES (?,?,?)',
-            (pid, nom, prenom)
-        )
+    insert_chunks(
+        conn,
+        'INSERT OR REPLACE INTO PERSONNE ("PE_PE_COD#", PE_PE_NOM, PE_PE_PRENOM) VALUES (?,?,?)',
+        parse_persons(path)
+    )
+    count = conn.execute("SELECT COUNT(*) FROM PERSONNE").fetchone()[0]
+
+    print(f"    -> {count} persons loaded")
+    return count
+
+
+# Columns of a manual position, in the order of the parse_positions() tuples
+POSITION_COLUMNS = """IDPERS, IDCONTRIBUTION, CODE_CONTRIBUTION,
+            IDTEMPORALITE, CODE_TEMPORALITE,
+            IDTHEME,
+            IDSTRUCTURE, CODE_STRUCTURE,
+            IDTYPESTRUCTURE, CODE_TYPESTRUCTURE,
+            IDSTRUCTUREPARENTE, CODE_STRUCTUREPARENTE"""
+
+
+def position_from_row(row, theme_ids, codes, counters):
+    """POSITIONS tuple (manual row) for one positions.csv record, or None
+    if it must be skipped.
+
+    `theme_ids` holds the valid theme ids; rows with an unknown theme or
+    unparsable ids are skipped.  Labels are encoded with `codes`
+    (label_codes.LabelCodes).  `counters` receives the skipped /
+    with_struct / without_struct tallies.
+    """
+    try:
+        idpers = int(row["ID_MEMBRE"])
+        idtheme = int(row["THEME_CODE"])
+        libcontrib = row["TYPE_CONTRIBUTION"].strip()
+    except (ValueError, KeyError):
+        counters["skipped"] += 1
+        return None
+
+    if idtheme not in theme_ids:
+        counters["skipped"] += 1
+        return None
+
+    idcontrib = CONTRIBUTION_MAP.get(libcontrib, 2)
+
+    # Structure and temporality data come directly from the CSV
+    idstruct = _int_or_none(row.get("ID_STRUCTURE"))
+    if idstruct is not None:
+        counters["with_struct"] += 1
+    else:
+        counters["without_struct"] += 1
+    idtemp = _int_or_none(row.get("ID_TEMPORALITE")) or 1
+    libtemp = (row.get("TEMPORALITE") or "").strip() or 'Présent'
+
+    code = codes.code
+    return (idpers, idcontrib, code(libcontrib),
+            idtemp, code(libtemp),
+            idtheme,
+            idstruct, code((row.get("LIB_STRUCTURE") or "").strip() or None),
+            _int_or_none(row.get("ID_TYPE_STRUCTURE")),
+            code((row.get("TYPE_STRUCTURE") or "").strip() or None),
+            _int_or_none(row.get("ID_STRUCTURE_PARENT")),
+            code((row.get("LIB_STRUCTURE_PARENT") or "").strip() or None))
+
 
-    print(f"    -> {len(persons)} persons loaded")
-    return len(persons)
+def parse_positions(path, theme_ids, codes, counters):
+    """Yield (*POSITIONS tuple, record_hash) for positions.csv."""
+    header = csv_header(path)
+    for h, fields in csv_records(path):
+        pos = position_from_row(dict(zip(header, fields)), theme_ids, codes, counters)
+        if pos is not None:
+            yield (*pos, h)
+
+
+INSERT_DUMP_POSITION = f"""INSERT INTO POSITIONS (
+            {POSITION_COLUMNS},
+            SOURCE_HASH
+        ) VALUES (?,?,?,?,?,?,?,?,?,?,?,?, ?)"""
 
 
 def load_positions(conn):
-    """Load positions.csv into POSITIONNEMENT table.
+    """Load positions.csv into POSITIONS table (labels into LABELS).
 
     Dump format (2026-04-15) — UTF-8 CSV with columns:
       ID_MEMBRE, PE_PE_NOM, PE_PE_PRENOM, THEME_CODE, TYPE_CONTRIBUTION,
@@ -197,169 +488,56 @@ def load_positions(conn):
     path = os.path.join(DATA_DIR, "positions.csv")
     print(f"  Loading positions from {os.path.basename(path)}...")
 
-    # Load valid theme IDs for validation
-    valid_themes = set(
-        r[0] for r in conn.execute('SELECT "CS_TH_COD#" FROM THEMES').fetchall()
+    # Valid theme IDs and label codes resolved in memory
+    theme_ids = {r[0] for r in conn.execute('SELECT "CS_TH_COD#" FROM THEMES')}
+    counters = {"skipped": 0, "with_struct": 0, "without_struct": 0}
+
+    count = insert_chunks(
+        conn,
+        INSERT_DUMP_POSITION,
+        parse_positions(path, theme_ids, label_codes.LabelCodes(conn), counters)
     )
 
-    with_struct = 0
-    without_struct = 0
-
-    with open(path, encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        count = 0
-        skipped = 0
-        for row in reader:
-            try:
-                idpers = int(row["ID_MEMBRE"])
-                idtheme = int(row["THEME_CODE"])
-                libcontrib = row["TYPE_CONTRIBUTION"].strip()
-            except (ValueError, KeyError):
-                skipped += 1
-                continue
-
-            if idtheme not in valid_themes:
-                skipped += 1
-                continue
-
-            idcontrib = CONTRIBUTION_MAP.get(libcontrib, 2)
-
-            # Get theme label from THEMES table
-            theme_row = conn.execute(
-                'SELECT THEME FROM THEMES WHERE "CS_TH_COD#" = ?', (idtheme,)
-            ).fetchone()
-            libtheme = theme_row[0] if theme_row else None
-
-            # Read structure data directly from CSV
-            try:
-                idstruct = int(row["ID_STRUCTURE"]) if row.get("ID_STRUCTURE", "").strip() else None
-            except ValueError:
-                idstruct = None
-            libstruct = row.get("LIB_STRUCTURE", "").strip() or None
-
-            try:
-                idtypestruct = int(row["ID_TYPE_STRUCTURE"]) if row.get("ID_TYPE_STRUCTURE", "").strip() else None
-            except ValueError:
-                idtypestruct = None
-            libtypestruct = row.get("TYPE_STRUCTURE", "").strip() or None
-
-            try:
-                idstructparent = int(row["ID_STRUCTURE_PARENT"]) if row.get("ID_STRUCTURE_PARENT", "").strip() else None
-            except ValueError:
-                idstructparent = None
-            libstructparent = row.get("LIB_STRUCTURE_PARENT", "").strip() or None
-
-            if idstruct is not None:
-                with_struct += 1
-            else:
-                without_struct += 1
-
-            # Read temporality directly from CSV
-            try:
-                idtemp = int(row["ID_TEMPORALITE"]) if row.get("ID_TEMPORALITE", "").strip() else 1
-            except ValueError:
-                idtemp = 1
-            libtemp = row.get("TEMPORALITE", "").strip() or 'Présent'
-
-            conn.execute(
-                """INSERT INTO POSITIONNEMENT (
-                    IDPERS, IDCONTRIBUTION, LIBCONTRIBUTION,
-                    IDTEMPORALITE, LIBELLETEMPORALITE,
-                    IDTHEME, LIBELLETHEME,
-                    IDSTRUCTURE, LIBELLESTRUCTURE,
-                    IDTYPESTRUCTURE, LIBELLETYPESTRUCTURE,
-                    IDSTRUCTUREPARENTE, LIBELLESTRUCTUREPARENTE,
-                    AUTO_GENERE
-                ) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?, NULL)""",
-                (idpers, idcontrib, libcontrib,
-                 idtemp, libtemp,
-                 idtheme, libtheme,
-                 idstruct, libstruct,
-                 idtypestruct, libtypestruct,
-                 idstructparent, libstructparent)
-            )
-            count += 1
-
-    print(f"    -> {count} positions loaded ({skipped} skipped)")
-    print(f"    -> {with_struct} with structure, {without_struct} without")
+    print(f"    -> {count} positions loaded ({counters['skipped']} skipped)")
+    print(f"    -> {counters['with_struct']} with structure, {counters['without_struct']} without")
     return count
 
 
-def propagate_parents(conn):
+def clear_auto(conn, person_ids):
+    """Delete the auto-generated positions of `person_ids`."""
+    conn.execute(
+        "DELETE FROM POSITIONS WHERE AUTO = 1 "
+        "AND IDPERS IN (SELECT value FROM json_each(?))",
+        (json.dumps(sorted(person_ids)),)
+    )
+
+
+def propagate_parents(conn, person_ids=None):
     """Propagate positions from child themes to all parent themes.
 
     For every manual positioning on a child theme, create auto-generated
     entries on all ancestor themes (up to the root), matching the logic
     of the Oracle procedure PROPAGER_POSITIONNEMENT_PARENT.
 
-    Auto-generated rows use AUTO_GENERE = 'O' (letter O, for 'Oui').
+    Auto-generated rows have AUTO = 1 (AUTO_GENERE = 'O', letter O for
+    'Oui', in the POSITIONNEMENT view).
     If the person is already manually positioned on a parent theme
     (same role + same structure), no auto entry is created.
-    """
-    print("  Propagating positions to parent themes...")
 
-    sql = """
-        INSERT INTO POSITIONNEMENT (
-            IDPERS, IDCONTRIBUTION, LIBCONTRIBUTION,
-            IDTEMPORALITE, LIBELLETEMPORALITE,
-            IDTHEME, LIBELLETHEME,
-            IDSTRUCTURE, LIBELLESTRUCTURE,
-            IDTYPESTRUCTURE, LIBELLETYPESTRUCTURE,
-            IDSTRUCTUREPARENTE, LIBELLESTRUCTUREPARENTE,
-            AUTO_GENERE
-        )
-        WITH RECURSIVE ancestors AS (
-            -- Start from every manual position's direct parent
-            SELECT
-                p.IDPERS, p.IDCONTRIBUTION, p.LIBCONTRIBUTION,
-                p.IDTEMPORALITE, p.LIBELLETEMPORALITE,
-                tp."CS_TH_COD#" AS IDTHEME, tp.THEME AS LIBELLETHEME,
-                p.IDSTRUCTURE, p.LIBELLESTRUCTURE,
-                p.IDTYPESTRUCTURE, p.LIBELLETYPESTRUCTURE,
-                p.IDSTRUCTUREPARENTE, p.LIBELLESTRUCTUREPARENTE
-            FROM POSITIONNEMENT p
-            JOIN THEMES tc ON tc."CS_TH_COD#" = p.IDTHEME
-            JOIN THEMES tp ON tp."CS_TH_COD#" = tc.THEME_PARENT
-            WHERE p.AUTO_GENERE IS NULL  -- only manual positions as source
-              AND tc.THEME_PARENT IS NOT NULL
-            UNION
-            -- Walk up the hierarchy
-            SELECT
-                a.IDPERS, a.IDCONTRIBUTION, a.LIBCONTRIBUTION,
-                a.IDTEMPORALITE, a.LIBELLETEMPORALITE,
-                gp."CS_TH_COD#" AS IDTHEME, gp.THEME AS LIBELLETHEME,
-                a.IDSTRUCTURE, a.LIBELLESTRUCTURE,
-                a.IDTYPESTRUCTURE, a.LIBELLETYPESTRUCTURE,
-                a.IDSTRUCTUREPARENTE, a.LIBELLESTRUCTUREPARENTE
-            FROM ancestors a
-            JOIN THEMES t ON t."CS_TH_COD#" = a.IDTHEME
-            JOIN THEMES gp ON gp."CS_TH_COD#" = t.THEME_PARENT
-            WHERE t.THEME_PARENT IS NOT NULL
-        )
-        SELECT DISTINCT
-            a.IDPERS, a.IDCONTRIBUTION, a.LIBCONTRIBUTION,
-            a.IDTEMPORALITE, a.LIBELLETEMPORALITE,
-            a.IDTHEME, a.LIBELLETHEME,
-            a.IDSTRUCTURE, a.LIBELLESTRUCTURE,
-            a.IDTYPESTRUCTURE, a.LIBELLETYPESTRUCTURE,
-            a.IDSTRUCTUREPARENTE, a.LIBELLESTRUCTUREPARENTE,
-            'O' AS AUTO_GENERE
-        FROM ancestors a
-        -- Skip if already positioned (manual or auto) on this parent
-        WHERE NOT EXISTS (
-            SELECT 1 FROM POSITIONNEMENT p2
-            WHERE p2.IDPERS = a.IDPERS
-              AND p2.IDCONTRIBUTION = a.IDCONTRIBUTION
-              AND p2.IDTHEME = a.IDTHEME
-              AND COALESCE(p2.IDSTRUCTURE, -1) = COALESCE(a.IDSTRUCTURE, -1)
-        )
+    With `person_ids`, only the auto rows of those persons are brought up
+    to date (see propagation.propagate).
     """
-    conn.execute(sql)
+    print("  Propagating positions to parent themes...")
+    added, removed = propagation.propagate(conn, person_ids)
+    if person_ids is not None:
+        print(f"    -> {added} auto-generated positions added, {removed} removed "
+              f"for {len(person_ids)} persons")
+        return added
     auto_count = conn.execute(
-        "SELECT COUNT(*) FROM POSITIONNEMENT WHERE AUTO_GENERE = 'O'"
+        "SELECT COUNT(*) FROM POSITIONS WHERE AUTO = 1"
     ).fetchone()[0]
-    total = conn.execute("SELECT COUNT(*) FROM POSITIONNEMENT").fetchone()[0]
-    print(f"    -> {auto_count} auto-generated positions added (total now: {total})")
+    total = conn.execute("SELECT COUNT(*) FROM POSITIONS").fetchone()[0]
+    print(f"    -> {auto_count} auto-generated positions (total now: {total})")
     return auto_count
 
 
@@ -408,42 +586,443 @@ def populate_structures(conn):
 
 
 
-def main():
-    # Remove old DB if exists
-    if os.path.exists(DB_PATH):
-        os.remove(DB_PATH)
-        print(f"  Removed old database: {DB_PATH}")
+# ──────────────────────────────────────────────
+# In-place update: schema migrations + delta import
+# ──────────────────────────────────────────────
+def file_fingerprint(path):
+    """sha1 of a dump file, stored in DB_META to skip unchanged dumps."""
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _dump_fingerprints():
+    return {
+        "themes_csv": file_fingerprint(os.path.join(DATA_DIR, "Themes.csv")),
+        "positions_csv": file_fingerprint(os.path.join(DATA_DIR, "positions.csv")),
+    }
+
+
+def _write_meta(conn, values):
+    conn.executemany(
+        "INSERT OR REPLACE INTO DB_META (key, value) VALUES (?, ?)",
+        [(k, str(v)) for k, v in values.items()]
+    )
+
+
+def bump_data_version(conn):
+    """Increment DB_META.data_version inside the caller's transaction."""
+    conn.execute("""
+        INSERT INTO DB_META (key, value) VALUES ('data_version', '1')
+        ON CONFLICT (key) DO UPDATE SET value = CAST(value AS INTEGER) + 1
+    """)
+
+
+def _tag_dump_rows(conn):
+    """Tag the manual rows matching a record of the current dump with its
+    SOURCE_HASH, one row per record; the others were added through the
+    API and stay NULL.  Returns the number of tagged rows."""
+    theme_ids = {r[0] for r in conn.execute('SELECT "CS_TH_COD#" FROM THEMES')}
+    counters = {"skipped": 0, "with_struct": 0, "without_struct": 0}
+    in_dump = {}
+    for *pos, h in parse_positions(os.path.join(DATA_DIR, "positions.csv"), theme_ids,
+                                   label_codes.LabelCodes(conn), counters):
+        in_dump.setdefault(tuple(pos), []).append(h)
+    tags = []
+    for row in conn.execute(f"""
+        SELECT ROWID_POS, {POSITION_COLUMNS} FROM POSITIONS
+        WHERE AUTO = 0 AND SOURCE_HASH IS NULL ORDER BY ROWID_POS
+    """):
+        hashes = in_dump.get(tuple(row[1:]))
+        if hashes:
+            tags.append((hashes.pop(), row[0]))
+    conn.executemany("UPDATE POSITIONS SET SOURCE_HASH = ? WHERE ROWID_POS = ?", tags)
+    return len(tags)
+
+
+def _migrate_16(conn):
+    """POSITIONNEMENT table → POSITIONS (integer codes, LABELS dictionary,
+    AUTO flag) + POSITIONNEMENT view, from any layout since MIGRATABLE_FROM.
+
+    ROWID_POS values (and the AUTOINCREMENT counter) are kept.  A table
+    without SOURCE_HASH (< 13) gets its dump rows tagged (_tag_dump_rows);
+    THEME_CLOSURE (< 10), the auto rows and STATS_* are then brought in
+    line with THEMES and the manual rows.
+    """
+    old = {r[1] for r in conn.execute("PRAGMA table_info(POSITIONNEMENT)")}
+    conn.execute("ALTER TABLE POSITIONNEMENT RENAME TO POSITIONNEMENT_OLD")
+    conn.executescript(SCHEMA)
+    conn.execute("""
+        INSERT INTO LABELS (LABEL)
+        SELECT label FROM (
+            SELECT LIBCONTRIBUTION AS label FROM POSITIONNEMENT_OLD
+            UNION SELECT LIBELLETEMPORALITE FROM POSITIONNEMENT_OLD
+            UNION SELECT LIBELLESTRUCTURE FROM POSITIONNEMENT_OLD
+            UNION SELECT LIBELLETYPESTRUCTURE FROM POSITIONNEMENT_OLD
+            UNION SELECT LIBELLESTRUCTUREPARENTE FROM POSITIONNEMENT_OLD
+        ) WHERE label IS NOT NULL
+        ON CONFLICT (LABEL) DO NOTHING
+    """)
+    source_hash = "o.SOURCE_HASH" if "SOURCE_HASH" in old else "NULL"
+    source_count = "o.SOURCE_COUNT" if "SOURCE_COUNT" in old else "NULL"
+    conn.execute(f"""
+        INSERT INTO POSITIONS (ROWID_POS, {POSITION_COLUMNS}, AUTO, SOURCE_HASH, SOURCE_COUNT)
+        SELECT o.ROWID_POS, o.IDPERS, o.IDCONTRIBUTION, lc.CODE,
+               o.IDTEMPORALITE, lt.CODE,
+               o.IDTHEME,
+               o.IDSTRUCTURE, ls.CODE,
+               o.IDTYPESTRUCTURE, ly.CODE,
+               o.IDSTRUCTUREPARENTE, lp.CODE,
+               o.AUTO_GENERE IS 'O', {source_hash}, {source_count}
+        FROM POSITIONNEMENT_OLD o
+        LEFT JOIN LABELS lc ON lc.LABEL = o.LIBCONTRIBUTION
+        LEFT JOIN LABELS lt ON lt.LABEL = o.LIBELLETEMPORALITE
+        LEFT JOIN LABELS ls ON ls.LABEL = o.LIBELLESTRUCTURE
+        LEFT JOIN LABELS ly ON ly.LABEL = o.LIBELLETYPESTRUCTURE
+        LEFT JOIN LABELS lp ON lp.LABEL = o.LIBELLESTRUCTUREPARENTE
+        ORDER BY o.ROWID_POS
+    """)
+    conn.execute("""
+        UPDATE sqlite_sequence
+        SET seq = MAX(seq, COALESCE(
+            (SELECT seq FROM sqlite_sequence WHERE name = 'POSITIONNEMENT_OLD'), 0))
+        WHERE name = 'POSITIONS'
+    """)
+    # Its indexes and the STRUCTURE_LABELS triggers go with it; the indexes
+    # of POSITIONS sharing their names are created now
+    conn.execute("DROP TABLE POSITIONNEMENT_OLD")
+    conn.executescript(SCHEMA)
+    if "SOURCE_HASH" not in old:
+        print(f"    -> {_tag_dump_rows(conn)} positions rattachées au dump")
+    build_theme_closure(conn)
+    # Auto rows without SOURCE_COUNT (< 14) get it, any drift is repaired
+    added, removed = propagation.propagate(conn)
+    print(f"    -> positions propagées ({added} ajoutées, {removed} retirées)")
+    stats_tables.rebuild(conn)
+    n_labels = search_index.build(conn)
+    n_codes = conn.execute("SELECT COUNT(*) FROM LABELS").fetchone()[0]
+    print(f"    -> positions codées ({n_codes} libellés, {n_labels} libellés de structures indexés)")
+
+
+# Oldest schema_version migrate() upgrades in place; an older or
+# unversioned database is rebuilt from scratch by main().
+MIGRATABLE_FROM = "8"
+
+# Target version -> step from the previous target (from MIGRATABLE_FROM
+# for the first one, whatever the version in between).
+MIGRATIONS = {
+    "16": _migrate_16,
+}
+
+
+def migrate(conn):
+    """Apply the pending MIGRATIONS in place.  Returns False if the
+    database cannot be migrated (caller falls back to main())."""
+    row = conn.execute("SELECT value FROM DB_META WHERE key = 'schema_version'").fetchone()
+    current = row[0] if row else None
+    if current == SCHEMA_VERSION:
+        return True
+    if (current is None or not current.isdigit()
+            or not int(MIGRATABLE_FROM) <= int(current) < int(SCHEMA_VERSION)):
+        return False
+    for version in sorted(MIGRATIONS, key=int):
+        if int(current) < int(version) <= int(SCHEMA_VERSION):
+            print(f"  Migration du schéma {current} → {version}...")
+            MIGRATIONS[version](conn)
+            current = version
+    conn.executescript(SCHEMA)  # new tables / indexes (IF NOT EXISTS)
+    _write_meta(conn, {"schema_version": SCHEMA_VERSION,
+                       "themes_version": themes_fingerprint(conn),
+                       "persons_version": persons_fingerprint(conn)})
+    bump_data_version(conn)
+    conn.commit()
+    return True
+
+
+def _delta_themes(conn, path):
+    """Upsert the themes of Themes.csv that changed.
+
+    Returns (hierarchy_changed_ids, removed_ids): themes added, removed
+    or moved, whose subtrees need re-propagation, and themes no longer in
+    the dump.
+    """
+    old = {r[0]: r[1:] for r in conn.execute(
+        'SELECT "CS_TH_COD#", THEME, NIVEAU, THEME_PARENT FROM THEMES')}
+    new = {r[0]: r[1:] for r in parse_themes(path)}
+
+    changed = [(tid, *v) for tid, v in new.items() if old.get(tid) != v]
+    conn.executemany("""
+        INSERT INTO THEMES ("CS_TH_COD#", THEME, NIVEAU, THEME_PARENT) VALUES (?,?,?,?)
+        ON CONFLICT ("CS_TH_COD#") DO UPDATE SET
+            THEME = excluded.THEME, NIVEAU = excluded.NIVEAU, THEME_PARENT = excluded.THEME_PARENT
+    """, changed)
+    # A new label needs no position update: POSITIONNEMENT reads it from THEMES
+
+    removed = set(old) - set(new)
+    moved = {tid for tid, v in new.items() if tid not in old or old[tid][2] != v[2]}
+    print(f"    -> thèmes : {len(changed)} ajoutés/modifiés, {len(removed)} retirés")
+    return moved | removed, removed
+
+
+def _delta_positions(conn, path):
+    """Multiset diff of the dump records on SOURCE_HASH: delete the rows
+    whose record left the dump, parse and insert the new records (and
+    upsert their persons).  Positions added through the API (SOURCE_HASH
+    NULL) are never touched.  Returns the affected persons."""
+    have = Counter(dict(conn.execute(
+        "SELECT SOURCE_HASH, COUNT(*) FROM POSITIONS "
+        "WHERE SOURCE_HASH IS NOT NULL GROUP BY SOURCE_HASH")))
+    wanted = Counter()
+    new_records = {}
+    for h, fields in csv_records(path):
+        wanted[h] += 1
+        if wanted[h] > have[h] and h not in new_records:
+            new_records[h] = fields
+
+    affected = set()
+    removed = 0
+    for h, extra in (have - wanted).items():
+        for (pid,) in conn.execute("""
+            DELETE FROM POSITIONS WHERE ROWID_POS IN (
+                SELECT ROWID_POS FROM POSITIONS WHERE SOURCE_HASH = ? LIMIT ?)
+            RETURNING IDPERS
+        """, (h, extra)).fetchall():
+            affected.add(pid)
+            removed += 1
+
+    # Only the records not seen before are parsed
+    header = csv_header(path)
+    theme_ids = {r[0] for r in conn.execute('SELECT "CS_TH_COD#" FROM THEMES')}
+    codes = label_codes.LabelCodes(conn)
+    counters = {"skipped": 0, "with_struct": 0, "without_struct": 0}
+    persons = {}
+    added = []
+    for h, n in (wanted - have).items():
+        row = dict(zip(header, new_records[h]))
+        pos = position_from_row(row, theme_ids, codes, counters)
+        if pos is None:
+            continue
+        persons[pos[0]] = (row["PE_PE_NOM"].strip(), row["PE_PE_PRENOM"].strip())
+        added.extend([(*pos, h)] * n)
+
+    old = {}
+    if persons:
+        old = {r[0]: r[1:] for r in conn.execute(
+            'SELECT "PE_PE_COD#", PE_PE_NOM, PE_PE_PRENOM FROM PERSONNE '
+            'WHERE "PE_PE_COD#" IN (SELECT value FROM json_each(?))',
+            (json.dumps(sorted(persons)),))}
+    changed = [(pid, *v) for pid, v in persons.items() if old.get(pid) != v]
+    conn.executemany("""
+        INSERT INTO PERSONNE ("PE_PE_COD#", PE_PE_NOM, PE_PE_PRENOM) VALUES (?,?,?)
+        ON CONFLICT ("PE_PE_COD#") DO UPDATE SET
+            PE_PE_NOM = excluded.PE_PE_NOM, PE_PE_PRENOM = excluded.PE_PE_PRENOM
+    """, changed)
+    if changed:
+        _write_meta(conn, {"persons_version": persons_fingerprint(conn)})
+    insert_chunks(conn, INSERT_DUMP_POSITION, added, commit=False)
+    affected.update(pos[0] for pos in added)
+    print(f"    -> personnes : {len(changed)} ajoutées/modifiées")
+    print(f"    -> positions : {len(added)} ajoutées, {removed} retirées "
+          f"({counters['skipped']} lignes ignorées)")
+    return affected
+
+
+def _persons_under(conn, theme_ids):
+    """Persons with a manual position in the subtree of `theme_ids`."""
+    return {r[0] for r in conn.execute("""
+        SELECT DISTINCT p.IDPERS FROM POSITIONS p
+        JOIN THEME_CLOSURE c ON c.descendant = p.IDTHEME
+        WHERE c.ancestor IN (SELECT value FROM json_each(?)) AND p.AUTO = 0
+    """, (json.dumps(sorted(theme_ids)),))}
+
+
+def delta_import(conn):
+    """Bring an existing database in line with the CSV dump.
+
+    Cost is proportional to the difference: only changed themes, persons
+    and positions are written, and propagation / STATS_* are recomputed
+    for the affected persons only.  Returns the number of affected persons.
+    """
+    fingerprints = _dump_fingerprints()
+    stored = dict(conn.execute(
+        "SELECT key, value FROM DB_META WHERE key IN ('themes_csv', 'positions_csv')"))
+    if stored == fingerprints:
+        return 0
+    print("  Import différentiel du dump...")
+
+    # Themes first (new positions may reference new themes)
+    hier_ids, removed_themes = _delta_themes(
+        conn, os.path.join(DATA_DIR, "Themes.csv"))
+    affected = _delta_positions(conn, os.path.join(DATA_DIR, "positions.csv"))
+
+    if hier_ids:
+        # Subtrees before and after the hierarchy change
+        affected |= _persons_under(conn, hier_ids)
+        clear_auto(conn, affected)
+        deletable = [(tid,) for tid in removed_themes if not conn.execute(
+            'SELECT 1 FROM POSITIONS WHERE IDTHEME = ? '
+            'UNION ALL SELECT 1 FROM THEMES WHERE THEME_PARENT = ? LIMIT 1', (tid, tid)
+        ).fetchone()]
+        conn.executemany('DELETE FROM THEMES WHERE "CS_TH_COD#" = ?', deletable)
+        build_theme_closure(conn)
+        affected |= _persons_under(conn, hier_ids)
+
+    # Written before propagating: propagation.parent_map() is keyed on it
+    _write_meta(conn, {**fingerprints, "themes_version": themes_fingerprint(conn)})
+    if affected:
+        propagate_parents(conn, affected)
+        stats_tables.refresh_persons(conn, affected)
+        populate_structures(conn)
+    bump_data_version(conn)
+    conn.commit()
+    print(f"    -> {len(affected)} personnes recalculées")
+    return len(affected)
 
-    print(f"\n  Creating database: {DB_PATH}")
+
+def _open_existing():
+    """Connection to the existing csr.db, or None if there is none."""
+    if not os.path.exists(DB_PATH):
+        return None
     conn = sqlite3.connect(DB_PATH)
     conn.execute("PRAGMA journal_mode=WAL")
     conn.execute("PRAGMA foreign_keys=ON")
+    if not conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'DB_META'"
+    ).fetchone():
+        conn.close()
+        return None
+    return conn
+
+
+def migrate_db():
+    """Apply the pending schema migrations to csr.db in place.
+
+    Returns False when the database is missing or too old to migrate;
+    the caller then rebuilds it from scratch.
+    """
+    conn = _open_existing()
+    if conn is None:
+        return False
+    try:
+        return migrate(conn)
+    finally:
+        conn.close()
+
+
+def import_delta():
+    """Apply the changes of the CSV dump to csr.db in one transaction."""
+    conn = _open_existing()
+    if conn is None:
+        return 0
+    try:
+        return delta_import(conn)
+    finally:
+        conn.close()
+
+
+def update():
+    """Update csr.db in place (migrations, then delta import).
+
+    Returns False when the database cannot be migrated (see migrate_db).
+    """
+    if not migrate_db():
+        return False
+    import_delta()
+    return True
+
+
+def install(built_path, target=None):
+    """Atomically move a database built by build() over `target`.
+
+    No connection to `target` may be open (db.py pauses its pool): the
+    -wal / -shm files left next to it belong to the old file.
+    """
+    target = target or DB_PATH
+    for suffix in ("-wal", "-shm"):
+        if os.path.exists(target + suffix):
+            os.remove(target + suffix)
+    os.replace(built_path, target)
+
+
+def main():
+    """Full rebuild: build into a temporary file, then swap it in."""
+    tmp = DB_PATH + ".build"
+    build(tmp)
+    install(tmp)
+    print(f"  Database installed: {DB_PATH}\n")
+
+
+def build(path):
+    """Create a complete database at `path` from the CSV dump."""
+    for leftover in (path, path + "-wal", path + "-shm"):
+        if os.path.exists(leftover):
+            os.remove(leftover)
+            print(f"  Removed old file: {leftover}")
+
+    print(f"\n  Creating database: {path}")
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA foreign_keys=ON")
+    for pragma in INGEST_PRAGMAS:
+        conn.execute(pragma)
 
     # Create schema
     conn.executescript(SCHEMA)
     print("  Schema created.")
 
-    # Load data
+    # Load data (secondary indexes are built once the rows are in)
     n_themes = load_themes(conn)
-    n_persons = load_persons(conn)
-    n_positions = load_positions(conn)
-    n_propagated = propagate_parents(conn)
+    with deferred_indexes(conn, "PERSONNE", "POSITIONS"):
+        n_persons = load_persons(conn)
+        n_positions = load_positions(conn)
+        # Full pass: plain scans, bulk inserts without index maintenance
+        n_propagated = propagate_parents(conn)
     create_default_users(conn)
 
     populate_structures(conn)
 
+    # Once the data is in: the bulk loads above skip the sync triggers
+    print("  Building search indexes...")
+    n_labels = search_index.build(conn)
+    print(f"    -> PERSONNE_FTS, THEMES_FTS, STRUCTURES_FTS ({n_labels} structure labels)")
+
+    print("  Precomputing dashboard aggregates...")
+    with deferred_indexes(conn, "STATS_MEMBER"):
+        n_stats = stats_tables.rebuild(conn)
+    print(f"    -> {n_stats} STATS_COUNT rows")
+
     # Store schema version
     conn.execute(
         "INSERT OR REPLACE INTO DB_META (key, value) VALUES ('schema_version', ?)",
         (SCHEMA_VERSION,)
     )
     print(f"  Schema version set to: {SCHEMA_VERSION}")
+    conn.execute(
+        "INSERT OR REPLACE INTO DB_META (key, value) VALUES ('themes_version', ?)",
+        (themes_fingerprint(conn),)
+    )
+    conn.execute(
+        "INSERT OR REPLACE INTO DB_META (key, value) VALUES ('persons_version', ?)",
+        (persons_fingerprint(conn),)
+    )
+    # Build time in ms: stays above any version reached by the previous DB
+    conn.execute(
+        "INSERT OR REPLACE INTO DB_META (key, value) VALUES ('data_version', ?)",
+        (str(int(time.time() * 1000)),)
+    )
+    # Dump fingerprints: delta_import() skips an unchanged dump
+    _write_meta(conn, _dump_fingerprints())
+
+    # Refresh planner statistics for the composite indexes
+    conn.execute("ANALYZE")
 
     conn.commit()
 
     # Verify
     print("\n  === Verification ===")
-    for table in ("THEMES", "PERSONNE", "POSITIONNEMENT", "USERS", "DB_META"):
+    for table in ("THEMES", "THEME_CLOSURE", "PERSONNE", "POSITIONS", "LABELS", "USERS", "DB_META"):
         count = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
         print(f"    {table}: {count} rows")
 
@@ -461,15 +1040,15 @@ def main():
     print(f"    Root themes: {roots}")
 
     present = conn.execute(
-        "SELECT COUNT(*) FROM POSITIONNEMENT WHERE LIBELLETEMPORALITE = 'Présent'"
+        "SELECT COUNT(*) FROM POSITIONS WHERE CODE_TEMPORALITE = ?", (label_codes.PRESENT,)
     ).fetchone()[0]
     print(f"    Present positions: {present}")
 
     auto = conn.execute(
-        "SELECT COUNT(*) FROM POSITIONNEMENT WHERE AUTO_GENERE = 'O'"
+        "SELECT COUNT(*) FROM POSITIONS WHERE AUTO = 1"
     ).fetchone()[0]
     manu = conn.execute(
-        "SELECT COUNT(*) FROM POSITIONNEMENT WHERE AUTO_GENERE IS NULL"
+        "SELECT COUNT(*) FROM POSITIONS WHERE AUTO = 0"
     ).fetchone()[0]
     print(f"    Manual positions: {manu}")
     print(f"    Auto-generated (propagated): {auto}")
@@ -502,9 +1081,11 @@ def main():
         print(f"    [WARN] CTE={total_via_cte} vs Direct={total_direct}")
 
     conn.close()
-    print(f"\n  Database ready: {DB_PATH}")
-    print(f"  Size: {os.path.getsize(DB_PATH):,} bytes\n")
+    print(f"\n  Database ready: {path}")
+    print(f"  Size: {os.path.getsize(path):,} bytes\n")
 
 
 if __name__ == "__main__":
-    main()
+    # --delta: in-place update (falls back to a full rebuild if impossible)
+    if "--delta" not in sys.argv or not update():
+        main()
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+label_codes.py - Dictionary encoding of the position labels (LABELS).
+
+POSITIONS stores the labels of a position (role, temporality, structure,
+structure type, parent structure) as integer codes into
+
+  LABELS(CODE INTEGER PRIMARY KEY, LABEL TEXT NOT NULL UNIQUE)
+
+and the POSITIONNEMENT view joins them back under their former column
+names.  The labels the queries filter on get fixed codes (SEEDED, part
+of init_db.SCHEMA), so that SQL can compare integers directly
+(`CODE_TEMPORALITE = PRESENT`); any other label gets the next free code
+the first time it is written.
+
+Works on a raw sqlite3 connection or cursor so that init_db can use it
+without importing db.py.
+"""
+
+# Fixed codes, never reassigned
+PRESENT = 1
+PASSE = 2
+EXPERT = 3
+CONTRIBUTEUR = 4
+UTILISATEUR = 5
+
+SEEDED = {
+    "Présent": PRESENT,
+    "Passé": PASSE,
+    "Expert": EXPERT,
+    "Contributeur": CONTRIBUTEUR,
+    "Utilisateur": UTILISATEUR,
+}
+
+SEED_SQL = "INSERT OR IGNORE INTO LABELS (CODE, LABEL) VALUES " + ", ".join(
+    f"({code}, '{label}')" for label, code in SEEDED.items())
+
+
+def code_sql(expr):
+    """SQL scalar subquery giving the code of the label `expr` (a bind
+    name or literal), NULL for an unknown label."""
+    return f"(SELECT CODE FROM LABELS WHERE LABEL = {expr})"
+
+
+def add(conn, labels):
+    """Make sure every label of `labels` (None ignored) has a code."""
+    conn.executemany(
+        "INSERT INTO LABELS (LABEL) VALUES (?) ON CONFLICT (LABEL) DO NOTHING",
+        [(label,) for label in set(labels) if label is not None])
+
+
+class LabelCodes:
+    """LABELS as {label: code} for bulk writers; code() adds the labels
+    it has not seen yet."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.codes = dict(conn.execute("SELECT LABEL, CODE FROM LABELS"))
+
+    def code(self, label):
+        if label is None:
+            return None
+        c = self.codes.get(label)
+        if c is None:
+            add(self.conn, [label])
+            c = self.codes[label] = self.conn.execute(
+                "SELECT CODE FROM LABELS WHERE LABEL = ?", (label,)).fetchone()[0]
+        return c
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""
+propagation.py - Auto-generated positions on parent themes (POSITIONS.AUTO = 1).
+
+Every manual position is propagated to all strict ancestors of its theme,
+like the Oracle procedure PROPAGER_POSITIONNEMENT_PARENT.  Manual rows are
+grouped by everything an auto row copies from its source (person, role,
+temporality, structure and their label codes); the wanted auto rows of a group
+are the union of the ancestors of its themes, minus the themes on which
+the person already holds a non-auto row with the same role and structure.
+Each auto row carries SOURCE_COUNT, the number of manual rows of its group
+whose theme lies below it.
+
+`propagate(conn, person_ids=None)` computes that set in Python from a
+cached parent map, diffs it against the existing auto rows and applies
+the inserts, count updates and deletes in bulk, so that a targeted call
+costs the positions of `person_ids` only and rewrites nothing that is
+already right.
+
+`add_sources()` / `remove_sources()` maintain the counts after single
+manual rows were inserted or deleted: they only touch the ancestor chain
+of those rows' themes (plus, on removal, the theme itself when it stops
+being held), whatever the number of positions of the person.
+
+Works on a raw sqlite3 connection or cursor so that init_db can use it
+without importing db.py.
+"""
+import json
+import threading
+from collections import Counter
+
+# Columns an auto row copies from its manual source, in this order
+CARRIED = (
+    "IDPERS", "IDCONTRIBUTION", "CODE_CONTRIBUTION",
+    "IDTEMPORALITE", "CODE_TEMPORALITE",
+    "IDSTRUCTURE", "CODE_STRUCTURE",
+    "IDTYPESTRUCTURE", "CODE_TYPESTRUCTURE",
+    "IDSTRUCTUREPARENTE", "CODE_STRUCTUREPARENTE",
+)
+CARRIED_SQL = ", ".join(CARRIED)
+
+INSERT_AUTO = f"""
+    INSERT INTO POSITIONS ({CARRIED_SQL}, IDTHEME, SOURCE_COUNT, AUTO)
+    VALUES ({", ".join("?" * (len(CARRIED) + 2))}, 1)
+"""
+# Auto rows of one group (IS: NULL-safe) on a set of themes
+_GROUP_AUTO = ("AUTO = 1 AND IDPERS = ? AND IDTHEME IN (SELECT value FROM json_each(?)) AND "
+               + " AND ".join(f"{c} IS ?" for c in CARRIED[1:]))
+
+
+class ParentMap:
+    """THEMES as {id: parent}, with memoised strict ancestors."""
+
+    def __init__(self, rows, version=None):
+        self.version = version
+        self.parent = dict(rows)
+        self._ancestors = {}
+
+    def ancestors(self, tid):
+        """Strict ancestors of `tid` (nearest first), like THEME_CLOSURE
+        with depth > 0: the chain stops at a parent missing from THEMES."""
+        out = self._ancestors.get(tid)
+        if out is None:
+            chain = []
+            p = self.parent.get(tid)
+            while p in self.parent and p != tid and p not in chain:
+                chain.append(p)
+                p = self.parent[p]
+            out = self._ancestors[tid] = tuple(chain)
+        return out
+
+
+_lock = threading.Lock()
+_parents = None
+
+
+def parent_map(conn):
+    """Process-wide ParentMap, reloaded when DB_META.themes_version changes.
+
+    A database without themes_version (being built) always gets a fresh,
+    uncached map.
+    """
+    global _parents
+    row = conn.execute("SELECT value FROM DB_META WHERE key = 'themes_version'").fetchone()
+    version = row[0] if row else None
+    pm = _parents
+    if version is not None and pm is not None and pm.version == version:
+        return pm
+    pm = ParentMap(conn.execute('SELECT "CS_TH_COD#", THEME_PARENT FROM THEMES'),
+                   version)
+    if version is not None:
+        with _lock:
+            _parents = pm
+    return pm
+
+
+def invalidate():
+    """Forget the cached parent map."""
+    global _parents
+    with _lock:
+        _parents = None
+
+
+def propagate(conn, person_ids=None):
+    """Bring the auto rows of `person_ids` (default: everybody) in line
+    with their manual rows.  Returns (added, removed)."""
+    pm = parent_map(conn)
+    binds = {}
+    pfilter = ""
+    if person_ids is not None:
+        pids = sorted({int(p) for p in person_ids})
+        if not pids:
+            return 0, 0
+        binds["pids"] = json.dumps(pids)
+        pfilter = "AND IDPERS IN (SELECT value FROM json_each(:pids))"
+
+    # (person, role, theme, structure) already held by a non-auto row:
+    # no auto row there
+    held = {tuple(r) for r in conn.execute(f"""
+        SELECT DISTINCT IDPERS, IDCONTRIBUTION, IDTHEME, COALESCE(IDSTRUCTURE, -1)
+        FROM POSITIONS
+        WHERE AUTO = 0 {pfilter}
+    """, binds)}
+
+    # group -> {ancestor theme: [SOURCE_COUNT, ROWID_POS of the matching
+    # auto row or None]}
+    wanted = {}
+    for row in conn.execute(f"""
+        SELECT {CARRIED_SQL}, IDTHEME, COUNT(*) FROM POSITIONS
+        WHERE AUTO = 0 {pfilter}
+        GROUP BY {CARRIED_SQL}, IDTHEME
+    """, binds):
+        ancestors = pm.ancestors(row[-2])
+        if not ancestors:
+            continue
+        group = tuple(row[:-2])
+        themes = wanted.get(group)
+        if themes is None:
+            themes = wanted[group] = {}
+        pers, contr, struct = group[0], group[1], group[5]
+        struct = -1 if struct is None else struct
+        for anc in ancestors:
+            if (pers, contr, anc, struct) not in held:
+                themes.setdefault(anc, [0, None])[0] += row[-1]
+
+    # Keep the auto rows that are still wanted (one per key), delete the
+    # others
+    stale, recount = [], []
+    for row in conn.execute(f"""
+        SELECT ROWID_POS, {CARRIED_SQL}, IDTHEME, SOURCE_COUNT FROM POSITIONS
+        WHERE AUTO = 1 {pfilter}
+    """, binds):
+        themes = wanted.get(tuple(row[1:-2]))
+        tid, count = row[-2], row[-1]
+        want = themes.get(tid) if themes is not None else None
+        if want is not None and want[1] is None:
+            want[1] = row[0]
+            if count != want[0]:
+                recount.append((want[0], row[0]))
+        else:
+            stale.append((row[0],))
+
+    added = [(*group, tid, count)
+             for group, themes in wanted.items()
+             for tid, (count, kept) in themes.items() if kept is None]
+    conn.executemany("DELETE FROM POSITIONS WHERE ROWID_POS = ?", stale)
+    conn.executemany("UPDATE POSITIONS SET SOURCE_COUNT = ? WHERE ROWID_POS = ?", recount)
+    conn.executemany(INSERT_AUTO, added)
+    return len(added), len(stale)
+
+
+def _held(conn, pers, contr, struct, themes):
+    """Themes of `themes` on which the person holds a non-auto row with
+    this role and structure."""
+    return {r[0] for r in conn.execute("""
+        SELECT DISTINCT IDTHEME FROM POSITIONS
+        WHERE IDPERS = ? AND IDTHEME IN (SELECT value FROM json_each(?))
+          AND IDCONTRIBUTION IS ? AND COALESCE(IDSTRUCTURE, -1) = COALESCE(?, -1)
+          AND AUTO = 0
+    """, (pers, json.dumps(sorted(themes)), contr, struct))}
+
+
+def add_sources(conn, rows):
+    """Account for manual rows just inserted; `rows` are tuples of the
+    CARRIED columns followed by IDTHEME (see `INSERT ... RETURNING`)."""
+    pm = parent_map(conn)
+    for (*group, tid), n in Counter(tuple(r) for r in rows).items():
+        pers, contr, struct = group[0], group[1], group[5]
+        # The theme itself is now held: no auto row of this role/structure there
+        conn.execute("""
+            DELETE FROM POSITIONS
+            WHERE AUTO = 1 AND IDPERS = ? AND IDTHEME = ?
+              AND IDCONTRIBUTION IS ? AND COALESCE(IDSTRUCTURE, -1) = COALESCE(?, -1)
+        """, (pers, tid, contr, struct))
+        chain = pm.ancestors(tid)
+        if not chain:
+            continue
+        chain_json = json.dumps(chain)
+        binds = (pers, chain_json, *group[1:])
+        present = {r[0] for r in conn.execute(
+            f"SELECT IDTHEME FROM POSITIONS WHERE {_GROUP_AUTO}", binds)}
+        conn.execute(
+            f"UPDATE POSITIONS SET SOURCE_COUNT = SOURCE_COUNT + ? WHERE {_GROUP_AUTO}",
+            (n, *binds))
+        missing = set(chain) - present
+        if missing:
+            missing -= _held(conn, pers, contr, struct, missing)
+        conn.executemany(INSERT_AUTO, [(*group, anc, n)
+                                       for anc in chain if anc in missing])
+
+
+def remove_sources(conn, rows):
+    """Account for manual rows just deleted; `rows` are tuples of the
+    CARRIED columns followed by IDTHEME (see `DELETE ... RETURNING`)."""
+    pm = parent_map(conn)
+    freed = set()
+    for (*group, tid), n in Counter(tuple(r) for r in rows).items():
+        chain = pm.ancestors(tid)
+        if chain:
+            binds = (group[0], json.dumps(chain), *group[1:])
+            conn.execute(
+                f"UPDATE POSITIONS SET SOURCE_COUNT = SOURCE_COUNT - ? WHERE {_GROUP_AUTO}",
+                (n, *binds))
+            conn.execute(
+                f"DELETE FROM POSITIONS WHERE {_GROUP_AUTO} AND SOURCE_COUNT <= 0", binds)
+        freed.add((group[0], group[1], group[5], tid))
+
+    # A theme no longer held gets the auto rows its remaining sources
+    # below it call for (once every count above has been decremented)
+    columns = ", ".join("p." + c for c in CARRIED)
+    for pers, contr, struct, tid in freed:
+        if _held(conn, pers, contr, struct, [tid]):
+            continue
+        conn.executemany(INSERT_AUTO, [(*r[:-1], tid, r[-1]) for r in conn.execute(f"""
+            SELECT {columns}, COUNT(*)
+            FROM POSITIONS p
+            JOIN THEME_CLOSURE c ON c.descendant = p.IDTHEME AND c.ancestor = ? AND c.depth > 0
+            WHERE p.IDPERS = ? AND p.AUTO = 0
+              AND p.IDCONTRIBUTION IS ? AND COALESCE(p.IDSTRUCTURE, -1) = COALESCE(?, -1)
+            GROUP BY {columns}
+        """, (tid, pers, contr, struct)).fetchall()])
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+search_index.py - FTS5 tables behind the /find autocompletes.
+
+  PERSONNE_FTS(PE_PE_NOM, PE_PE_PRENOM)  external content: PERSONNE
+  THEMES_FTS(THEME)                      external content: THEMES
+  STRUCTURE_LABELS(id, IDSTRUCTURE, LIBELLESTRUCTURE, POSITIONS)
+      (structure, label) pairs used by POSITIONS ('' for no label)
+      with their number of positions: what /api/structures/find lists
+  STRUCTURES_FTS(acronyme, libelle, label)
+      one row per STRUCTURE_LABELS row (same rowid), acronym and full
+      name taken from STRUCTURES
+
+Every index uses the unicode61 tokenizer with remove_diacritics 2, so
+that "modelisation" finds "Modélisation" and "present" "Présent".  The
+triggers of STATEMENTS keep the four tables in sync with any write to
+PERSONNE, THEMES, STRUCTURES or POSITIONS (API, delta import,
+propagation).
+
+`build(conn)` creates everything and fills it from the current data; it
+runs once the data is loaded (init_db.build, migration 16), so the bulk
+loads of a build do not go through the triggers.  `match_expr(q)` turns
+user input into an FTS5 prefix query.
+
+Works on a raw sqlite3 connection or cursor so that init_db can use it
+without importing db.py.
+"""
+import re
+
+TOKENIZE = "unicode61 remove_diacritics 2"
+
+# LIBELLESTRUCTURE of a POSITIONS row, '' for none
+_NEW_LABEL = "COALESCE((SELECT LABEL FROM LABELS WHERE CODE = new.CODE_STRUCTURE), '')"
+_OLD_LABEL = "COALESCE((SELECT LABEL FROM LABELS WHERE CODE = old.CODE_STRUCTURE), '')"
+
+# Executed one by one (no executescript: it would commit the caller's
+# transaction)
+STATEMENTS = (
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS PERSONNE_FTS USING fts5(
+        PE_PE_NOM, PE_PE_PRENOM,
+        content='PERSONNE', content_rowid='PE_PE_COD#', tokenize='{TOKENIZE}')""",
+    """CREATE TRIGGER IF NOT EXISTS trg_personne_fts_ai AFTER INSERT ON PERSONNE BEGIN
+        INSERT INTO PERSONNE_FTS (rowid, PE_PE_NOM, PE_PE_PRENOM)
+        VALUES (new."PE_PE_COD#", new.PE_PE_NOM, new.PE_PE_PRENOM);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS trg_personne_fts_ad AFTER DELETE ON PERSONNE BEGIN
+        INSERT INTO PERSONNE_FTS (PERSONNE_FTS, rowid, PE_PE_NOM, PE_PE_PRENOM)
+        VALUES ('delete', old."PE_PE_COD#", old.PE_PE_NOM, old.PE_PE_PRENOM);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS trg_personne_fts_au AFTER UPDATE ON PERSONNE BEGIN
+        INSERT INTO PERSONNE_FTS (PERSONNE_FTS, rowid, PE_PE_NOM, PE_PE_PRENOM)
+        VALUES ('delete', old."PE_PE_COD#", old.PE_PE_NOM, old.PE_PE_PRENOM);
+        INSERT INTO PERSONNE_FTS (rowid, PE_PE_NOM, PE_PE_PRENOM)
+        VALUES (new."PE_PE_COD#", new.PE_PE_NOM, new.PE_PE_PRENOM);
+    END""",
+
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS THEMES_FTS USING fts5(
+        THEME, content='THEMES', content_rowid='CS_TH_COD#', tokenize='{TOKENIZE}')""",
+    """CREATE TRIGGER IF NOT EXISTS trg_themes_fts_ai AFTER INSERT ON THEMES BEGIN
+        INSERT INTO THEMES_FTS (rowid, THEME) VALUES (new."CS_TH_COD#", new.THEME);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS trg_themes_fts_ad AFTER DELETE ON THEMES BEGIN
+        INSERT INTO THEMES_FTS (THEMES_FTS, rowid, THEME) VALUES ('delete', old."CS_TH_COD#", old.THEME);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS trg_themes_fts_au AFTER UPDATE OF THEME ON THEMES BEGIN
+        INSERT INTO THEMES_FTS (THEMES_FTS, rowid, THEME) VALUES ('delete', old."CS_TH_COD#", old.THEME);
+        INSERT INTO THEMES_FTS (rowid, THEME) VALUES (new."CS_TH_COD#", new.THEME);
+    END""",
+
+    """CREATE TABLE IF NOT EXISTS STRUCTURE_LABELS (
+        id               INTEGER PRIMARY KEY,
+        IDSTRUCTURE      INTEGER NOT NULL,
+        LIBELLESTRUCTURE TEXT NOT NULL,
+        POSITIONS        INTEGER NOT NULL,
+        UNIQUE (IDSTRUCTURE, LIBELLESTRUCTURE)
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS trg_pos_structure_ai AFTER INSERT ON POSITIONS
+    WHEN new.IDSTRUCTURE IS NOT NULL BEGIN
+        INSERT INTO STRUCTURE_LABELS (IDSTRUCTURE, LIBELLESTRUCTURE, POSITIONS)
+        VALUES (new.IDSTRUCTURE, {_NEW_LABEL}, 1)
+        ON CONFLICT (IDSTRUCTURE, LIBELLESTRUCTURE) DO UPDATE SET POSITIONS = POSITIONS + 1;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS trg_pos_structure_ad AFTER DELETE ON POSITIONS
+    WHEN old.IDSTRUCTURE IS NOT NULL BEGIN
+        UPDATE STRUCTURE_LABELS SET POSITIONS = POSITIONS - 1
+        WHERE IDSTRUCTURE = old.IDSTRUCTURE AND LIBELLESTRUCTURE = {_OLD_LABEL};
+        DELETE FROM STRUCTURE_LABELS
+        WHERE IDSTRUCTURE = old.IDSTRUCTURE AND LIBELLESTRUCTURE = {_OLD_LABEL}
+          AND POSITIONS <= 0;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS trg_pos_structure_au
+    AFTER UPDATE OF IDSTRUCTURE, CODE_STRUCTURE ON POSITIONS BEGIN
+        UPDATE STRUCTURE_LABELS SET POSITIONS = POSITIONS - 1
+        WHERE IDSTRUCTURE = old.IDSTRUCTURE AND LIBELLESTRUCTURE = {_OLD_LABEL};
+        DELETE FROM STRUCTURE_LABELS
+        WHERE IDSTRUCTURE = old.IDSTRUCTURE AND LIBELLESTRUCTURE = {_OLD_LABEL}
+          AND POSITIONS <= 0;
+        INSERT INTO STRUCTURE_LABELS (IDSTRUCTURE, LIBELLESTRUCTURE, POSITIONS)
+        SELECT new.IDSTRUCTURE, {_NEW_LABEL}, 1 WHERE new.IDSTRUCTURE IS NOT NULL
+        ON CONFLICT (IDSTRUCTURE, LIBELLESTRUCTURE) DO UPDATE SET POSITIONS = POSITIONS + 1;
+    END""",
+
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS STRUCTURES_FTS USING fts5(
+        acronyme, libelle, label, tokenize='{TOKENIZE}')""",
+    """CREATE TRIGGER IF NOT EXISTS trg_structure_labels_fts_ai AFTER INSERT ON STRUCTURE_LABELS BEGIN
+        INSERT INTO STRUCTURES_FTS (rowid, acronyme, libelle, label)
+        VALUES (new.id,
+                (SELECT acronyme FROM STRUCTURES WHERE id = new.IDSTRUCTURE),
+                (SELECT libelle FROM STRUCTURES WHERE id = new.IDSTRUCTURE),
+                new.LIBELLESTRUCTURE);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS trg_structure_labels_fts_ad AFTER DELETE ON STRUCTURE_LABELS BEGIN
+        DELETE FROM STRUCTURES_FTS WHERE rowid = old.id;
+    END""",
+    # INSERT OR REPLACE (populate_structures) only fires the insert trigger
+    """CREATE TRIGGER IF NOT EXISTS trg_structures_fts_ai AFTER INSERT ON STRUCTURES BEGIN
+        UPDATE STRUCTURES_FTS SET acronyme = new.acronyme, libelle = new.libelle
+        WHERE rowid IN (SELECT id FROM STRUCTURE_LABELS WHERE IDSTRUCTURE = new.id);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS trg_structures_fts_au AFTER UPDATE ON STRUCTURES BEGIN
+        UPDATE STRUCTURES_FTS SET acronyme = new.acronyme, libelle = new.libelle
+        WHERE rowid IN (SELECT id FROM STRUCTURE_LABELS WHERE IDSTRUCTURE = new.id);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS trg_structures_fts_ad AFTER DELETE ON STRUCTURES BEGIN
+        UPDATE STRUCTURES_FTS SET acronyme = NULL, libelle = NULL
+        WHERE rowid IN (SELECT id FROM STRUCTURE_LABELS WHERE IDSTRUCTURE = old.id);
+    END""",
+)
+
+
+def build(conn):
+    """Create the search tables and triggers, and (re)fill them from the
+    current data.  Returns the number of indexed structure labels."""
+    for sql in STATEMENTS:
+        conn.execute(sql)
+    conn.execute("INSERT INTO PERSONNE_FTS (PERSONNE_FTS) VALUES ('rebuild')")
+    conn.execute("INSERT INTO THEMES_FTS (THEMES_FTS) VALUES ('rebuild')")
+    # STRUCTURES_FTS follows through the STRUCTURE_LABELS triggers
+    conn.execute("DELETE FROM STRUCTURE_LABELS")
+    conn.execute("""
+        INSERT INTO STRUCTURE_LABELS (IDSTRUCTURE, LIBELLESTRUCTURE, POSITIONS)
+        SELECT p.IDSTRUCTURE, COALESCE(l.LABEL, ''), COUNT(*)
+        FROM POSITIONS p
+        LEFT JOIN LABELS l ON l.CODE = p.CODE_STRUCTURE
+        WHERE p.IDSTRUCTURE IS NOT NULL
+        GROUP BY p.IDSTRUCTURE, COALESCE(l.LABEL, '')
+    """)
+    return conn.execute("SELECT COUNT(*) FROM STRUCTURE_LABELS").fetchone()[0]
+
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def match_expr(q):
+    """FTS5 query matching every word of `q` as a prefix
+    ('jean pi' -> '"jean"* "pi"*'), or None if `q` has no word."""
+    words = _WORD_RE.findall(q)
+    if not words:
+        return None
+    return " ".join(f'"{w}"*' for w in words)
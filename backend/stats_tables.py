@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+stats_tables.py - Precomputed dashboard aggregates (STATS_MEMBER / STATS_COUNT).
+
+Every dashboard widget is a distinct-person count per key, so the data
+is kept as:
+
+  STATS_MEMBER(mode, dim, key_id, key_label, idpers)  -- person belongs to key
+  STATS_COUNT (mode, dim, key_id, key_label, cnt)     -- COUNT(*) of the above
+
+for mode in ('manu', 'all') and the dimensions below.  `rebuild()` fills
+both tables from POSITIONS (init_db.main); `refresh_persons()`
+recomputes the memberships of a few persons only and applies the
+difference to STATS_COUNT (add_position / delete_position).
+
+Works on a raw sqlite3 connection or cursor so that init_db can use it
+without importing db.py.
+"""
+import json
+from collections import Counter
+
+import label_codes
+
+MODES = {
+    "manu": "AUTO = 0",
+    "all":  "1=1",
+}
+
+# dim -> SELECT (key_id, key_label, idpers) over POSITIONS, {where} being
+# the mode filter (+ person filter) and {present} the present-positions
+# filter (integer code).  Everything but 'temp' is restricted to present
+# positions, like the endpoints reading them; labels come from LABELS.
+PRESENT = f"CODE_TEMPORALITE = {label_codes.PRESENT}"
+
+DIMENSIONS = {
+    # /top/themes, overview.themes_active, themes_coverage.total
+    "theme": """
+        SELECT DISTINCT IDTHEME, '', IDPERS FROM POSITIONS
+        WHERE {present} AND {where}""",
+    # themes_coverage experts / contributeurs / utilisateurs
+    "theme_role": """
+        SELECT DISTINCT IDTHEME, COALESCE(l.LABEL, ''), IDPERS
+        FROM POSITIONS LEFT JOIN LABELS l ON l.CODE = CODE_CONTRIBUTION
+        WHERE {present} AND {where}""",
+    # /top/structures (grouped by id + label)
+    "structure": """
+        SELECT DISTINCT IDSTRUCTURE, COALESCE(l.LABEL, CAST(IDSTRUCTURE AS TEXT)), IDPERS
+        FROM POSITIONS LEFT JOIN LABELS l ON l.CODE = CODE_STRUCTURE
+        WHERE IDSTRUCTURE IS NOT NULL AND {present} AND {where}""",
+    # /all_structures, overview.structures_active
+    "structure_id": """
+        SELECT DISTINCT IDSTRUCTURE, '', IDPERS FROM POSITIONS
+        WHERE IDSTRUCTURE IS NOT NULL AND {present} AND {where}""",
+    # /distribution (role)
+    "role": """
+        SELECT DISTINCT 0, COALESCE(l.LABEL, '(N/A)'), IDPERS
+        FROM POSITIONS LEFT JOIN LABELS l ON l.CODE = CODE_CONTRIBUTION
+        WHERE {present} AND {where}""",
+    # /distribution (temporalite) — all temporalities
+    "temp": """
+        SELECT DISTINCT 0, COALESCE(l.LABEL, '(N/A)'), IDPERS
+        FROM POSITIONS LEFT JOIN LABELS l ON l.CODE = CODE_TEMPORALITE
+        WHERE {where}""",
+    # /themes_per_person, overview.people_present / themes_per_person:
+    # key_id = number of distinct present themes of the person
+    "bucket": """
+        SELECT COUNT(DISTINCT IDTHEME), '', IDPERS FROM POSITIONS
+        WHERE {present} AND {where}
+        GROUP BY IDPERS""",
+}
+
+
+def _members_sql(mode, person_filter=""):
+    where = MODES[mode] + person_filter
+    return " UNION ALL ".join(
+        f"SELECT '{mode}', '{dim}', * FROM ({sql.format(where=where, present=PRESENT)})"
+        for dim, sql in DIMENSIONS.items()
+    )
+
+
+def rebuild(conn):
+    """Recompute both STATS_* tables from scratch."""
+    conn.execute("DELETE FROM STATS_MEMBER")
+    conn.execute("DELETE FROM STATS_COUNT")
+    for mode in MODES:
+        conn.execute(
+            "INSERT INTO STATS_MEMBER (mode, dim, key_id, key_label, idpers) "
+            + _members_sql(mode)
+        )
+    conn.execute("""
+        INSERT INTO STATS_COUNT (mode, dim, key_id, key_label, cnt)
+        SELECT mode, dim, key_id, key_label, COUNT(*)
+        FROM STATS_MEMBER
+        GROUP BY mode, dim, key_id, key_label
+    """)
+    return conn.execute("SELECT COUNT(*) FROM STATS_COUNT").fetchone()[0]
+
+
+def refresh_persons(conn, person_ids):
+    """Bring the aggregates up to date after positions of `person_ids` changed.
+
+    Cost is proportional to the positions of those persons only.
+    """
+    pids = sorted({int(p) for p in person_ids})
+    if not pids:
+        return
+    binds = {"pids": json.dumps(pids)}
+    pfilter = " AND IDPERS IN (SELECT value FROM json_each(:pids))"
+
+    old = {tuple(r) for r in conn.execute("""
+        SELECT mode, dim, key_id, key_label, idpers FROM STATS_MEMBER
+        WHERE idpers IN (SELECT value FROM json_each(:pids))
+    """, binds)}
+    new = set()
+    for mode in MODES:
+        new.update(tuple(r) for r in conn.execute(_members_sql(mode, pfilter), binds))
+
+    removed, added = old - new, new - old
+    if not removed and not added:
+        return
+    conn.executemany(
+        "DELETE FROM STATS_MEMBER WHERE mode = ? AND dim = ? AND key_id = ? "
+        "AND key_label = ? AND idpers = ?", sorted(removed))
+    conn.executemany(
+        "INSERT INTO STATS_MEMBER (mode, dim, key_id, key_label, idpers) "
+        "VALUES (?, ?, ?, ?, ?)", sorted(added))
+
+    delta = Counter()
+    for r in removed:
+        delta[r[:4]] -= 1
+    for r in added:
+        delta[r[:4]] += 1
+    conn.executemany("""
+        INSERT INTO STATS_COUNT (mode, dim, key_id, key_label, cnt)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (mode, dim, key_id, key_label) DO UPDATE SET cnt = cnt + excluded.cnt
+    """, [(*k, d) for k, d in sorted(delta.items()) if d])
+    conn.executemany(
+        "DELETE FROM STATS_COUNT WHERE mode = ? AND dim = ? AND key_id = ? "
+        "AND key_label = ? AND cnt <= 0",
+        [k for k, d in sorted(delta.items()) if d < 0])
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+Shared fixtures: the backend runs on a database built from the small dump
+of tests/data (Themes.csv, positions.csv) in a temporary directory, never
+on data/csr.db.
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+
+import pytest
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+sys.path.insert(0, BACKEND)
+# Read by db.py / init_db.py at import time
+os.environ["CSR_DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="csr-tests-"), "csr.db")
+
+import init_db  # noqa: E402
+
+init_db.DATA_DIR = FIXTURES
+
+
+def backup(src, dst):
+    """Copy a database with the backup API (a plain file copy misses the WAL)."""
+    s = sqlite3.connect(src)
+    d = sqlite3.connect(dst)
+    s.backup(d)
+    s.close()
+    d.close()
+
+
+@pytest.fixture(scope="session")
+def app():
+    import app as app_module
+    import db
+    assert db.wait_ready(60)
+    return app_module.app
+
+
+@pytest.fixture()
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture()
+def auth(client):
+    """Authorization header of the admin user."""
+    r = client.post("/api/login", json={"username": "admin", "password": "admin"})
+    return {"Authorization": "Bearer " + r.get_json()["access_token"]}
+
+
+@pytest.fixture(scope="session")
+def built_db(tmp_path_factory):
+    """Path of a database freshly built from the fixture dump (read only)."""
+    path = str(tmp_path_factory.mktemp("built") / "csr.db")
+    init_db.build(path)
+    return path
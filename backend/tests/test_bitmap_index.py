@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""Bitset engine of the CSR queries (bitmap_index.py) against the SQL one."""
+import json
+import random
+
+import pytest
+
+import bitmap_index
+from db import data_version, fetch_all
+
+STRUCTURES = [3, 11, 17, 99999]
+THEMES = [1, 2, 10, 11, 20, 100, 101, 110, 111, 200, 99999]
+
+
+def random_body(rng, qid, params):
+    body = {}
+    for name in list(params) + ["structure_ids", "include_structures", "exclude_structures"]:
+        if name in ("theme_ids", "exclude_theme_ids"):
+            body[name] = rng.sample(THEMES, rng.randint(0, 3))
+        elif name in ("structure_ids", "include_structures", "exclude_structures"):
+            # '*' only means "any structure" to themes_in_structures
+            star = qid == "themes_in_structures" and name == "structure_ids" and rng.random() < .1
+            body[name] = ["*"] if star else rng.sample(STRUCTURES, rng.randint(0, 2))
+        elif name == "structure_id":
+            body[name] = rng.choice(STRUCTURES + [None])
+        elif name == "person_id":
+            body[name] = rng.randint(1, 6)
+        elif name == "root_theme_id":
+            body[name] = rng.choice(THEMES + [None])
+        elif name == "match":
+            body[name] = rng.choice(["ANY", "ALL"])
+        elif name == "include_desc":
+            body[name] = rng.choice([True, False])
+        elif name == "role":
+            body[name] = rng.choice(["Expert", "Contributeur", "Utilisateur", "*"])
+        elif name == "temporalite":
+            body[name] = rng.choice(["Présent", "Passé", "*"])
+        elif name == "mode":
+            body[name] = rng.choice(["MANU", "AUTO", "*"])
+    return body
+
+
+def rows(r):
+    return sorted(json.dumps(row, sort_keys=True) for row in r.get_json())
+
+
+@pytest.mark.parametrize("qid", ["people_with_no_theme", "people_by_themes",
+                                 "people_by_themes_excluding", "people_of_structure_by_themes",
+                                 "people_of_structure_by_themes_excluding", "themes_in_structures",
+                                 "themes_not_in_structures", "themes_in_S_not_in_Sp",
+                                 "subthemes_of_X_in_S", "subthemes_of_X_not_in_S"])
+def test_bitmap_engine_matches_sql(app, client, auth, monkeypatch, qid):
+    import app as app_module
+    assert qid in app_module.BITMAP_QUERIES
+    rng = random.Random(qid)
+    for _ in range(40):
+        body = random_body(rng, qid, app_module.CSR_QUERIES[qid]["params"])
+        out = {}
+        for engine in ("sql", "bitmap"):
+            monkeypatch.setattr(app_module, "SET_ENGINE", engine)
+            r = client.post(f"/api/queries/{qid}", json=body, headers=auth)
+            assert r.status_code == 200, (engine, body)
+            out[engine] = rows(r)
+        assert out["bitmap"] == out["sql"], body
+
+
+def test_snapshot_version_matches_its_rows(app):
+    bm = bitmap_index.get_bitmaps()
+    assert bm.version == data_version()
+    persons = {r["p"] for r in fetch_all("SELECT DISTINCT IDPERS AS p FROM POSITIONS", {})}
+    assert set(bm.person_ids) == persons
+
+
+def test_rebuild_runs_outside_the_lock(app, monkeypatch):
+    load = bitmap_index._load
+    held = []
+
+    def spy(themes):
+        held.append(bitmap_index._lock.locked())
+        return load(themes)
+
+    monkeypatch.setattr(bitmap_index, "_bitmaps", None)
+    monkeypatch.setattr(bitmap_index, "_load", spy)
+    bm = bitmap_index.get_bitmaps()
+    assert held == [False]
+    assert bitmap_index.get_bitmaps() is bm
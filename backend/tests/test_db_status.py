@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+"""Readiness of the API while db._ensure_db() rebuilds the database."""
+import sqlite3
+
+import db
+import init_db
+from conftest import backup
+
+
+def test_obsolete_schema_answers_503_until_rebuilt(app, client, auth, built_db, tmp_path, monkeypatch):
+    path = str(tmp_path / "csr.db")
+    backup(built_db, path)
+    conn = sqlite3.connect(path)
+    conn.execute("UPDATE DB_META SET value = '7' WHERE key = 'schema_version'")
+    conn.commit()
+    conn.close()
+    monkeypatch.setattr(db, "DB_PATH", path)
+    monkeypatch.setattr(init_db, "DB_PATH", path)
+    started = []
+    monkeypatch.setattr(db, "_start_worker", lambda state, job: started.append(state))
+
+    try:
+        db._ensure_db()
+        assert started == ["building"]
+        assert not db.ready()
+        assert client.get("/api/stats/overview", headers=auth).status_code == 503
+        assert client.get("/api/health").status_code == 200
+    finally:
+        db._set_status(ready=True, state="ready")
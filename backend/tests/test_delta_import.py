@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""Hierarchy changes of Themes.csv through the differential import
+(init_db.delta_import) against a full build of the same dump."""
+import shutil
+import sqlite3
+
+import init_db
+from conftest import FIXTURES, backup
+
+
+def snapshot(conn):
+    return {
+        "closure": set(conn.execute("SELECT * FROM THEME_CLOSURE")),
+        "themes": set(conn.execute("SELECT * FROM THEMES")),
+        "positions": set(conn.execute("""
+            SELECT IDPERS, CODE_CONTRIBUTION, CODE_TEMPORALITE, IDTHEME, IDSTRUCTURE, AUTO, SOURCE_COUNT
+            FROM POSITIONS""")),
+        "stats": set(conn.execute("SELECT * FROM STATS_COUNT")),
+    }
+
+
+def test_moved_subtree_matches_full_build(built_db, tmp_path, monkeypatch):
+    dump = tmp_path / "dump"
+    shutil.copytree(FIXTURES, dump)
+    themes = (dump / "Themes.csv").read_text(encoding="utf-8")
+    # "Statistiques" (and its subtree) moves under "Informatique", "Sécurité
+    # des réseaux" under "Apprentissage automatique"
+    (dump / "Themes.csv").write_text(
+        themes.replace('20,"Statistiques",1,2', '20,"Statistiques",1,1')
+              .replace('111,"Sécurité des réseaux",2,11', '111,"Sécurité des réseaux",2,10'),
+        encoding="utf-8")
+    monkeypatch.setattr(init_db, "DATA_DIR", str(dump))
+
+    path = str(tmp_path / "csr.db")
+    backup(built_db, path)
+    conn = sqlite3.connect(path)
+    assert init_db.delta_import(conn) > 0
+
+    fresh = str(tmp_path / "fresh.db")
+    init_db.build(fresh)
+    want = sqlite3.connect(fresh)
+    assert snapshot(conn) == snapshot(want)
+    assert (conn.execute("SELECT value FROM DB_META WHERE key = 'themes_version'").fetchone()
+            == want.execute("SELECT value FROM DB_META WHERE key = 'themes_version'").fetchone())
+    conn.close()
+    want.close()
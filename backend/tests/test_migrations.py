@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""In-place migrations (init_db.migrate) from the former schema versions."""
+import sqlite3
+from collections import Counter
+
+import pytest
+
+import init_db
+import propagation
+import stats_tables
+from conftest import backup
+
+# POSITIONNEMENT as a table, before schema 16 (SOURCE_HASH from 13,
+# SOURCE_COUNT from 14)
+LEGACY_TABLE = """
+CREATE TABLE POSITIONNEMENT_LEGACY (
+    ROWID_POS          INTEGER PRIMARY KEY AUTOINCREMENT,
+    IDPERS             INTEGER NOT NULL,
+    IDCONTRIBUTION     INTEGER,
+    LIBCONTRIBUTION    TEXT,
+    IDTEMPORALITE      INTEGER,
+    LIBELLETEMPORALITE TEXT,
+    IDTHEME            INTEGER NOT NULL,
+    LIBELLETHEME       TEXT,
+    IDSTRUCTURE        INTEGER,
+    LIBELLESTRUCTURE   TEXT,
+    IDTYPESTRUCTURE    INTEGER,
+    LIBELLETYPESTRUCTURE TEXT,
+    IDSTRUCTUREPARENTE  INTEGER,
+    LIBELLESTRUCTUREPARENTE TEXT,
+    AUTO_GENERE        TEXT DEFAULT NULL{extra}
+)
+"""
+LEGACY_COLUMNS = """ROWID_POS, IDPERS, IDCONTRIBUTION, LIBCONTRIBUTION, IDTEMPORALITE,
+    LIBELLETEMPORALITE, IDTHEME, LIBELLETHEME, IDSTRUCTURE, LIBELLESTRUCTURE,
+    IDTYPESTRUCTURE, LIBELLETYPESTRUCTURE, IDSTRUCTUREPARENTE, LIBELLESTRUCTUREPARENTE,
+    AUTO_GENERE"""
+
+# Manual position "added through the API": not in the dump
+API_POSITION = (5, 1, "Expert", 1, "Présent", 200, 17, "ADRIA lib")
+
+
+def add_api_position(conn):
+    """Insert API_POSITION into POSITIONS with its propagation."""
+    pid, contr, libcontr, temp, libtemp, tid, sid, libstruct = API_POSITION
+    codes = init_db.label_codes.LabelCodes(conn)
+    conn.execute("""
+        INSERT INTO POSITIONS (IDPERS, IDCONTRIBUTION, CODE_CONTRIBUTION, IDTEMPORALITE,
+                               CODE_TEMPORALITE, IDTHEME, IDSTRUCTURE, CODE_STRUCTURE)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """, (pid, contr, codes.code(libcontr), temp, codes.code(libtemp), tid, sid, codes.code(libstruct)))
+    propagation.propagate(conn, [pid])
+    stats_tables.refresh_persons(conn, [pid])
+    conn.commit()
+
+
+def downgrade(conn, version):
+    """Turn a current database into the layout of schema `version`."""
+    v = int(version)
+    extra = ""
+    if v >= 13:
+        extra += ",\n    SOURCE_HASH TEXT DEFAULT NULL"
+    if v >= 14:
+        extra += ",\n    SOURCE_COUNT INTEGER DEFAULT NULL"
+    conn.execute(LEGACY_TABLE.format(extra=extra))
+    columns = LEGACY_COLUMNS + "".join(
+        f", {c}" for c, since in (("SOURCE_HASH", 13), ("SOURCE_COUNT", 14)) if v >= since)
+    conn.execute(f"INSERT INTO POSITIONNEMENT_LEGACY ({columns}) "
+                 f"SELECT {columns} FROM POSITIONNEMENT ORDER BY ROWID_POS")
+    for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'").fetchall():
+        conn.execute(f"DROP TRIGGER {name}")
+    conn.execute("DROP VIEW POSITIONNEMENT")
+    conn.execute("DROP TABLE POSITIONS")
+    conn.execute("DROP TABLE LABELS")
+    conn.execute("ALTER TABLE POSITIONNEMENT_LEGACY RENAME TO POSITIONNEMENT")
+    dropped = ["STRUCTURE_LABELS", "PERSONNE_FTS", "THEMES_FTS", "STRUCTURES_FTS"] if v < 15 else []
+    if v < 12:
+        dropped += ["STATS_MEMBER", "STATS_COUNT"]
+    if v < 10:
+        dropped.append("THEME_CLOSURE")
+    for table in dropped:
+        conn.execute(f"DROP TABLE {table}")
+    conn.execute("DELETE FROM DB_META WHERE key NOT IN ('schema_version', 'themes_version')")
+    if v < 9:
+        conn.execute("DELETE FROM DB_META WHERE key = 'themes_version'")
+    conn.execute("UPDATE DB_META SET value = ? WHERE key = 'schema_version'", (version,))
+    conn.commit()
+
+
+def snapshot(conn):
+    return {
+        "positions": Counter(conn.execute(f"""
+            SELECT {LEGACY_COLUMNS.replace("ROWID_POS, ", "")},
+                   SOURCE_HASH IS NOT NULL, SOURCE_COUNT
+            FROM POSITIONNEMENT""")),
+        "stats": set(conn.execute("SELECT * FROM STATS_COUNT")),
+        "closure": set(conn.execute("SELECT * FROM THEME_CLOSURE")),
+        "structure_labels": set(conn.execute("SELECT * FROM STRUCTURE_LABELS")),
+        "persons_fts": conn.execute("SELECT COUNT(*) FROM PERSONNE_FTS").fetchone()[0],
+    }
+
+
+@pytest.fixture(scope="module")
+def expected(built_db, tmp_path_factory):
+    """The built database plus API_POSITION, as a full recompute sees it."""
+    path = str(tmp_path_factory.mktemp("expected") / "csr.db")
+    backup(built_db, path)
+    conn = sqlite3.connect(path)
+    add_api_position(conn)
+    yield snapshot(conn), dict(conn.execute("SELECT key, value FROM DB_META"))
+    conn.close()
+
+
+@pytest.mark.parametrize("version", ["8", "12", "13", "15"])
+def test_migrate_keeps_api_positions(built_db, expected, tmp_path, version):
+    path = str(tmp_path / "csr.db")
+    backup(built_db, path)
+    conn = sqlite3.connect(path)
+    add_api_position(conn)
+    downgrade(conn, version)
+
+    assert init_db.migrate(conn)
+    init_db.delta_import(conn)
+
+    want, want_meta = expected
+    assert snapshot(conn) == want
+    meta = dict(conn.execute("SELECT key, value FROM DB_META"))
+    for key in ("schema_version", "themes_version", "persons_version"):
+        assert meta[key] == want_meta[key]
+    conn.close()
+
+
+def test_migrate_tags_dump_rows_only(built_db, tmp_path):
+    path = str(tmp_path / "csr.db")
+    backup(built_db, path)
+    conn = sqlite3.connect(path)
+    add_api_position(conn)
+    downgrade(conn, "8")
+
+    assert init_db.migrate(conn)
+    untagged = conn.execute(
+        "SELECT IDPERS, IDTHEME FROM POSITIONS WHERE AUTO = 0 AND SOURCE_HASH IS NULL").fetchall()
+    assert untagged == [(API_POSITION[0], API_POSITION[5])]
+    conn.close()
+
+
+@pytest.mark.parametrize("version", [None, "7", "x"])
+def test_migrate_refuses_unversioned_or_older(built_db, tmp_path, version):
+    path = str(tmp_path / "csr.db")
+    backup(built_db, path)
+    conn = sqlite3.connect(path)
+    conn.execute("DELETE FROM DB_META WHERE key = 'schema_version'")
+    if version is not None:
+        conn.execute("INSERT INTO DB_META (key, value) VALUES ('schema_version', ?)", (version,))
+    conn.commit()
+    assert not init_db.migrate(conn)
+    conn.close()
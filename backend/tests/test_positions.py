@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""Position writes (POST/DELETE /api/positions, POST /api/positions/bulk)."""
+import sqlite3
+
+import pytest
+
+import db
+import propagation
+import stats_tables
+from conftest import backup
+
+OPERATIONS = [
+    {"op": "add", "idpers": 4, "idtheme": 111, "libcontr": "Expert", "libtemp": "Présent"},
+    {"op": "add", "idpers": 6, "idtheme": 200, "libcontr": "Contributeur", "libtemp": "Présent",
+     "idstruct": 17},
+    {"op": "add", "idpers": 6, "idtheme": 999, "libcontr": "Expert", "libtemp": "Présent"},
+]
+
+
+def derived(conn):
+    """Auto rows and STATS_* aggregates, as the incremental paths keep them."""
+    return {
+        "auto": set(conn.execute("""
+            SELECT IDPERS, CODE_CONTRIBUTION, CODE_TEMPORALITE, IDTHEME, IDSTRUCTURE, SOURCE_COUNT
+            FROM POSITIONS WHERE AUTO = 1""")),
+        "member": set(conn.execute("SELECT * FROM STATS_MEMBER")),
+        "count": set(conn.execute("SELECT * FROM STATS_COUNT")),
+    }
+
+
+def recomputed(tmp_path):
+    """derived() of a copy of the served database after a full recompute."""
+    path = str(tmp_path / "recomputed.db")
+    backup(db.DB_PATH, path)
+    conn = sqlite3.connect(path)
+    propagation.propagate(conn)
+    stats_tables.rebuild(conn)
+    out = derived(conn)
+    conn.close()
+    return out
+
+
+def served():
+    conn = sqlite3.connect(db.DB_PATH)
+    out = derived(conn)
+    conn.close()
+    return out
+
+
+@pytest.mark.parametrize("body", [[OPERATIONS[0]], "operations", 3])
+def test_bulk_rejects_non_object_body(client, auth, body):
+    assert client.post("/api/positions/bulk", json=body, headers=auth).status_code == 400
+
+
+def test_bulk_rejects_non_list_operations(client, auth):
+    r = client.post("/api/positions/bulk", json={"operations": OPERATIONS[0]}, headers=auth)
+    assert r.status_code == 400
+
+
+def test_bulk_matches_full_recompute(client, auth, tmp_path):
+    r = client.post("/api/positions/bulk", json={"operations": OPERATIONS}, headers=auth)
+    assert r.status_code == 200
+    assert r.get_json()["applied"] == 2
+    assert [res["ok"] for res in r.get_json()["results"]] == [True, True, False]
+    try:
+        assert served() == recomputed(tmp_path)
+    finally:
+        deletes = [dict(op, op="delete") for op in OPERATIONS[:2]]
+        r = client.post("/api/positions/bulk", json={"operations": deletes}, headers=auth)
+        assert r.get_json()["applied"] == 2
+    assert served() == recomputed(tmp_path)
+
+
+@pytest.mark.parametrize("position", [
+    {"idpers": 1, "idtheme": 101, "libcontr": "Expert", "libtemp": "Présent"},
+    {"idpers": 2, "idtheme": 110, "libcontr": "Utilisateur", "libtemp": "Passé", "idstruct": 3},
+])
+def test_source_counts_match_full_recompute(client, auth, tmp_path, position):
+    """add_sources / remove_sources only walk the ancestors of the theme."""
+    assert client.post("/api/positions", json=position, headers=auth).status_code == 200
+    try:
+        assert served() == recomputed(tmp_path)
+    finally:
+        assert client.delete("/api/positions", json=position, headers=auth).status_code == 200
+    assert served() == recomputed(tmp_path)
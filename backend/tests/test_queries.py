@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+"""CSR query builders (POST /api/queries/<id>) on the SQL engine."""
+import pytest
+
+
+@pytest.fixture()
+def run(client, auth, monkeypatch):
+    import app as app_module
+    monkeypatch.setattr(app_module, "SET_ENGINE", "sql")
+
+    def run(qid, body):
+        r = client.post(f"/api/queries/{qid}", json=body, headers=auth)
+        assert r.status_code == 200, r.get_json()
+        return r.get_json()
+    return run
+
+
+@pytest.mark.parametrize("qid, body, other", [
+    ("themes_in_structures", {"structure_ids": [3], "match": "ANY"}, {"include_structures": [11, 17]}),
+    ("themes_in_structures", {"structure_ids": [3, 17], "match": "ANY"}, {"include_structures": [11]}),
+    ("themes_in_S_not_in_Sp", {"include_structures": [11], "exclude_structures": [17]},
+     {"structure_ids": [3, 17]}),
+])
+def test_structure_fields_bind_apart(run, qid, body, other):
+    """structure_ids and include_structures used to share the :s1... binds,
+    so a body carrying both answered for the wrong structures."""
+    alone = run(qid, body)
+    assert alone
+    assert run(qid, {**body, **other}) == alone
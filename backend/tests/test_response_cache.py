@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""Response cache of /api/stats/* and /api/themes/tree (app.cached_response)."""
+import gzip
+
+from db import fetch_all
+
+# The recursive query GET /api/themes/tree used to run
+TREE_SQL = """
+    WITH RECURSIVE theme_tree AS (
+        SELECT "CS_TH_COD#" AS id, THEME AS label, THEME_PARENT AS parent_id, NIVEAU AS lvl
+        FROM THEMES WHERE THEME_PARENT IS NULL
+        UNION ALL
+        SELECT t."CS_TH_COD#", t.THEME, t.THEME_PARENT, t.NIVEAU
+        FROM THEMES t JOIN theme_tree tt ON t.THEME_PARENT = tt.id
+    )
+    SELECT id, label, parent_id, lvl FROM theme_tree ORDER BY label, id
+"""
+
+POSITION = {"idpers": 4, "idtheme": 110, "libcontr": "Expert", "libtemp": "Présent"}
+
+
+def test_gzip_when_accepted(client, auth):
+    plain = client.get("/api/stats/overview", headers={**auth, "Accept-Encoding": "identity"})
+    r = client.get("/api/stats/overview", headers={**auth, "Accept-Encoding": "gzip"})
+    assert r.headers["Content-Encoding"] == "gzip"
+    assert gzip.decompress(r.get_data()) == plain.get_data()
+
+
+def test_gzip_refused_with_q0(client, auth):
+    r = client.get("/api/stats/overview", headers={**auth, "Accept-Encoding": "gzip;q=0, identity"})
+    assert r.status_code == 200
+    assert "Content-Encoding" not in r.headers
+    assert r.get_json()
+
+
+def test_tree_rows_match_recursive_query(client, auth):
+    assert client.get("/api/themes/tree", headers=auth).get_json() == fetch_all(TREE_SQL, {})
+
+
+def test_tree_etag_survives_position_writes(client, auth):
+    tree = client.get("/api/themes/tree", headers=auth).headers["ETag"]
+    counts = client.get("/api/themes/tree?counts=1", headers=auth).headers["ETag"]
+    assert client.post("/api/positions", json=POSITION, headers=auth).status_code == 200
+    try:
+        r = client.get("/api/themes/tree", headers={**auth, "If-None-Match": tree})
+        assert r.status_code == 304
+        r = client.get("/api/themes/tree?counts=1", headers={**auth, "If-None-Match": counts})
+        assert r.status_code == 200
+    finally:
+        assert client.delete("/api/positions", json=POSITION, headers=auth).status_code == 200
@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+"""ThemeIndex (theme_index.py) against THEME_CLOSURE."""
+from db import fetch_all
+from theme_index import get_theme_index
+
+
+def test_descendants_match_closure(app):
+    closure = {}
+    for r in fetch_all("SELECT ancestor, descendant FROM THEME_CLOSURE", {}):
+        closure.setdefault(r["ancestor"], set()).add(r["descendant"])
+    tix = get_theme_index()
+    for tid, below in closure.items():
+        assert tix.descendants([tid]) == sorted(below)
+        assert tix.descendants([tid], include_self=False) == sorted(below - {tid})
+
+
+def test_tree_rows_cover_rooted_themes(app):
+    rows = get_theme_index().tree_rows()
+    assert [r["label"] for r in rows] == sorted(r["label"] for r in rows)
+    ids = {r["id"] for r in rows}
+    assert all(r["parent_id"] is None or r["parent_id"] in ids for r in rows)
+    assert len(ids) == len(fetch_all('SELECT "CS_TH_COD#" FROM THEMES', {}))
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+theme_index.py - In-memory index of the THEMES hierarchy.
+
+The hierarchy is loaded once per process and kept as dense arrays
+(parent, children, depth) plus an Euler tour: every theme gets a
+pre-order number `pre` and the pre-order number `post` of the last
+node of its subtree, so that
+
+    descendant(a, b)  <=>  pre[b] <= pre[a] <= post[b]
+
+is an O(1) range test and the subtree of `b` is the contiguous slice
+order[pre[b] : post[b] + 1] (descendants(), PositionBitmaps.subtree()).
+
+The index is invalidated through DB_META.themes_version, written by
+init_db whenever THEMES is (re)loaded.
+"""
+import threading
+
+from db import fetch_all, fetch_one
+
+
+class ThemeIndex:
+    """Immutable snapshot of THEMES; build with ThemeIndex(rows, version)."""
+
+    def __init__(self, rows, version=None):
+        self.version = version
+        self.ids = [int(r["id"]) for r in rows]
+        self.pos = {tid: i for i, tid in enumerate(self.ids)}
+        self.labels = [r["label"] for r in rows]
+        self.niveau = [r.get("niveau") for r in rows]
+
+        n = len(self.ids)
+        self.parent = [-1] * n
+        self.children = [[] for _ in range(n)]
+        for i, r in enumerate(rows):
+            pid = r["parent_id"]
+            if pid is not None and int(pid) in self.pos:
+                p = self.pos[int(pid)]
+                self.parent[i] = p
+                self.children[p].append(i)
+        # A parent id that does not exist in THEMES breaks the chain to
+        # the root (the recursive CTEs behaved the same way).
+        self._dangling = [r["parent_id"] is not None and int(r["parent_id"]) not in self.pos
+                          for r in rows]
+
+        # Euler tour (iterative DFS, children visited by id for stability)
+        for ch in self.children:
+            ch.sort(key=lambda c: self.ids[c])
+        self.pre = [-1] * n
+        self.post = [-1] * n
+        self.depth = [0] * n
+        self.order = []
+        roots = sorted((i for i in range(n) if self.parent[i] == -1),
+                       key=lambda i: self.ids[i])
+        for root in roots:
+            stack = [(root, False)]
+            while stack:
+                node, done = stack.pop()
+                if done:
+                    self.post[node] = len(self.order) - 1
+                    continue
+                self.pre[node] = len(self.order)
+                self.order.append(node)
+                stack.append((node, True))
+                for c in reversed(self.children[node]):
+                    self.depth[c] = self.depth[node] + 1
+                    stack.append((c, False))
+        self._paths = {}
+
+    # ── Lookups ─────────────────────────────────────────────────────
+    def __contains__(self, tid):
+        return tid in self.pos
+
+    def __len__(self):
+        return len(self.ids)
+
+    def label(self, tid):
+        i = self.pos.get(tid)
+        return self.labels[i] if i is not None else None
+
+    def leaves(self):
+        return [self.ids[i] for i in range(len(self.ids)) if not self.children[i]]
+
+    # ── Closures ────────────────────────────────────────────────────
+    def descendants(self, tids, include_self=True):
+        """Sorted ids of every theme in the subtrees of `tids`."""
+        out = set()
+        for tid in tids:
+            i = self.pos.get(int(tid))
+            if i is None or self.pre[i] < 0:
+                continue
+            lo = self.pre[i] if include_self else self.pre[i] + 1
+            out.update(self.ids[j] for j in self.order[lo:self.post[i] + 1])
+        return sorted(out)
+
+    def tree_rows(self):
+        """{id, label, parent_id, lvl} of the themes reachable from a root
+        (THEME_PARENT NULL), ordered by label: the rows of
+        GET /api/themes/tree."""
+        rows = []
+        for root in range(len(self.ids)):
+            if self.parent[root] != -1 or self._dangling[root]:
+                continue
+            for i in self.order[self.pre[root]:self.post[root] + 1]:
+                p = self.parent[i]
+                rows.append({"id": self.ids[i], "label": self.labels[i],
+                             "parent_id": self.ids[p] if p != -1 else None,
+                             "lvl": self.niveau[i]})
+        rows.sort(key=lambda r: (r["label"], r["id"]))
+        return rows
+
+    def root_path(self, tid, sep=" › "):
+        """Labels from the root down to `tid`, joined with `sep`."""
+        if tid in self._paths:
+            return self._paths[tid]
+        i = self.pos.get(tid)
+        path = None
+        if i is not None:
+            chain = []
+            while i != -1:
+                chain.append(i)
+                last = i
+                i = self.parent[i]
+            if not self._dangling[last]:
+                path = sep.join(self.labels[j] for j in reversed(chain))
+        self._paths[tid] = path
+        return path
+
+
+_lock = threading.Lock()
+_index = None
+
+
+def _themes_version():
+    row = fetch_one("SELECT value FROM DB_META WHERE key = 'themes_version'", {})
+    return row["value"] if row else None
+
+
+def get_theme_index():
+    """Return the process-wide ThemeIndex, reloading it if THEMES changed."""
+    global _index
+    version = _themes_version()
+    idx = _index
+    if idx is not None and idx.version == version:
+        return idx
+    with _lock:
+        if _index is None or _index.version != version:
+            rows = fetch_all("""
+                SELECT "CS_TH_COD#" AS id, THEME AS label,
+                       THEME_PARENT AS parent_id, NIVEAU AS niveau
+                FROM THEMES
+            """, {})
+            _index = ThemeIndex(rows, version)
+        return _index
+
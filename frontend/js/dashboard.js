@@ -95,9 +95,9 @@ function enableZoom(canvas, chart, title = "") {
 }
 
   // ========== KPIs ==========
-  async function loadKPIs(){
+  async function loadKPIs(pre){
     try{
-      const o = await api("/api/stats/overview" + modeParam());
+      const o = pre ?? await api("/api/stats/overview" + modeParam());
       // tolérant aux champs
       const set = (id, v) => { const el=document.getElementById(id); if(el) el.textContent = (v ?? "—"); };
       const peopleTotal   = o.people_present ?? (typeof o.people_total==="number" && typeof o.non_positionnes==="number" ? o.people_total - o.non_positionnes : o.people_total);
@@ -111,9 +111,9 @@ function enableZoom(canvas, chart, title = "") {
 
   // ========== Top charts ==========
   const charts = {};
-  async function loadTopCharts(){
+  async function loadTopCharts(pre){
     try{
-      const themes = await api("/api/stats/top/themes?limit=10&mode=" + getMode());
+      const themes = pre ?? await api("/api/stats/top/themes?limit=10&mode=" + getMode());
       const c1 = document.getElementById("chTopThemes")?.getContext("2d");
       if (c1){
         const chart = new Chart(c1, {
@@ -131,9 +131,9 @@ function enableZoom(canvas, chart, title = "") {
   }
 
   // ========== Thèmes sans expert ==========
-  async function loadThemesNoExpert(){
+  async function loadThemesNoExpert(pre){
     try{
-      const rows = await api("/api/stats/themes_no_expert" + modeParam());
+      const rows = pre ?? await api("/api/stats/themes_no_expert" + modeParam());
       const box = document.getElementById("noExpertList");
       if (!box || !rows?.length) return;
       const hdr = `<table style="width:100%; border-collapse:collapse; font-size:12px;">
@@ -390,9 +390,9 @@ function enableZoom(canvas, chart, title = "") {
   }
 
   // ========== Distribution thèmes par personne ==========
-  async function loadThemesPerPerson(){
+  async function loadThemesPerPerson(pre){
     try{
-      const rows = await api("/api/stats/themes_per_person" + modeParam());
+      const rows = pre ?? await api("/api/stats/themes_per_person" + modeParam());
       const ctx = document.getElementById("chThemeDist")?.getContext("2d");
       if (ctx && rows?.length){
         const chart = new Chart(ctx, {
@@ -416,9 +416,9 @@ function enableZoom(canvas, chart, title = "") {
   }
 
   // ========== Effectifs par structure (toutes) ==========
-  async function loadAllStructures(){
+  async function loadAllStructures(pre){
     try{
-      const rows = await api("/api/stats/all_structures" + modeParam());
+      const rows = pre ?? await api("/api/stats/all_structures" + modeParam());
       const ctx = document.getElementById("chAllStructs")?.getContext("2d");
       if (ctx && rows?.length){
         const chart = new Chart(ctx, {
@@ -449,9 +449,9 @@ function enableZoom(canvas, chart, title = "") {
   }
 
   // ========== Couverture thématique niveau 1 ==========
-  async function loadThemesCoverage(){
+  async function loadThemesCoverage(pre){
     try{
-      const rows = await api("/api/stats/themes_coverage" + modeParam());
+      const rows = pre ?? await api("/api/stats/themes_coverage" + modeParam());
       const ctx = document.getElementById("chThemesCoverage")?.getContext("2d");
       if (ctx && rows?.length){
         const chart = new Chart(ctx, {
@@ -622,9 +622,9 @@ function enableZoom(canvas, chart, title = "") {
     const pick = (r, ...names) => { for (const n of names) if (r?.[n] !== undefined) return r[n]; };
 
     // ===================== NOUVEAUX WIDGETS =====================
-    async function loadTopStructuresDiversity() {
+    async function loadTopStructuresDiversity(pre) {
       try {
-        const rows = await api("/api/stats/top_structures_diversity" + modeParam());
+        const rows = pre ?? await api("/api/stats/top_structures_diversity" + modeParam());
         const box = document.getElementById("topStructuresDivList");
         if (!box || !rows?.length) return;
         const hdr = `<table style="width:100%; border-collapse:collapse; font-size:12px;">
@@ -644,9 +644,9 @@ function enableZoom(canvas, chart, title = "") {
       } catch(e){}
     }
 
-    async function loadTopResearchers() {
+    async function loadTopResearchers(pre) {
       try {
-        const rows = await api("/api/stats/top_researchers" + modeParam());
+        const rows = pre ?? await api("/api/stats/top_researchers" + modeParam());
         const box = document.getElementById("topResearchersList");
         if (!box || !rows?.length) return;
         const anonNote = !isAdmin() ? `<div style="margin-bottom:8px;padding:4px 10px;background:rgba(251,191,36,.1);color:#fbbf24;border-radius:6px;font-size:11px;">
@@ -672,17 +672,33 @@ function enableZoom(canvas, chart, title = "") {
 
 
   // ========== Init ==========
-    function bootDashboardOnce() {
+    // Tous les widgets en un seul appel (POST /api/stats/dashboard) ;
+    // un widget absent de la réponse retombe sur son endpoint dédié.
+    const DASHBOARD_WIDGETS = [
+      "overview", { id: "top/themes", limit: 10 }, "themes_no_expert", "themes_per_person",
+      "all_structures", "themes_coverage", "top_structures_diversity", "top_researchers"
+    ];
+    async function fetchDashboard() {
+      try {
+        const r = await api("/api/stats/dashboard", {
+          method: 'POST', body: JSON.stringify({ mode: getMode(), widgets: DASHBOARD_WIDGETS })
+        });
+        return r?.widgets || {};
+      } catch(e) { return {}; }
+    }
+
+    async function bootDashboardOnce() {
       if (bootDashboardOnce._did) return;
       bootDashboardOnce._did = true;
-      loadKPIs().catch(()=>{});
-      loadTopCharts().catch(()=>{});
-      loadThemesNoExpert().catch(()=>{});
-      loadThemesPerPerson().catch(()=>{});
-      loadAllStructures().catch(()=>{});
-      loadThemesCoverage().catch(()=>{});
-      loadTopStructuresDiversity().catch(()=>{});
-      loadTopResearchers().catch(()=>{});
+      const w = await fetchDashboard();
+      loadKPIs(w["overview"]).catch(()=>{});
+      loadTopCharts(w["top/themes"]).catch(()=>{});
+      loadThemesNoExpert(w["themes_no_expert"]).catch(()=>{});
+      loadThemesPerPerson(w["themes_per_person"]).catch(()=>{});
+      loadAllStructures(w["all_structures"]).catch(()=>{});
+      loadThemesCoverage(w["themes_coverage"]).catch(()=>{});
+      loadTopStructuresDiversity(w["top_structures_diversity"]).catch(()=>{});
+      loadTopResearchers(w["top_researchers"]).catch(()=>{});
     }
 
     // Au chargement: uniquement si déjà connecté